@@ -1,22 +1,51 @@
-import React, { useState } from 'react';
+import React, { useState, useEffect } from 'react';
+import axios from 'axios';
 import { BrowserRouter as Router, Routes, Route, Navigate } from 'react-router-dom';
 import MyLoginPage from './pages/MyLoginPage';
 import MyRegistrationPage from './pages/MyRegistrationPage';
 import MyUserPortal from './pages/MyUserPortal';
 import ForgotMyPassword from './pages/ForgotMyPassword';
+import API_URL from './config';
 import './App.css';
 
+// Send the session token from /user/login with every request
+const setSessionToken = (token) => {
+  if (token) {
+    axios.defaults.headers.common['Authorization'] = `Bearer ${token}`;
+  } else {
+    delete axios.defaults.headers.common['Authorization'];
+  }
+};
+
 function App() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
   const [user, setUser] = useState(null);
 
+  // Expired token, or a project joined after login: refresh once and retry
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(null, async (error) => {
+      const original = error.config;
+      if (error.response && error.response.data && error.response.data.tokenRefresh && !original._retried) {
+        original._retried = true;
+        const refreshed = await axios.post(`${API_URL}/user/token/refresh`);
+        setSessionToken(refreshed.data.token);
+        original.headers['Authorization'] = `Bearer ${refreshed.data.token}`;
+        return axios(original);
+      }
+      return Promise.reject(error);
+    });
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   const handleLogin = (userData) => {
+    setSessionToken(userData.token);
     setIsAuthenticated(true);
     setUser(userData);
     console.log('User logged in:', userData);
   };
 
   const handleLogout = () => {
+    setSessionToken(null);
     setIsAuthenticated(false);
     setUser(null);
     console.log('User logged out');
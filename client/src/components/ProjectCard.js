@@ -5,7 +5,7 @@ import { Button, TextField, Checkbox } from "@mui/material";
 import HWSetStatus from "./HWSetStatus";
 import UserBanner from "./UserBanner";
 
-function ProjectCard({ name, users = [], hwSets = {}, username, onUserJoined }) {
+function ProjectCard({ name, users = [], hwSets = {}, username, onUserJoined, onHardwareChanged }) {
   const [qty, setQty] = useState("");
   const [isJoining, setIsJoining] = useState(false);
   const [message, setMessage] = useState("");
@@ -38,7 +38,7 @@ function ProjectCard({ name, users = [], hwSets = {}, username, onUserJoined })
 
       if (res.data.success) {
         setMessage("✅ Joined project successfully");
-        if (onUserJoined) onUserJoined();
+        if (onUserJoined) onUserJoined(res);
       } else {
         setMessage(`❌ ${res.data.message || "Failed to join project"}`);
       }
@@ -90,7 +90,9 @@ function ProjectCard({ name, users = [], hwSets = {}, username, onUserJoined })
             action === "checkin" ? "checked in" : "checked out"
           } ${processed} of ${selectedHW}`
         );
-        if (onUserJoined) onUserJoined();
+        // The parent skips the refetch when its inventory stream carries this change
+        if (onHardwareChanged) onHardwareChanged(res);
+        else if (onUserJoined) onUserJoined(res);
         setQty("");
       } else {
         setMessage(`❌ ${res.data.message || "Action failed"}`);
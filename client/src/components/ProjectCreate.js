@@ -73,7 +73,7 @@ function ProjectCreate({ hardware = [], onProjectUpdated }) {
         setProjectName("");
         setDescription("");
         setHardwareSets([{ name: "", quantity: "" }]);
-        if (onProjectUpdated) onProjectUpdated(); // 🔹 notify parent
+        if (onProjectUpdated) onProjectUpdated(response); // 🔹 notify parent
       } else {
         setMessage(`❌ ${response.data.message}`);
       }
@@ -1,7 +1,7 @@
 import React from "react";
 import ProjectCard from "./ProjectCard";
 
-function Projects({ nameQuery, projects = [], username, onUserJoined, showMyProjects }) {
+function Projects({ nameQuery, projects = [], username, onUserJoined, onHardwareChanged, showMyProjects }) {
   //const filtered = projects.filter((p) => {
     // const matchesName = (p.projectName)
     //   .toLowerCase()
@@ -58,6 +58,7 @@ function Projects({ nameQuery, projects = [], username, onUserJoined, showMyProj
             hwSets={proj.hwSets}
             username={username}
             onUserJoined={onUserJoined}
+            onHardwareChanged={onHardwareChanged}
           />
         ))
       ) : (
@@ -71,15 +71,115 @@ const MyUserPortal = ({ response, onLogout }) => {
     }
   };
 
-  const handleProjectUpdated = async () => {
+  // True while the inventory event stream is connected
+  const [live, setLive] = useState(false);
+  // Server process behind the stream ("shared" when it carries every worker's writes)
+  const [streamOrigin, setStreamOrigin] = useState(null);
+
+  // After one of our own writes: the stream only delivers its delta when the
+  // same process made the write (or events are shared); otherwise refetch
+  const streamCarries = (res) =>
+    live && streamOrigin !== null && res?.headers?.["x-inventory-origin"] === streamOrigin;
+
+  const handleProjectUpdated = async (res) => {
+    if (streamCarries(res)) return;  // the stream delivers the change
     await fetchProjects();   // refresh project list
     await fetchHardware();   // refresh hardware list
   };
 
+  const handleHardwareChanged = (res) => {
+    if (!streamCarries(res)) fetchProjects();
+  };
+
+  // Apply one delta from GET /events/inventory to the local lists
+  const applyInventoryEvent = (event) => {
+    switch (event.type) {
+      case "hardwareCreated":
+        setHardware((prev) =>
+          prev.some((hw) => hw.hwName === event.hwName)
+            ? prev
+            : [...prev, { hwName: event.hwName, capacity: event.capacity, availability: event.availability }]
+        );
+        break;
+      case "projectCreated":
+        setProjects((prev) =>
+          prev.some((proj) => proj.projectName === event.projectName)
+            ? prev
+            : [...prev, {
+                projectName: event.projectName,
+                description: event.description,
+                users: event.users,
+                hwSets: event.hwSets,
+              }]
+        );
+        // Each set's capacity was reserved from the global pool
+        setHardware((prev) =>
+          prev.map((hw) =>
+            event.hwSets[hw.hwName]
+              ? { ...hw, availability: hw.availability - event.hwSets[hw.hwName].capacity }
+              : hw
+          )
+        );
+        break;
+      case "connected":
+        setStreamOrigin(event.origin);
+        break;
+      case "userAdded":
+        setProjects((prev) =>
+          prev.map((proj) =>
+            proj.projectName === event.projectName && !proj.users.includes(event.username)
+              ? { ...proj, users: [...proj.users, event.username] }
+              : proj
+          )
+        );
+        break;
+      case "checkout":
+      case "checkin": {
+        const delta = event.type === "checkout" ? event.qty : -event.qty;
+        setProjects((prev) =>
+          prev.map((proj) => {
+            const hwInfo = proj.projectName === event.projectName && proj.hwSets[event.hwName];
+            if (!hwInfo) return proj;
+            const userUsage = hwInfo.user_usage || {};
+            return {
+              ...proj,
+              hwSets: {
+                ...proj.hwSets,
+                [event.hwName]: {
+                  ...hwInfo,
+                  used: hwInfo.used + delta,
+                  user_usage: {
+                    ...userUsage,
+                    [event.username]: (userUsage[event.username] || 0) + delta,
+                  },
+                },
+              },
+            };
+          })
+        );
+        break;
+      }
+      default:
+        // "resync": events were missed, start over from the full lists
+        fetchProjects();
+        fetchHardware();
+    }
+  };
 
   useEffect(() => {
     fetchProjects();
     fetchHardware();
+
+    if (typeof EventSource === "undefined") return undefined;
+    // Reconnects by itself and resumes from the last event id
+    const source = new EventSource(`${API_URL}/events/inventory`);
+    source.onopen = () => setLive(true);
+    source.onerror = () => {
+      setLive(false);
+      setStreamOrigin(null);
+    };
+    source.addEventListener("inventory", (e) => applyInventoryEvent(JSON.parse(e.data)));
+    return () => source.close();
   }, []);
 
 
@@ -159,6 +259,7 @@ const MyUserPortal = ({ response, onLogout }) => {
               projects={projects}
               username={response.user}
               onUserJoined={fetchProjects}
+              onHardwareChanged={handleHardwareChanged}
               showMyProjects={showMyProjects}
             />
           ) : (
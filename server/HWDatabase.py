@@ -1,5 +1,8 @@
 # HWDatabase.py
-from pymongo import MongoClient
+import collectionVersions
+import hwCache
+import inventoryEvents
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel
 from typing import Optional
 
@@ -21,17 +24,13 @@ class HWData(BaseModel):
 # ============================================================
 # Create a new hardware set
 # ============================================================
-def createHardwareSet(client, hwSetName, initCapacity):
+def createHardwareSet(store, hwSetName, initCapacity):
     """
     Create a new hardware set with specified capacity.
     Availability starts equal to capacity.
+    Returns False if the name is taken (enforced by the storage engine).
     """
     try:
-        # Check if it already exists
-        existing = client['Hardware'].Hardware_Sets.find_one({"hwName": hwSetName})
-        if existing:
-            return False
-
         hw_doc = HWData(
             hwName=hwSetName,
             capacity=initCapacity,
@@ -40,9 +39,14 @@ def createHardwareSet(client, hwSetName, initCapacity):
 
         hw_model_dump = hw_doc.model_dump()
 
-        client['Hardware'].Hardware_Sets.insert_one(hw_model_dump)
+        store.insertHardware(hw_model_dump)
+        hwCache.invalidate()
+        collectionVersions.bump(store, 'hardware')
+        inventoryEvents.publish({'type': 'hardwareCreated', **hwSummary(hw_model_dump)})
         print(f" Created hardware set '{hwSetName}' with capacity {initCapacity}")
         return True
+    except DuplicateKeyError:
+        return False
     except Exception as e:
         print(f" Error creating hardware set: {e}")
         return False
@@ -51,10 +55,10 @@ def createHardwareSet(client, hwSetName, initCapacity):
 # ============================================================
 # Query a hardware set by its name
 # ============================================================
-def queryHardwareSet(client, hwSetName):
+def queryHardwareSet(store, hwSetName):
     """Return a hardware set by name."""
     try:
-        existing = client['Hardware'].Hardware_Sets.find_one({"hwName": hwSetName})
+        existing = store.findHardware(hwSetName)
         return existing
     except Exception as e:
         print(f"❌ Error querying hardware set: {e}")
@@ -64,20 +68,16 @@ def queryHardwareSet(client, hwSetName):
 # ============================================================
 # Update availability of a hardware set
 # ============================================================
-def updateAvailability(client, hwSetName, newAvailability):
+def updateAvailability(store, hwSetName, newAvailability):
     """
     Update the availability of a hardware set.
     Ensures value stays within [0, capacity].
     """
     try:
-        existing = client['Hardware'].Hardware_Sets.find_one({"hwName": hwSetName})
-        if existing:
-            existing['availability'] = max(0, min(existing['capacity'], newAvailability))
-            client['Hardware'].Hardware_Sets.update_one(
-                {'hwName': hwSetName},
-                {'$set': {'availability': existing['availability']}}
-            )
-            print(f"Updated '{hwSetName}' availability → {hw['availability']}/{hw['capacity']}")
+        if store.setAvailability(hwSetName, newAvailability):
+            hwCache.invalidate()
+            collectionVersions.bump(store, 'hardware')
+            print(f"Updated '{hwSetName}' availability → {newAvailability}")
             return True
         print(f"Hardware set '{hwSetName}' not found.")
         return False
@@ -87,22 +87,42 @@ def updateAvailability(client, hwSetName, newAvailability):
 
 
 # ============================================================
-# Get all hardware set names and info
+# Query several hardware sets at once
 # ============================================================
-def getAllHwSets(client):
-    """Return a list of all hardware sets with capacity and availability."""
-    try:
-        hardware_sets = list(client['Hardware'].Hardware_Sets.find({}))
-        _hw_storage =[]
+def queryHardwareSets(store, hwSetNames):
+    """Return {hwName: hardware set} for every requested name that exists, in one query."""
+    return store.findHardwareMany(hwSetNames)
 
-        for hwSet in hardware_sets:
-            _hw_storage.append({
-                'hwName': hwSet['hwName'],
-                'capacity': hwSet['capacity'],
-                'availability': hwSet['availability']
-            })
 
-        return _hw_storage
+# ============================================================
+# Get all hardware set names and info
+# ============================================================
+def getAllHwSets(store, version=None):
+    """
+    Return a list of all hardware sets with capacity and availability.
+    Served from hwCache; the storage engine is only scanned on a cache miss.
+    version is the hardware change counter the caller read, if any.
+    """
+    try:
+        return hwCache.getHardware(lambda: _loadAllHwSets(store), version)
     except Exception as e:
         print(f"❌ Error retrieving hardware list: {e}")
         return []
+
+
+def _loadAllHwSets(store):
+    hardware_sets = store.listHardware()
+    _hw_storage =[]
+
+    for hwSet in hardware_sets:
+        _hw_storage.append(hwSummary(hwSet))
+
+    return _hw_storage
+
+
+def hwSummary(hwSet):
+    return {
+        'hwName': hwSet['hwName'],
+        'capacity': hwSet['capacity'],
+        'availability': hwSet['availability']
+    }
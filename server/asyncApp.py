@@ -0,0 +1,881 @@
+# Async (ASGI) variant of app.py on Starlette and Motor.
+#
+# Exposes the same routes and JSON responses as the Flask app, but every
+# handler awaits MongoDB instead of blocking a worker, so one process can keep
+# thousands of requests in flight. bcrypt work still runs on the
+# passwordHasher process pool, off the event loop. The admin routes (bulk
+# import/export, ledger) reuse the synchronous modules through MongoStorage in
+# the threadpool. Sets with sharded counters (counterShards.py) are merged on
+# hardware reads but only written by app.py; writes to them here fail with a
+# message saying so.
+#
+# Run locally with:  uvicorn asyncApp:app --host 0.0.0.0 --port 8001
+import io
+import json
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse, FileResponse, StreamingResponse, Response
+from starlette.routing import Match, Route
+
+# Import custom modules for database interactions
+import bulkData
+import dbClient
+import checkoutLedger
+import checkoutLeases
+import collectionVersions
+import counterShards
+import dbIndexes
+import hwCache
+import inventoryEvents
+import metrics
+import passwordHasher
+import rateLimits
+import sessionTokens
+import staticAssets
+import utilizationSeries
+import asyncUsersDatabase as usersDB
+import asyncProjectsDatabase as projectsDB
+import asyncHWDatabase as hardwareDB
+from mongoStorage import MongoStorage
+from projectsDatabase import MAX_PAGE_SIZE
+
+MONGODB_DATABASE_USER = 'User'
+STATIC_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'client', 'build'))
+# The React build, indexed once per process (see staticAssets.py)
+ASSETS = staticAssets.Manifest(STATIC_FOLDER)
+
+# Admin routes are only enabled when ADMIN_TOKEN is set, and then require it
+# in the X-Admin-Token header (as in app.py)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+# Import bodies are spooled to a temporary file past this size
+IMPORT_SPOOL_BYTES = 8 * 1024 * 1024
+
+_store = None
+
+
+def _syncStore():
+    # The synchronous engine, for the modules shared with app.py (threadpool only)
+    global _store
+    if _store is None:
+        _store = MongoStorage()
+    return _store
+
+
+def _hasherBusyResponse(e):
+    return JSONResponse({
+        'success': False,
+        'message': str(e)
+    }, status_code=503, headers={'Retry-After': str(e.retry_after)})
+
+
+def _tooManyRequests(wait):
+    return JSONResponse(rateLimits.tooManyRequests(wait), status_code=429,
+                        headers={'Retry-After': rateLimits.retryAfter(wait)})
+
+
+# Username for a project route, from the session token if one is sent
+def _sessionUser(request, data, projectName):
+    username, denied = sessionTokens.authorizeProject(
+        request.headers.get('Authorization'), projectName, data.get('username')
+    )
+    if denied:
+        status, payload = denied
+        return (None, JSONResponse(payload, status_code=status))
+    return (username, None)
+
+
+async def _sessionPayload(username, authTime=None):
+    projects = await projectsDB.getMemberProjects(dbClient.getAsyncClient(), username)
+    return {
+        'token': sessionTokens.issueToken(username, projects, authTime),
+        'expiresIn': sessionTokens.SESSION_TTL,
+        'projects': projects
+    }
+
+
+############################################################
+# USER MANAGEMENT
+############################################################
+
+async def main_page(request):
+    data = await request.json()
+    db = dbClient.getAsyncClient()[MONGODB_DATABASE_USER]
+    userProjects = await usersDB.getUserProjectsList(db, data.get('username'))
+    return JSONResponse({
+        'success': True,
+        'projects': userProjects
+    })
+
+
+async def join_project(request):
+    data = await request.json()
+    username = data.get('username')
+    projectId = data.get('projectId')
+
+    db = dbClient.getAsyncClient()[MONGODB_DATABASE_USER]
+    if await usersDB.joinProject(db, username, projectId):
+        return JSONResponse({
+            'success': True,
+            'message': f'User {username} successfully joined project {projectId}.'
+        })
+    return JSONResponse({
+        'success': False,
+        'message': 'Failed to join project. User may already be a member or does not exist.'
+    }, status_code=400)
+
+
+async def login(request):
+    try:
+        data = await request.json()
+        username = data.get('username')
+        password = data.get('password')
+
+        if not username or not password:
+            return JSONResponse({
+                'success': False,
+                'message': 'Username and password are required'
+            }, status_code=400)
+
+        # Attempts on one account are limited whichever address they come from
+        wait = await rateLimits.checkAsync('login', [('user', username)], dbClient.getAsyncClient())
+        if wait is not None:
+            return _tooManyRequests(wait)
+
+        db = dbClient.getAsyncClient()[MONGODB_DATABASE_USER]
+        if await usersDB.login(db, username, password):
+            session = await _sessionPayload(username)
+            return JSONResponse({
+                'success': True,
+                'message': 'Login successful',
+                'user': {'username': username, 'projects': session['projects']},
+                'token': session['token'],
+                'expiresIn': session['expiresIn']
+            })
+        return JSONResponse({
+            'success': False,
+            'message': 'Invalid credentials'
+        }, status_code=401)
+
+    except passwordHasher.HasherBusy as e:
+        return _hasherBusyResponse(e)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Login error: {str(e)}'
+        }, status_code=500)
+
+
+async def refresh_token(request):
+    try:
+        token = sessionTokens.tokenFromHeader(request.headers.get('Authorization'))
+        if not token:
+            return JSONResponse({'success': False, 'message': 'A session token is required.'}, status_code=401)
+        claims = sessionTokens.verifyRefresh(token)
+
+        username = claims['sub']
+        db = dbClient.getAsyncClient()[MONGODB_DATABASE_USER]
+        if not await usersDB.usernameExists(db, username):
+            return JSONResponse({'success': False, 'message': 'User no longer exists.'}, status_code=401)
+
+        session = await _sessionPayload(username, claims['auth_time'])
+        return JSONResponse({'success': True, **session})
+
+    except sessionTokens.TokenError as e:
+        return JSONResponse({'success': False, 'message': str(e)}, status_code=401)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Token refresh error: {str(e)}'
+        }, status_code=500)
+
+
+async def register(request):
+    try:
+        data = await request.json()
+        username = data.get('username')
+        password = data.get('password')
+        email = data.get('email')
+
+        if not username or not password:
+            return JSONResponse({
+                'success': False,
+                'message': 'Username and password are required'
+            }, status_code=400)
+
+        db = dbClient.getAsyncClient()[MONGODB_DATABASE_USER]
+        result, err = await usersDB.addUser(db, username, password, email)
+        if result:
+            return JSONResponse({
+                'success': True,
+                'message': 'User registered successfully'
+            })
+        if err == usersDB.USERNAME_TAKEN:
+            return JSONResponse({
+                'success': False,
+                'message': 'Username already exists'
+            }, status_code=400)
+        return JSONResponse({
+            'success': False,
+            'message': 'Failed to register user'
+        }, status_code=500)
+
+    except passwordHasher.HasherBusy as e:
+        return _hasherBusyResponse(e)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Registration error: {str(e)}'
+        }, status_code=500)
+
+
+async def get_user_projects_list(request):
+    try:
+        data = await request.json()
+        db = dbClient.getAsyncClient()[MONGODB_DATABASE_USER]
+        projects = await usersDB.getUserProjectsList(db, data.get('username'))
+        if projects != []:
+            return JSONResponse({
+                'success': True,
+                'projects': projects
+            })
+        return JSONResponse({
+            'success': False,
+            'message': 'User not found or has no projects'
+        }, status_code=400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error retrieving user projects: {str(e)}'
+        }, status_code=500)
+
+
+async def get_user_projects(request):
+    # Same as app.get_user_projects
+    try:
+        username = request.path_params['username']
+        client = dbClient.getAsyncClient()
+        tag = collectionVersions.etag(
+            'projects', await collectionVersions.getVersionAsync(client, 'projects'), f'user:{username}'
+        )
+        if collectionVersions.notModified(request.headers.get('if-none-match'), tag):
+            return _notModified(tag)
+        return JSONResponse({
+            'success': True,
+            'projects': await projectsDB.getUserProjects(client, username)
+        }, headers=_versionHeaders(tag))
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error retrieving user projects: {str(e)}'
+        }, status_code=500)
+
+
+async def get_project_info(request):
+    return JSONResponse({})
+
+
+async def check_inventory(request):
+    try:
+        includeProjects = request.query_params.get('projects', '1') != '0'
+        inventory = await projectsDB.getInventory(dbClient.getAsyncClient(), includeProjects=includeProjects)
+        return JSONResponse({
+            'success': True,
+            'inventory': inventory
+        })
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error retrieving inventory: {str(e)}'
+        }, status_code=500)
+
+
+############################################################
+# PROJECT MANAGEMENT
+############################################################
+
+async def create_project(request):
+    try:
+        data = await request.json()
+        projectName = data.get('projectName')
+        description = data.get('description')
+        hwSets = data.get('hwSets', {})
+
+        if not projectName:
+            return JSONResponse({
+                'success': False,
+                'message': 'Project name is required.'
+            }, status_code=400)
+
+        success, err = await projectsDB.createProject(dbClient.getAsyncClient(), projectName, description, hwSets)
+        if success:
+            return JSONResponse({
+                'success': True,
+                'message': f'Project "{projectName}" created successfully.'
+            })
+        return JSONResponse({
+            'success': False,
+            'message': err or f'Failed to create project "{projectName}". It may already exist or hardware allocation failed.'
+        }, status_code=400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error creating project: {str(e)}'
+        }, status_code=500)
+
+
+async def get_projects(request):
+    # Same query parameters and streamed body as app.get_projects
+    try:
+        params = request.query_params
+        limit = int(params['limit']) if params.get('limit') else None
+        if limit is not None and not 0 < limit <= MAX_PAGE_SIZE:
+            return JSONResponse({
+                'success': False,
+                'message': f'limit must be between 1 and {MAX_PAGE_SIZE}.'
+            }, status_code=400)
+
+        fields = params.get('fields')
+        client = dbClient.getAsyncClient()
+        tag = collectionVersions.etag(
+            'projects', await collectionVersions.getVersionAsync(client, 'projects'), request.url.query
+        )
+        if collectionVersions.notModified(request.headers.get('if-none-match'), tag):
+            return _notModified(tag)
+        projects = projectsDB.iterProjects(
+            client,
+            after=params.get('after'),
+            limit=limit,
+            fields=fields.split(',') if fields else None,
+            member=params.get('member'),
+            hwName=params.get('hwName')
+        )
+        first = await anext(projects, None)
+    except ValueError as e:
+        return JSONResponse({
+            'success': False,
+            'message': str(e)
+        }, status_code=400)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error retrieving projects: {str(e)}'
+        }, status_code=500)
+
+    async def generate():
+        yield '{"success": true, "projects": ['
+        count = 0
+        last_cursor = None
+        item = first
+        while item is not None:
+            last_cursor, summary = item
+            yield (',' if count else '') + json.dumps(summary)
+            count += 1
+            item = await anext(projects, None)
+        next_cursor = last_cursor if limit and count == limit else None
+        yield '], "nextCursor": ' + json.dumps(next_cursor) + '}'
+
+    return StreamingResponse(generate(), media_type='application/json', headers=_versionHeaders(tag))
+
+
+def _versionHeaders(tag):
+    return {'ETag': tag, 'Cache-Control': collectionVersions.CACHE_CONTROL}
+
+
+def _notModified(tag):
+    return Response(status_code=304, headers=_versionHeaders(tag))
+
+
+async def add_project_user(request):
+    try:
+        data = await request.json()
+        projectName = data.get('projectName')
+        username = data.get('username')
+
+        if not projectName or not username:
+            return JSONResponse({
+                'success': False,
+                'message': 'Project name and username are required.'
+            }, status_code=400)
+
+        if await projectsDB.addProjectUser(dbClient.getAsyncClient(), projectName, username):
+            return JSONResponse({
+                'success': True,
+                'message': f'User "{username}" added to project "{projectName}".'
+            })
+        return JSONResponse({
+            'success': False,
+            'message': f'Failed to add user "{username}" to project "{projectName}".'
+        }, status_code=400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error adding user to project: {str(e)}'
+        }, status_code=500)
+
+
+async def checkout_project_hw(request):
+    try:
+        data = await request.json()
+        projectName = data.get('projectName')
+        username, denied = _sessionUser(request, data, projectName)
+        if denied:
+            return denied
+        hwName = data.get('hwName')
+        qty = data.get('qty')
+
+        if not username or not projectName or not hwName or qty is None:
+            return JSONResponse({
+                'success': False,
+                'message': 'Username, project name, hardware name, and quantity are required.'
+            }, status_code=400)
+
+        # Optional: return the units automatically after leaseSeconds
+        lease, err = checkoutLeases.newLease(hwName, username, qty, data.get('leaseSeconds'))
+        if err:
+            return JSONResponse({'success': False, 'message': err}, status_code=400)
+
+        success, processed, err = await projectsDB.checkOutHW(
+            dbClient.getAsyncClient(), projectName, hwName, qty, username=username, lease=lease
+        )
+        if success:
+            result = {
+                'success': True,
+                'processedQty': processed,
+                'message': f'User "{username}" checked out {processed} of "{hwName}" from project "{projectName}".'
+            }
+            if lease:
+                result['lease'] = checkoutLeases.leaseSummary(lease)
+            return JSONResponse(result)
+        return JSONResponse({
+            'success': False,
+            'processedQty': 0,
+            'message': err or f'Failed to check out hardware "{hwName}" from project "{projectName}".'
+        }, status_code=400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error during hardware checkout: {str(e)}'
+        }, status_code=500)
+
+
+async def checkin_project_hw(request):
+    try:
+        data = await request.json()
+        projectName = data.get('projectName')
+        username, denied = _sessionUser(request, data, projectName)
+        if denied:
+            return denied
+        hwName = data.get('hwName')
+        qty = data.get('qty')
+
+        if not username or not projectName or not hwName or qty is None:
+            return JSONResponse({
+                'success': False,
+                'message': 'Username, project name, hardware name, and quantity are required.'
+            }, status_code=400)
+
+        success, processed, err = await projectsDB.checkInHW(
+            dbClient.getAsyncClient(), projectName, hwName, qty, username=username
+        )
+        if success:
+            return JSONResponse({
+                'success': True,
+                'processedQty': processed,
+                'message': f'User "{username}" checked in {processed} of "{hwName}" to project "{projectName}".'
+            })
+        return JSONResponse({
+            'success': False,
+            'processedQty': 0,
+            'message': err or f'Failed to check in hardware "{hwName}" to project "{projectName}".'
+        }, status_code=400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error during hardware check-in: {str(e)}'
+        }, status_code=500)
+
+
+async def batch_project_hw(request):
+    try:
+        data = await request.json() or {}
+        projectName = data.get('projectName')
+        username, denied = _sessionUser(request, data, projectName)
+        if denied:
+            return denied
+        mode = data.get('mode', 'atomic')
+        operations = data.get('operations')
+
+        if not username or not projectName or not operations:
+            return JSONResponse({
+                'success': False,
+                'message': 'Username, project name, and operations are required.'
+            }, status_code=400)
+
+        success, results, err = await projectsDB.applyHWBatch(
+            dbClient.getAsyncClient(), projectName, operations, username=username, mode=mode
+        )
+        applied = mode != 'atomic' and any(r['success'] for r in results)
+        return JSONResponse({
+            'success': success,
+            'mode': mode,
+            'results': results,
+            'message': err or ('All operations applied.' if success else 'Some operations failed.')
+        }, status_code=200 if success or applied else 400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error during hardware batch: {str(e)}'
+        }, status_code=500)
+
+
+############################################################
+# HARDWARE MANAGEMENT
+############################################################
+
+async def create_hardware(request):
+    try:
+        data = await request.json()
+        hwName = data.get('hwName')
+        capacity = data.get('capacity')
+
+        if not hwName or capacity is None:
+            return JSONResponse({
+                'success': False,
+                'message': 'Hardware name and capacity are required.'
+            }, status_code=400)
+
+        if await hardwareDB.createHardwareSet(dbClient.getAsyncClient(), hwName, int(capacity)):
+            return JSONResponse({
+                'success': True,
+                'message': f'Hardware set "{hwName}" created successfully.'
+            })
+        return JSONResponse({
+            'success': False,
+            'message': f'Hardware set "{hwName}" already exists.'
+        }, status_code=400)
+
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error creating hardware set: {str(e)}'
+        }, status_code=500)
+
+
+async def get_hardware(request):
+    try:
+        client = dbClient.getAsyncClient()
+        version = await collectionVersions.getVersionAsync(client, 'hardware')
+        tag = collectionVersions.etag('hardware', version)
+        if collectionVersions.notModified(request.headers.get('if-none-match'), tag):
+            return _notModified(tag)
+        hw_list = await hardwareDB.getAllHwSets(client, version)
+        return JSONResponse({
+            'success': True,
+            'hardware': hw_list
+        }, headers=_versionHeaders(tag))
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error retrieving hardware: {str(e)}'
+        }, status_code=500)
+
+
+async def get_hardware_utilization(request):
+    try:
+        params = request.query_params
+        result = await utilizationSeries.seriesAsync(
+            dbClient.getAsyncClient(), request.path_params['hwName'], params.get('projectName'),
+            params.get('since'), params.get('until'), params.get('granularity')
+        )
+        return JSONResponse({'success': True, **result})
+    except ValueError as e:
+        return JSONResponse({'success': False, 'message': str(e)}, status_code=400)
+    except Exception as e:
+        return JSONResponse({
+            'success': False,
+            'message': f'Error retrieving utilization: {str(e)}'
+        }, status_code=500)
+
+
+############################################################
+# ADMIN: BULK IMPORT / EXPORT
+############################################################
+
+def _adminDenied(request):
+    # Hidden entirely unless ADMIN_TOKEN is configured
+    if not ADMIN_TOKEN:
+        return Response(status_code=404)
+    if request.headers.get('x-admin-token') != ADMIN_TOKEN:
+        return Response(status_code=403)
+    return None
+
+
+# Query: format=ndjson|csv, mode=insert|upsert
+# Streams one NDJSON progress line per batch; the last line has "done": true
+async def bulk_import(request):
+    denied = _adminDenied(request)
+    if denied:
+        return denied
+    kind = request.path_params['kind']
+    fmt = request.query_params.get('format', 'ndjson')
+    mode = request.query_params.get('mode', 'insert')
+    if kind not in bulkData.COLLECTIONS or fmt not in bulkData.FORMATS or mode not in bulkData.MODES:
+        return JSONResponse({'success': False, 'message': 'Unknown kind, format or mode.'}, status_code=400)
+
+    # bulkData reads lines synchronously, so receive the body first and run
+    # the import in the threadpool
+    body = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    async for chunk in request.stream():
+        body.write(chunk)
+    body.seek(0)
+    store = _syncStore()
+
+    def generate():
+        try:
+            lines = io.TextIOWrapper(body, encoding='utf-8', newline='')
+            for progress in bulkData.importRecords(store, kind, lines, fmt, mode):
+                yield json.dumps(progress) + '\n'
+        except Exception as e:
+            yield json.dumps({'done': True, 'success': False, 'message': f'Error during import: {str(e)}'}) + '\n'
+        finally:
+            body.close()
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson')
+
+
+async def bulk_export(request):
+    denied = _adminDenied(request)
+    if denied:
+        return denied
+    kind = request.path_params['kind']
+    fmt = request.query_params.get('format', 'ndjson')
+    if kind not in bulkData.COLLECTIONS or fmt not in bulkData.FORMATS:
+        return JSONResponse({'success': False, 'message': 'Unknown kind or format.'}, status_code=400)
+
+    # A plain generator, iterated in the threadpool by StreamingResponse
+    return StreamingResponse(
+        bulkData.exportRecords(_syncStore(), kind, fmt),
+        media_type='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+        headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'}
+    )
+
+
+############################################################
+# CHECKOUT LEDGER
+############################################################
+
+# Query: username, projectName, hwName, since/until (ISO 8601), after (cursor), limit
+async def ledger_entries(request):
+    denied = _adminDenied(request)
+    if denied:
+        return denied
+    args = dict(request.query_params)
+    options = {name: args.pop(name, None) for name in ('since', 'until', 'after', 'limit')}
+    try:
+        limit = int(options['limit']) if options['limit'] else None
+        entries, nextCursor = await run_in_threadpool(
+            checkoutLedger.query, _syncStore(), args, options['since'], options['until'], options['after'], limit
+        )
+    except ValueError as e:
+        return JSONResponse({'success': False, 'message': str(e)}, status_code=400)
+    return JSONResponse({'success': True, 'entries': entries, 'nextCursor': nextCursor})
+
+
+async def ledger_state(request):
+    denied = _adminDenied(request)
+    if denied:
+        return denied
+    projectName = request.path_params['projectName']
+
+    def rebuild():
+        store = _syncStore()
+        state = checkoutLedger.currentState(store, projectName)
+        return (state, checkoutLedger.diff(store, state, projectName))
+
+    state, differences = await run_in_threadpool(rebuild)
+    mismatches = [
+        {'hwName': hwName, 'field': field, 'ledger': want, 'stored': have}
+        for _, hwName, field, want, have in differences
+    ]
+    return JSONResponse({
+        'success': True,
+        'hwSets': state.get(projectName, {}),
+        'mismatches': mismatches
+    })
+
+
+############################################################
+# HEALTH
+############################################################
+
+async def health(request):
+    try:
+        await dbClient.getAsyncClient().admin.command('ping')
+        ok, err = True, None
+    except Exception as e:
+        ok, err = False, str(e)
+    return JSONResponse({
+        'success': ok,
+        'database': {'ok': ok, 'error': err, 'pid': os.getpid(), 'counterShards': counterShards.getStats()},
+        'passwordHasher': passwordHasher.getStats(),
+        'hardwareCache': hwCache.getStats(),
+        'inventoryEvents': inventoryEvents.getStats(),
+        'checkoutLeases': checkoutLeases.getStats(),
+        'utilization': utilizationSeries.getStats(),
+        'rateLimits': rateLimits.getStats()
+    }, status_code=200 if ok else 503)
+
+
+async def inventory_events(request):
+    # One task per open stream; a publish wakes all of them (see inventoryEvents.py)
+    return StreamingResponse(
+        inventoryEvents.asyncStream(request.headers.get('last-event-id')),
+        media_type='text/event-stream',
+        headers=inventoryEvents.STREAM_HEADERS
+    )
+
+
+async def prometheus_metrics(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+# Serve React App - registered last so API routes take precedence
+async def serve_react_routes(request):
+    asset = ASSETS.lookup(request.path_params.get('path', ''))
+    if asset is None:
+        return Response(status_code=404)
+    status, headers, body, file_path = staticAssets.respond(
+        asset, request.headers.get('accept-encoding'), request.headers.get('if-none-match')
+    )
+    if file_path is not None:
+        return FileResponse(file_path, headers=headers)
+    return Response(body, status_code=status, headers=headers)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Open the Motor pool before the first request, close it on shutdown
+    dbClient.requireUri()
+    try:
+        await dbClient.getAsyncClient().admin.command('ping')
+        print(f"Motor client ready in worker {os.getpid()}")
+        await dbIndexes.ensureIndexesAsync(dbClient.getAsyncClient())
+        # The change stream watcher is a plain thread on the synchronous client
+        hwCache.startChangeStream(dbClient.getClient())
+        inventoryEvents.start(dbClient.getClient())
+        # Lease expiry, ledger snapshots and utilization rollups also run on
+        # threads, through the synchronous engine
+        store = _syncStore()
+        checkoutLeases.start(store)
+        checkoutLedger.start(store)
+        utilizationSeries.start(store)
+    except Exception as e:
+        print(f"Error warming up Motor client: {e}")
+    yield
+    dbClient.closeAsyncClient()
+    passwordHasher.shutdown()
+
+
+routes = [
+    Route('/main', main_page, methods=['GET']),
+    Route('/join_project', join_project, methods=['POST']),
+    Route('/user/login', login, methods=['POST']),
+    Route('/user/token/refresh', refresh_token, methods=['POST']),
+    Route('/user/register', register, methods=['POST']),
+    Route('/get_user_projects_list', get_user_projects_list, methods=['POST']),
+    Route('/users/{username}/projects', get_user_projects, methods=['GET']),
+    Route('/get_project_info', get_project_info, methods=['POST']),
+    Route('/api/inventory', check_inventory, methods=['GET']),
+    Route('/projects/create', create_project, methods=['POST']),
+    Route('/projects', get_projects, methods=['GET']),
+    Route('/projects/addUser', add_project_user, methods=['POST']),
+    Route('/projects/checkout', checkout_project_hw, methods=['POST']),
+    Route('/projects/checkin', checkin_project_hw, methods=['POST']),
+    Route('/projects/batch', batch_project_hw, methods=['POST']),
+    Route('/hardware/create', create_hardware, methods=['POST']),
+    Route('/hardware', get_hardware, methods=['GET']),
+    Route('/hardware/{hwName}/utilization', get_hardware_utilization, methods=['GET']),
+    Route('/admin/import/{kind}', bulk_import, methods=['POST']),
+    Route('/admin/export/{kind}', bulk_export, methods=['GET']),
+    Route('/admin/ledger', ledger_entries, methods=['GET']),
+    Route('/admin/ledger/state/{projectName}', ledger_state, methods=['GET']),
+    Route('/health', health, methods=['GET']),
+    Route('/events/inventory', inventory_events, methods=['GET']),
+    Route('/metrics', prometheus_metrics, methods=['GET']),
+    Route('/', serve_react_routes, methods=['GET']),
+    Route('/{path:path}', serve_react_routes, methods=['GET']),
+]
+
+class RateLimitMiddleware:
+    """Counterpart of app.py's _rateLimit hook; runs before routing, so it matches the route itself."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            route = _endpointName(scope)
+            if rateLimits.applies(route):
+                headers = Headers(scope=scope)
+                client = scope.get('client')
+                ip = rateLimits.clientIp(client[0] if client else None, headers.get('x-forwarded-for'))
+                user = rateLimits.tokenUser(headers.get('authorization'))
+                wait = await rateLimits.checkAsync(route, rateLimits.identities(ip, user, route),
+                                                   dbClient.getAsyncClient())
+                if wait is not None:
+                    await _tooManyRequests(wait)(scope, receive, send)
+                    return
+        await self.app(scope, receive, send)
+
+
+class InventoryOriginMiddleware:
+    """Counterpart of app.py's _inventoryOrigin hook."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST':
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message)[inventoryEvents.ORIGIN_HEADER] = inventoryEvents.origin()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+def _endpointName(scope):
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.endpoint.__name__
+    return None
+
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(metrics.MetricsMiddleware),
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=[inventoryEvents.ORIGIN_HEADER]),
+        Middleware(InventoryOriginMiddleware),
+        Middleware(RateLimitMiddleware)
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,152 @@
+# asyncHWDatabase.py
+# Async (Motor) counterpart of HWDatabase.py, used by asyncApp.py.
+# Query shapes are shared with mongoStorage (mongoQueries) so both stay in step.
+import collectionVersions
+import counterShards
+import hwCache
+import inventoryEvents
+from pymongo.errors import DuplicateKeyError
+from HWDatabase import HWData, hwSummary
+from mongoQueries import reserveOps, releaseOps
+
+
+# ============================================================
+# Create a new hardware set
+# ============================================================
+async def createHardwareSet(client, hwSetName, initCapacity):
+    """
+    Create a new hardware set with specified capacity.
+    Availability starts equal to capacity.
+    """
+    try:
+        hw_doc = HWData(
+            hwName=hwSetName,
+            capacity=initCapacity,
+            availability=initCapacity
+        )
+
+        hw_model_dump = hw_doc.model_dump()
+        await client['Hardware'].Hardware_Sets.insert_one(hw_model_dump)
+        hwCache.invalidate()
+        await collectionVersions.bumpAsync(client, 'hardware')
+        inventoryEvents.publish({'type': 'hardwareCreated', **hwSummary(hw_model_dump)})
+        print(f" Created hardware set '{hwSetName}' with capacity {initCapacity}")
+        return True
+    except DuplicateKeyError:
+        return False
+    except Exception as e:
+        print(f" Error creating hardware set: {e}")
+        return False
+
+
+# ============================================================
+# Query hardware sets
+# ============================================================
+async def queryHardwareSet(client, hwSetName):
+    """Return a hardware set by name."""
+    try:
+        hwSet = await client['Hardware'].Hardware_Sets.find_one({"hwName": hwSetName})
+        return (await _mergeShards(client, [hwSet]))[0] if hwSet else None
+    except Exception as e:
+        print(f"❌ Error querying hardware set: {e}")
+        return None
+
+
+async def queryHardwareSets(client, hwSetNames, session=None):
+    """Return {hwName: hardware set} for every requested name that exists, in one query."""
+    cursor = client['Hardware'].Hardware_Sets.find(
+        {"hwName": {"$in": list(hwSetNames)}},
+        session=session
+    )
+    hwSets = await _mergeShards(client, [hwSet async for hwSet in cursor])
+    return {hwSet['hwName']: hwSet for hwSet in hwSets}
+
+
+async def _mergeShards(client, hwSets):
+    # Sharded sets: availability is the sum of the shards' free units (as MongoStorage)
+    keys = [counterShards.hardwareKey(hwSet['hwName']) for hwSet in hwSets if 'shards' in hwSet]
+    if keys:
+        coll = client[counterShards.SHARDS_DATABASE][counterShards.SHARDS_COLLECTION]
+        merged = await counterShards.mergeAsync(coll, keys)
+        for hwSet in hwSets:
+            entry = merged.get(('hardware', hwSet['hwName'], hwSet['hwName']))
+            if entry is not None:
+                hwSet['availability'] = entry['free']
+    return hwSets
+
+
+# ============================================================
+# Update availability of a hardware set
+# ============================================================
+async def updateAvailability(client, hwSetName, newAvailability):
+    """
+    Update the availability of a hardware set.
+    Ensures value stays within [0, capacity].
+    """
+    try:
+        # Sharded sets (counterShards.py) are only written by app.py
+        result = await client['Hardware'].Hardware_Sets.update_one(
+            {'hwName': hwSetName, 'shards': {'$exists': False}},
+            [{'$set': {'availability': {'$max': [0, {'$min': ['$capacity', newAvailability]}]}}}]
+        )
+        if result.matched_count:
+            hwCache.invalidate()
+            await collectionVersions.bumpAsync(client, 'hardware')
+            print(f"Updated '{hwSetName}' availability → {newAvailability}")
+            return True
+        print(f"Hardware set '{hwSetName}' not found.")
+        return False
+    except Exception as e:
+        print(f"Error updating availability: {e}")
+        return False
+
+
+# ============================================================
+# Reserve / release units from the global pool
+# ============================================================
+async def reserveHardware(client, amounts, session=None):
+    """Deduct { hwName: qty } from global availability in a single bulk write."""
+    ops = reserveOps(amounts)
+    if not ops:
+        return True
+    result = await client['Hardware'].Hardware_Sets.bulk_write(ops, ordered=False, session=session)
+    hwCache.invalidate()
+    return result.matched_count == len(ops)
+
+
+async def reserveHardwareSet(client, hwSetName, qty):
+    """Deduct qty from one set's availability if enough is left. Returns True on success."""
+    if qty <= 0:
+        return True
+    result = await client['Hardware'].Hardware_Sets.update_one(
+        {'hwName': hwSetName, 'shards': {'$exists': False}, 'availability': {'$gte': qty}},
+        {'$inc': {'availability': -qty}}
+    )
+    hwCache.invalidate()
+    return result.matched_count == 1
+
+
+async def releaseHardware(client, amounts, session=None):
+    """Give { hwName: qty } back to the global pool, never exceeding capacity."""
+    ops = releaseOps(amounts)
+    if ops:
+        await client['Hardware'].Hardware_Sets.bulk_write(ops, ordered=False, session=session)
+        hwCache.invalidate()
+
+
+# ============================================================
+# Get all hardware set names and info
+# ============================================================
+async def getAllHwSets(client, version=None):
+    """Return a list of all hardware sets, served from hwCache when fresh (see HWDatabase)."""
+    try:
+        hit, hw_list, generation = hwCache.lookup(version)
+        if hit:
+            return hw_list
+        cursor = client['Hardware'].Hardware_Sets.find({})
+        hw_list = [hwSummary(hwSet) for hwSet in await _mergeShards(client, [hwSet async for hwSet in cursor])]
+        hwCache.store(hw_list, generation, version)
+        return hw_list
+    except Exception as e:
+        print(f"❌ Error retrieving hardware list: {e}")
+        return []
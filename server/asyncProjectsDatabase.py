@@ -0,0 +1,328 @@
+# asyncProjectsDatabase.py
+# Async (Motor) counterpart of projectsDatabase.py, used by asyncApp.py.
+# Validation is shared with projectsDatabase and query shapes with mongoStorage (mongoQueries), so all stay in step.
+# asyncApp.py always talks to MongoDB; the in-memory engine is only available to app.py.
+import asyncHWDatabase as HWDB
+import checkoutLedger
+import checkoutLeases
+import collectionVersions
+import hwCache
+import inventoryEvents
+import utilizationSeries
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from projectsDatabase import (
+    USER_PROJECT_FIELDS,
+    parseReservations, validateReservations, newProjectDoc, projectSummary, parseListArgs,
+    mergeInventory, checkOutFailureReason, checkInFailureReason,
+    parseBatch, simulateBatch, batchFailure, batchResult, isValidKey,
+    projectCreatedEvent, usageEvent, batchEvents, userAddedEvent
+)
+from mongoQueries import (
+    STREAM_BATCH_SIZE,
+    projectListQuery, inventoryPipeline,
+    checkOutQuery, checkInQuery, failureProjection,
+    atomicBatchQuery, bestEffortBatchPipeline, batchProjection,
+    transactionsUnsupported, ReservationFailed, membershipOps
+)
+
+
+# ============================================================
+# Create a new project
+# ============================================================
+async def createProject(client, projectName, description, hwSets_dict):
+    """
+    Create a new project and allocate hardware from the global HW pool.
+    Same round trips as projectsDatabase.createProject: one $in query, one
+    bulk reservation and one insert inside a transaction.
+    """
+    try:
+        requested, err = parseReservations(hwSets_dict)
+        if err:
+            return (False, err)
+
+        hw_infos = await HWDB.queryHardwareSets(client, requested.keys())
+        reason = _shardedSetReason({'hwSets': hw_infos}, requested.keys())
+        if reason:
+            return (False, reason)
+        validation_errors = validateReservations(requested, hw_infos)
+        if validation_errors:
+            print(f"Project creation for '{projectName}' aborted: {'; '.join(validation_errors)}")
+            return (False, '; '.join(validation_errors))
+
+        proj_model_dump = newProjectDoc(projectName, description, requested)
+
+        try:
+            reserved = await _reserveAndInsertInTransaction(client, requested, proj_model_dump)
+        except OperationFailure as e:
+            if not transactionsUnsupported(e):
+                raise
+            reserved = await _reserveAndInsertWithRollback(client, requested, proj_model_dump)
+
+        if not reserved:
+            print(f"Project creation for '{projectName}' aborted: hardware was taken concurrently.")
+            return (False, "Hardware availability changed while creating the project. Please try again.")
+
+        # Reservations are only visible once the transaction has committed
+        hwCache.invalidate()
+        await collectionVersions.bumpAsync(client, 'projects', 'hardware')
+        await checkoutLedger.recordAsync(client, checkoutLedger.reservationEntries(projectName, requested))
+        inventoryEvents.publish(projectCreatedEvent(proj_model_dump))
+
+        print(f"Created project '{projectName}' with hardware: {proj_model_dump['hwSets']}")
+        return (True, None)
+
+    except DuplicateKeyError:
+        return (False, f"Project '{projectName}' already exists.")
+    except Exception as e:
+        print(f"Error creating project: {e}")
+        return (False, f"Error creating project: {e}")
+
+
+async def _reserveAndInsertInTransaction(client, requested, project_doc):
+    async def reserve_and_insert(session):
+        if not await HWDB.reserveHardware(client, requested, session=session):
+            raise ReservationFailed()
+        await client['Projects'].project.insert_one(project_doc, session=session)
+
+    async with await client.start_session() as session:
+        try:
+            await session.with_transaction(reserve_and_insert)
+        except ReservationFailed:
+            return False
+    return True
+
+
+async def _reserveAndInsertWithRollback(client, requested, project_doc):
+    taken = {}
+    try:
+        for hwName, reserve_amount in requested.items():
+            if not await HWDB.reserveHardwareSet(client, hwName, reserve_amount):
+                await HWDB.releaseHardware(client, taken)
+                return False
+            taken[hwName] = reserve_amount
+        await client['Projects'].project.insert_one(project_doc)
+        return True
+    except Exception:
+        await HWDB.releaseHardware(client, taken)
+        raise
+
+
+# ============================================================
+# Get all projects
+# ============================================================
+async def getProjects(client):
+    """Return all project entries."""
+    try:
+        return [summary async for _, summary in iterProjects(client)]
+    except Exception as e:
+        print(f"Error getting projects: {e}")
+        return []
+
+
+async def iterProjects(client, after=None, limit=None, fields=None, member=None, hwName=None):
+    """Async generator of (cursor, project) pairs; see projectsDatabase.iterProjects."""
+    query, projection = projectListQuery(*parseListArgs(after, fields, member, hwName))
+    cursor = client['Projects'].project.find(query, projection).sort('_id', 1).batch_size(STREAM_BATCH_SIZE)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for projSet in cursor:
+        yield (str(projSet['_id']), projectSummary(projSet))
+
+
+# ============================================================
+# Projects a user belongs to
+# ============================================================
+async def getMemberProjects(client, username):
+    """Names of the projects listing username as a member; see projectsDatabase.getMemberProjects."""
+    return [project['projectName'] async for _, project in iterProjects(client, member=username, fields=['projectName'])]
+
+
+async def getUserProjects(client, username):
+    """Projects of username with their hardware state; see projectsDatabase.getUserProjects."""
+    return [project async for _, project in iterProjects(client, member=username, fields=USER_PROJECT_FIELDS)]
+
+
+# ============================================================
+# Inventory across all projects
+# ============================================================
+async def getInventory(client, includeProjects=True):
+    """Per-hardware-set totals; see projectsDatabase.getInventory."""
+    cursor = client['Projects'].project.aggregate(inventoryPipeline(includeProjects))
+    per_set = [entry async for entry in cursor]
+    return mergeInventory(await HWDB.getAllHwSets(client), per_set, includeProjects)
+
+
+# ============================================================
+# Add user to project
+# ============================================================
+async def addProjectUser(client, projectName, username):
+    """Add a user to an existing project, on both sides (see mongoStorage.addProjectUser)."""
+    try:
+        try:
+            async with await client.start_session() as session:
+                added = await session.with_transaction(
+                    lambda s: _addMembership(client, projectName, username, session=s)
+                )
+        except OperationFailure as e:
+            if not transactionsUnsupported(e):
+                raise
+            added = await _addMembership(client, projectName, username)
+
+        if added:
+            await collectionVersions.bumpAsync(client, 'projects')
+            inventoryEvents.publish(userAddedEvent(projectName, username))
+            print(f"Added user '{username}' to project '{projectName}'")
+            return True
+        print(f"User '{username}' already in project '{projectName}' or project not found.")
+        return False
+    except Exception as e:
+        print(f"Error adding user to project: {e}")
+        return False
+
+
+async def _addMembership(client, projectName, username, session=None):
+    (projectFilter, projectUpdate), (userFilter, userUpdate) = membershipOps(projectName, username)
+    project = await client['Projects'].project.update_one(projectFilter, projectUpdate, session=session)
+    if not project.matched_count:
+        return None
+    user = await client['User'].users.update_one(userFilter, userUpdate, session=session)
+    return bool(project.modified_count or user.modified_count)
+
+
+def _shardedSetReason(existing, hwNames):
+    # Sharded sets (counterShards.py) are left to app.py; the shared queries skip them
+    for hwName in hwNames:
+        if 'shards' in (existing or {}).get('hwSets', {}).get(hwName, {}):
+            return f"'{hwName}' uses sharded counters, which this server does not update."
+    return None
+
+
+async def _recordMovements(client, entries):
+    # Applied check-outs/check-ins go to the ledger and the utilization rollups
+    await checkoutLedger.recordAsync(client, entries)
+    utilizationSeries.note(entries)
+
+
+# ============================================================
+# Check out / check in hardware within a project
+# ============================================================
+# Return signature: (success: bool, processed_qty: int, error_msg: str | None)
+
+async def checkOutHW(client, projectName, hwName, qty, username=None, lease=None):
+    """Check out qty units of hwName for username in a single round trip."""
+    try:
+        qty = int(qty)
+        if qty <= 0:
+            return (False, 0, "Quantity must be a positive integer.")
+        if not isValidKey(hwName) or not isValidKey(username):
+            return (False, 0, "Invalid hardware set or user name.")
+
+        query, update, projection = checkOutQuery(projectName, hwName, qty, username, lease)
+        updated = await client['Projects'].project.find_one_and_update(
+            query, update,
+            projection=projection,
+            return_document=ReturnDocument.AFTER
+        )
+        if updated:
+            if lease:
+                checkoutLeases.schedule(projectName, lease)
+            await collectionVersions.bumpAsync(client, 'projects')
+            await _recordMovements(client, [checkoutLedger.entry('checkout', projectName, hwName, username, qty)])
+            inventoryEvents.publish(usageEvent('checkout', projectName, hwName, username, qty))
+            return (True, qty, None)
+
+        existing = await client['Projects'].project.find_one(
+            {"projectName": projectName}, failureProjection(hwName)
+        )
+        return (False, 0, _shardedSetReason(existing, [hwName])
+                or checkOutFailureReason(existing, projectName, hwName, qty, username))
+    except Exception as e:
+        return (False, 0, f"Error checking out HW: {e}")
+
+
+async def checkInHW(client, projectName, hwName, qty, username=None):
+    """Check in up to qty units of hwName that username holds, in a single round trip."""
+    try:
+        qty = int(qty)
+        if qty <= 0:
+            return (False, 0, "Quantity must be a positive integer.")
+        if not isValidKey(hwName) or not isValidKey(username):
+            return (False, 0, "Invalid hardware set or user name.")
+
+        query, update, projection = checkInQuery(projectName, hwName, qty, username)
+        before = await client['Projects'].project.find_one_and_update(
+            query, update,
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before:
+            processed = min(qty, before['hwSets'][hwName]['user_usage'][username])
+            await collectionVersions.bumpAsync(client, 'projects')
+            await _recordMovements(client, [checkoutLedger.entry('checkin', projectName, hwName, username, processed)])
+            inventoryEvents.publish(usageEvent('checkin', projectName, hwName, username, processed))
+            return (True, processed, None)
+
+        existing = await client['Projects'].project.find_one(
+            {"projectName": projectName}, failureProjection(hwName)
+        )
+        return (False, 0, _shardedSetReason(existing, [hwName])
+                or checkInFailureReason(existing, projectName, hwName, username))
+    except Exception as e:
+        return (False, 0, f"Error checking in HW: {e}")
+
+
+# ============================================================
+# Batch check out / check in within a project
+# ============================================================
+async def applyHWBatch(client, projectName, operations, username=None, mode='atomic'):
+    """Apply several check-outs/check-ins to one project in a single write (see projectsDatabase)."""
+    try:
+        ops, err = parseBatch(operations, mode, username)
+        if err:
+            return (False, [], err)
+
+        projection = batchProjection(ops)
+
+        if mode == 'atomic':
+            query, update = atomicBatchQuery(projectName, ops, username)
+            applied = await client['Projects'].project.find_one_and_update(
+                query, update, projection=projection
+            )
+            if applied:
+                results = [batchResult(op, op['qty'], None) for op in ops]
+                await collectionVersions.bumpAsync(client, 'projects')
+                await _recordMovements(client, checkoutLedger.batchEntries(projectName, username, results))
+                for event in batchEvents(projectName, username, results):
+                    inventoryEvents.publish(event)
+                return (True, results, None)
+            existing = await client['Projects'].project.find_one({'projectName': projectName}, projection)
+            reason = _shardedSetReason(existing, [op['hwName'] for op in ops])
+            if reason:
+                return (False, [batchResult(op, 0, reason) for op in ops], reason)
+            return batchFailure(existing, projectName, ops, username, atomic=True)
+
+        before = await client['Projects'].project.find_one_and_update(
+            {'projectName': projectName, 'users': username},
+            bestEffortBatchPipeline(ops, username),
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+        if not before:
+            existing = await client['Projects'].project.find_one({'projectName': projectName}, projection)
+            return batchFailure(existing, projectName, ops, username, atomic=False)
+        results = simulateBatch(before, projectName, ops, username)
+        for i, op in enumerate(ops):
+            # The pipeline leaves sharded sets alone; report them as not applied
+            reason = _shardedSetReason(before, [op['hwName']])
+            if reason:
+                results[i] = batchResult(op, 0, reason)
+        if any(r['success'] for r in results):
+            await collectionVersions.bumpAsync(client, 'projects')
+            await _recordMovements(client, checkoutLedger.batchEntries(projectName, username, results))
+            for event in batchEvents(projectName, username, results):
+                inventoryEvents.publish(event)
+        return (all(r['success'] for r in results), results, None)
+
+    except Exception as e:
+        return (False, [], f"Error applying hardware batch: {e}")
@@ -0,0 +1,88 @@
+# asyncUsersDatabase.py
+# Async (Motor) counterpart of usersDatabase.py, used by asyncApp.py.
+# bcrypt still runs on the passwordHasher pool; the event loop only awaits the result.
+import passwordHasher
+import asyncProjectsDatabase as projectsDB
+from pymongo.errors import DuplicateKeyError
+from usersDatabase import UserLogin, USERNAME_TAKEN
+
+
+# Function to add a new user (registration)
+async def addUser(db, username, password, email=None):
+    # Add a new user to the database; returns (success, error message)
+    user = UserLogin(
+        username=username,
+        password=password,
+        email=email,
+        projects=[]
+    )
+
+    # HasherBusy goes up to the route, which answers 503
+    hashed_pw = await passwordHasher.hashPasswordAsync(user.password)
+
+    try:
+        user_model_dump = user.model_dump()
+        user_model_dump["password"] = hashed_pw
+        await db.users.insert_one(user_model_dump)
+        return (True, None)
+
+    except DuplicateKeyError:
+        return (False, USERNAME_TAKEN)
+    except Exception as e:
+        print(f"Error adding user: {e}")
+        return (False, f"Error adding user: {e}")
+
+
+# Helper function to query a user by username
+async def queryUser(db, username):
+    return await db.users.find_one({"username": username})
+
+
+# Function to log in a user
+async def login(db, username, password, email=None):
+    # Authenticate a user and return login status
+    try:
+        existing = await queryUser(db, username)
+        if not existing:
+            return False
+
+        matches, new_hash = await passwordHasher.verifyPasswordAsync(password, existing["password"])
+        if not matches:
+            return False
+
+        # Transparently upgrade hashes created with an outdated bcrypt cost
+        if new_hash:
+            await db.users.update_one(
+                {'username': username, 'password': existing["password"]},
+                {'$set': {'password': new_hash}}
+            )
+        return True
+
+    except Exception as e:
+        # Not a credentials problem (or HasherBusy): let the route answer 500 or 503 rather than 401
+        print(f"Error during login: {e}")
+        raise
+
+
+# Function to check if username already exists
+async def usernameExists(db, username):
+    try:
+        existing = await db.users.find_one({"username": username}, {'_id': 1})
+        return existing is not None
+    except Exception as e:
+        print(f"Error checking username: {e}")
+        return False
+
+
+# Function to add a user to a project
+async def joinProject(db, username, projectId):
+    # projectId is the project's name; recorded on both the user and the project
+    return await projectsDB.addProjectUser(db.client, projectId, username)
+
+
+# Function to get the list of projects for a user
+async def getUserProjectsList(db, username):
+    existing = await db.users.find_one({'username': username}, {'projects': 1})
+    if existing:
+        return existing['projects']
+    return []
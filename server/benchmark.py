@@ -0,0 +1,375 @@
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+'''
+Load-test / benchmark harness for the backend API, built on the same calls
+as testBackend.py.
+
+Scenarios (run one after another, each for --duration seconds):
+    login      login storm: every worker logs in random users
+    checkout   concurrent 1-unit checkouts and check-ins on one hot hardware set
+    list       project listing, hardware listing and the inventory report
+    mixed      weighted mix of all of the above
+
+Each scenario reports, per route, p50/p95/p99/mean/max latency, throughput
+and status counts, and the whole run is saved as JSON so two commits can be
+compared:
+
+    python benchmark.py --concurrency 32 --duration 15 -o before.json
+    python benchmark.py --concurrency 32 --duration 15 -o after.json --compare before.json
+
+By default the harness targets an already running server (--base-url).
+With --serve it starts app.py in this process on a free port instead, on the
+storage engine chosen with --storage: mongodb uses whatever MONGODB_URI points
+at (e.g. a local mongod), memory needs no database at all.
+All fixtures are created under a per-run prefix, so runs never collide.
+'''
+
+DEFAULT_BASE_URL = "http://localhost:8001"
+SCENARIOS = ('login', 'checkout', 'list', 'mixed')
+BENCH_PASSWORD = "bench-password"
+
+# Relative weights of the operations in the mixed scenario
+MIXED_WEIGHTS = {
+    'login': 1,
+    'checkout': 6,
+    'listProjects': 2,
+    'listHardware': 2,
+    'inventory': 1
+}
+
+
+# ============ Fixtures ============
+
+class Fixtures:
+    """Hardware sets, users and a project created once per run."""
+
+    def __init__(self, baseUrl, users, hotCapacity):
+        self.baseUrl = baseUrl
+        self.prefix = f"bench-{uuid.uuid4().hex[:8]}"
+        self.hotHw = f"{self.prefix}-hot"
+        self.coldHw = f"{self.prefix}-cold"
+        self.project = f"{self.prefix}-project"
+        self.users = [f"{self.prefix}-user{i}" for i in range(users)]
+        self.tokens = {}
+        self.hotCapacity = hotCapacity
+
+    def create(self):
+        s = requests.Session()
+        self._post(s, "/hardware/create", {"hwName": self.hotHw, "capacity": self.hotCapacity})
+        self._post(s, "/hardware/create", {"hwName": self.coldHw, "capacity": 1000})
+        self._post(s, "/projects/create", {
+            "projectName": self.project,
+            "description": "Benchmark fixture",
+            "hwSets": {self.hotHw: self.hotCapacity, self.coldHw: 100}
+        })
+        for username in self.users:
+            res = s.post(f"{self.baseUrl}/user/register", json={"username": username, "password": BENCH_PASSWORD})
+            if res.status_code == 503:
+                # bcrypt pool is saturated; back off and retry once
+                time.sleep(float(res.headers.get('Retry-After', 1)))
+                res = s.post(f"{self.baseUrl}/user/register", json={"username": username, "password": BENCH_PASSWORD})
+            if res.status_code >= 400:
+                raise RuntimeError(f"Fixture setup failed: registering {username} -> {res.status_code} {res.text[:200]}")
+            self._post(s, "/projects/addUser", {"projectName": self.project, "username": username})
+            # Logged in after joining, so the session token names the project
+            login = self._post(s, "/user/login", {"username": username, "password": BENCH_PASSWORD})
+            self.tokens[username] = login.json()["token"]
+
+    def _post(self, s, path, body):
+        res = s.post(f"{self.baseUrl}{path}", json=body)
+        if res.status_code >= 400:
+            raise RuntimeError(f"Fixture setup failed: POST {path} -> {res.status_code} {res.text[:200]}")
+        return res
+
+
+# ============ Operations ============
+# Each issues its requests through call(), which times and records them
+
+def opLogin(call, fx):
+    call("POST /user/login", "/user/login",
+         json={"username": random.choice(fx.users), "password": BENCH_PASSWORD})
+
+
+def opCheckout(call, fx):
+    # Check out one unit of the hot set, and give it back if we got it
+    headers = {"Authorization": f"Bearer {fx.tokens[random.choice(fx.users)]}"}
+    body = {"projectName": fx.project, "hwName": fx.hotHw, "qty": 1}
+    res = call("POST /projects/checkout", "/projects/checkout", json=body, headers=headers)
+    if res is not None and res.status_code == 200:
+        call("POST /projects/checkin", "/projects/checkin", json=body, headers=headers)
+
+
+def opListProjects(call, fx):
+    call("GET /projects", "/projects", params={"limit": 50})
+
+
+def opListHardware(call, fx):
+    call("GET /hardware", "/hardware")
+
+
+def opInventory(call, fx):
+    call("GET /api/inventory", "/api/inventory")
+
+
+OPERATIONS = {
+    'login': opLogin,
+    'checkout': opCheckout,
+    'listProjects': opListProjects,
+    'listHardware': opListHardware,
+    'inventory': opInventory
+}
+
+SCENARIO_OPS = {
+    'login': {'login': 1},
+    'checkout': {'checkout': 1},
+    'list': {'listProjects': 2, 'listHardware': 2, 'inventory': 1},
+    'mixed': MIXED_WEIGHTS
+}
+
+
+# ============ Runner ============
+
+class Recorder:
+    """Thread-safe per-route latency samples and status counts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.statuses = {}
+        self.errors = {}
+
+    def record(self, route, seconds, status):
+        with self.lock:
+            self.samples.setdefault(route, []).append(seconds)
+            counts = self.statuses.setdefault(route, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def error(self, route, exc):
+        with self.lock:
+            self.errors.setdefault(route, []).append(repr(exc))
+
+
+def runScenario(name, baseUrl, fx, concurrency, duration):
+    weights = SCENARIO_OPS[name]
+    ops = [OPERATIONS[op] for op in weights]
+    opWeights = list(weights.values())
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def worker(_):
+        s = requests.Session()
+
+        def call(route, path, **kwargs):
+            method = route.split(' ', 1)[0]
+            started = time.perf_counter()
+            try:
+                # .content reads the whole (possibly streamed) body
+                res = s.request(method, f"{baseUrl}{path}", **kwargs)
+                res.content
+            except requests.exceptions.RequestException as e:
+                recorder.error(route, e)
+                return None
+            recorder.record(route, time.perf_counter() - started, res.status_code)
+            return res
+
+        while time.perf_counter() < deadline:
+            random.choices(ops, opWeights)[0](call, fx)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    return summarize(recorder, wall)
+
+
+def percentile(sorted_samples, p):
+    # Nearest-rank percentile
+    if not sorted_samples:
+        return None
+    k = max(0, math.ceil(p / 100 * len(sorted_samples)) - 1)
+    return sorted_samples[k]
+
+
+def summarize(recorder, wall):
+    routes = {}
+    total = 0
+    for route, samples in sorted(recorder.samples.items()):
+        samples.sort()
+        total += len(samples)
+        routes[route] = {
+            'count': len(samples),
+            'throughputRps': round(len(samples) / wall, 2),
+            'p50Ms': round(percentile(samples, 50) * 1000, 2),
+            'p95Ms': round(percentile(samples, 95) * 1000, 2),
+            'p99Ms': round(percentile(samples, 99) * 1000, 2),
+            'meanMs': round(sum(samples) / len(samples) * 1000, 2),
+            'maxMs': round(samples[-1] * 1000, 2),
+            'statusCounts': recorder.statuses.get(route, {}),
+            'serverErrors': sum(c for s, c in recorder.statuses.get(route, {}).items() if s.startswith('5')),
+            'transportErrors': 0
+        }
+    for route, errors in recorder.errors.items():
+        routes.setdefault(route, {'count': 0})['transportErrors'] = len(errors)
+    return {
+        'wallSeconds': round(wall, 2),
+        'totalRequests': total,
+        'throughputRps': round(total / wall, 2) if wall else 0,
+        'routes': routes
+    }
+
+
+# ============ Reporting ============
+
+def printScenario(name, result):
+    print(f"\n🔹 {name}: {result['totalRequests']} requests in {result['wallSeconds']}s "
+          f"({result['throughputRps']} req/s)")
+    print(f"   {'route':28} {'count':>7} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  status")
+    for route, r in result['routes'].items():
+        if not r.get('count'):
+            print(f"   {route:28} transport errors: {r.get('transportErrors')}")
+            continue
+        print(f"   {route:28} {r['count']:>7} {r['throughputRps']:>8} {r['p50Ms']:>8} {r['p95Ms']:>8} "
+              f"{r['p99Ms']:>8} {r['maxMs']:>8}  {r['statusCounts']}")
+
+
+def compare(baseline, current, threshold):
+    """Print p95 and throughput changes per route; return the number of regressions."""
+    print(f"\n🔹 Comparison against {baseline['meta'].get('commit') or 'baseline'} (threshold {threshold}%)")
+    regressions = 0
+    for scenario, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(scenario)
+        if not base:
+            continue
+        for route, r in result['routes'].items():
+            b = base['routes'].get(route)
+            if not b or not b.get('count') or not r.get('count'):
+                continue
+            p95 = _change(b['p95Ms'], r['p95Ms'])
+            rps = _change(b['throughputRps'], r['throughputRps'])
+            regressed = p95 > threshold or rps < -threshold
+            regressions += regressed
+            mark = "❌" if regressed else "✅"
+            print(f"   {mark} {scenario:9} {route:28} p95 {b['p95Ms']} → {r['p95Ms']} ms ({p95:+.1f}%), "
+                  f"{b['throughputRps']} → {r['throughputRps']} req/s ({rps:+.1f}%)")
+    return regressions
+
+
+def _change(before, after):
+    if not before:
+        return 0.0
+    return (after - before) / before * 100
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return None
+
+
+# ============ In-process server ============
+
+def serveInProcess(backend='mongodb'):
+    """Start app.py on a free local port in a daemon thread; returns its base URL."""
+    import logging
+    from werkzeug.serving import make_server
+    import storage
+    storage.setStorage(storage.createStorage(backend))
+    storage.getStorage().start()
+    # The harness is one client hammering every route; rate limits would cap it
+    os.environ.setdefault('RATE_LIMIT_ENABLED', '0')
+    import app
+
+    # Per-request access logs would dominate the run
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+# ============ Entry point ============
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backend API.")
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL)
+    parser.add_argument('--serve', action='store_true', help="run app.py in this process instead of --base-url")
+    parser.add_argument('--storage', choices=('mongodb', 'memory'), default='mongodb',
+                        help="storage engine for --serve")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10, help="seconds per scenario")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--hot-capacity', type=int, default=10,
+                        help="units of the hot hardware set (lower = more contention)")
+    parser.add_argument('-o', '--output', help="write results as JSON")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=10, help="regression threshold in percent")
+    args = parser.parse_args(argv)
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    baseUrl = serveInProcess(args.storage) if args.serve else args.base_url.rstrip('/')
+    print(f"\n🚀 Benchmarking {baseUrl} with {args.concurrency} workers, {args.duration}s per scenario")
+
+    fx = Fixtures(baseUrl, args.users, args.hot_capacity)
+    fx.create()
+
+    results = {
+        'meta': {
+            'commit': gitCommit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'baseUrl': baseUrl,
+            'serve': args.serve,
+            'storage': args.storage if args.serve else None,
+            'concurrency': args.concurrency,
+            'durationSeconds': args.duration,
+            'users': args.users,
+            'hotCapacity': args.hot_capacity
+        },
+        'scenarios': {}
+    }
+    for name in scenarios:
+        results['scenarios'][name] = runScenario(name, baseUrl, fx, args.concurrency, args.duration)
+        printScenario(name, results['scenarios'][name])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except requests.exceptions.ConnectionError:
+        print("❌ Could not connect to backend. Start the server or pass --serve.")
+        sys.exit(1)
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
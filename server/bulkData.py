@@ -0,0 +1,350 @@
+# bulkData.py
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+import collectionVersions
+import hwCache
+import passwordHasher
+from HWDatabase import HWData
+from projectsDatabase import ProjectData
+from usersDatabase import UserLogin
+
+'''
+Bulk import / export of users, projects and hardware sets.
+
+Records are read as NDJSON (one JSON object per line) or CSV and written in
+batches of BULK_BATCH_SIZE through the storage engine (on MongoDB,
+insert_many(ordered=False)), so one bad or duplicate record never stops the
+rest. With mode='upsert' each batch replaces records by their unique name
+instead (bulk_write of ReplaceOne(upsert=True) on MongoDB).
+Plain-text passwords in a batch are hashed together across the bcrypt pool
+(passwordHasher.hashMany).
+
+Import restores documents as given: project hwSets and hardware availability
+are not reconciled against each other, so import hardware exported from the
+same database as the projects (export always writes consistent snapshots of
+each collection, not across them).
+
+Record shapes (CSV cells holding lists/objects are JSON-encoded):
+    users:     username, password | passwordHash, email, projects
+    projects:  projectName, description, hwSets, users
+               hwSets values may be a plain number (reserved capacity)
+    hardware:  hwName, capacity, availability (defaults to capacity)
+
+CLI:
+    python bulkData.py import users users.ndjson
+    python bulkData.py import projects projects.csv --format csv --mode upsert
+    python bulkData.py export hardware -o hardware.ndjson
+'''
+
+BULK_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+
+# kind -> unique key field
+COLLECTIONS = {
+    'users': 'username',
+    'projects': 'projectName',
+    'hardware': 'hwName',
+}
+FORMATS = ('ndjson', 'csv')
+MODES = ('insert', 'upsert')
+
+# Column order for CSV export
+CSV_FIELDS = {
+    'users': ('username', 'passwordHash', 'email', 'projects'),
+    'projects': ('projectName', 'description', 'hwSets', 'users'),
+    'hardware': ('hwName', 'capacity', 'availability'),
+}
+
+
+# ============================================================
+# Reading records
+# ============================================================
+def iterRecords(lines, fmt='ndjson'):
+    """
+    Yield (line number, record or None, error or None) from an iterable of
+    text lines, so callers can report bad lines without stopping.
+    """
+    if fmt == 'ndjson':
+        for lineno, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield (lineno, None, f"invalid JSON: {e}")
+                continue
+            if not isinstance(record, dict):
+                yield (lineno, None, "expected a JSON object")
+                continue
+            yield (lineno, record, None)
+    elif fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for record in reader:
+            yield (reader.line_num, _decodeCsvRecord(record), None)
+    else:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+
+def _decodeCsvRecord(record):
+    decoded = {}
+    for field, value in record.items():
+        if field is None or value is None or value == '':
+            continue
+        if value[:1] in '[{':
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        decoded[field] = value
+    return decoded
+
+
+# ============================================================
+# Record -> document
+# ============================================================
+def _userDoc(record):
+    # Returns (document, plain password or None); the password is hashed per batch
+    password_hash = record.get('passwordHash')
+    password = record.get('password')
+    if not password_hash and not password:
+        raise ValueError("password or passwordHash is required")
+    user = UserLogin(
+        username=record.get('username'),
+        password=password_hash or password,
+        email=record.get('email') or None,
+        projects=_asList(record.get('projects'))
+    )
+    doc = user.model_dump()
+    return (doc, None if password_hash else password)
+
+
+def _projectDoc(record):
+    hwSets = {}
+    for hwName, hw in (record.get('hwSets') or {}).items():
+        if isinstance(hw, dict):
+            hwSets[hwName] = {
+                'used': int(hw.get('used', 0)),
+                'capacity': int(hw.get('capacity', 0)),
+                **({'user_usage': hw['user_usage']} if hw.get('user_usage') else {})
+            }
+        else:
+            hwSets[hwName] = {'used': 0, 'capacity': int(hw)}
+    project = ProjectData(
+        projectName=record.get('projectName'),
+        description=record.get('description') or '',
+        hwSets=hwSets,
+        users=_asList(record.get('users'))
+    )
+    return (project.model_dump(), None)
+
+
+def _hardwareDoc(record):
+    capacity = int(record.get('capacity'))
+    availability = record.get('availability')
+    hw = HWData(
+        hwName=record.get('hwName'),
+        capacity=capacity,
+        availability=capacity if availability in (None, '') else int(availability)
+    )
+    return (hw.model_dump(), None)
+
+
+def _asList(value):
+    if value in (None, ''):
+        return []
+    if isinstance(value, list):
+        return value
+    return [v for v in str(value).split(';') if v]
+
+
+_DOC_BUILDERS = {
+    'users': _userDoc,
+    'projects': _projectDoc,
+    'hardware': _hardwareDoc,
+}
+
+
+# ============================================================
+# Import
+# ============================================================
+def importRecords(store, kind, lines, fmt='ndjson', mode='insert', batchSize=BULK_BATCH_SIZE):
+    """
+    Import records from an iterable of text lines. Yields a progress dict after
+    every batch; the last one has 'done': True. Counts:
+        read, inserted, updated, skipped (duplicate key in insert mode), failed
+    """
+    if kind not in COLLECTIONS:
+        raise ValueError(f"kind must be one of: {', '.join(COLLECTIONS)}")
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of: {', '.join(MODES)}")
+
+    key = COLLECTIONS[kind]
+    build = _DOC_BUILDERS[kind]
+    progress = {
+        'kind': kind, 'read': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'failed': 0,
+        'errors': [], 'elapsedSeconds': 0.0, 'done': False
+    }
+    started = time.perf_counter()
+
+    batch, plain = [], []
+    for lineno, record, err in iterRecords(lines, fmt):
+        progress['read'] += 1
+        if err is None:
+            try:
+                doc, password = build(record)
+            except Exception as e:
+                err = str(e)
+        if err is not None:
+            progress['failed'] += 1
+            _recordError(progress, f"line {lineno}: {err}")
+            continue
+        batch.append(doc)
+        plain.append(password)
+        if len(batch) >= batchSize:
+            _writeBatch(store, kind, key, batch, plain, mode, progress)
+            batch, plain = [], []
+            progress['elapsedSeconds'] = round(time.perf_counter() - started, 3)
+            yield dict(progress)
+
+    if batch:
+        _writeBatch(store, kind, key, batch, plain, mode, progress)
+    if kind == 'hardware':
+        hwCache.invalidate()
+    if progress['inserted'] or progress['updated']:
+        collectionVersions.bump(store, kind)
+    progress['elapsedSeconds'] = round(time.perf_counter() - started, 3)
+    progress['done'] = True
+    yield dict(progress)
+
+
+def _writeBatch(store, kind, key, docs, plain, mode, progress):
+    # Hash every plain-text password of the batch in one pass across the pool
+    pending = [i for i, password in enumerate(plain) if password]
+    if pending:
+        hashes = passwordHasher.hashMany(plain[i] for i in pending)
+        for i, hashed in zip(pending, hashes):
+            docs[i]['password'] = hashed
+
+    counts = store.bulkLoad(kind, docs, upsert=(mode == 'upsert'))
+    progress['inserted'] += counts['inserted']
+    progress['updated'] += counts['updated']
+    progress['skipped'] += counts['duplicates']
+    progress['failed'] += len(counts['errors'])
+    for index, message in counts['errors']:
+        _recordError(progress, f"{key}={docs[index].get(key)}: {message}")
+
+
+def _recordError(progress, message):
+    if len(progress['errors']) < MAX_REPORTED_ERRORS:
+        progress['errors'].append(message)
+
+
+# ============================================================
+# Export
+# ============================================================
+def exportRecords(store, kind, fmt='ndjson'):
+    """Yield the collection as NDJSON or CSV text, one chunk per record."""
+    if kind not in COLLECTIONS:
+        raise ValueError(f"kind must be one of: {', '.join(COLLECTIONS)}")
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+    cursor = store.exportDocs(kind)
+
+    if fmt == 'csv':
+        fields = CSV_FIELDS[kind]
+        yield _csvLine(fields)
+        for doc in cursor:
+            record = _exportRecord(kind, doc)
+            yield _csvLine([_csvCell(record.get(field)) for field in fields])
+    else:
+        for doc in cursor:
+            yield json.dumps(_exportRecord(kind, doc)) + '\n'
+
+
+def _exportRecord(kind, doc):
+    doc = dict(doc)
+    doc.pop('id', None)
+    if kind == 'users':
+        doc['passwordHash'] = doc.pop('password', None)
+    if kind == 'projects':
+        # Leases belong to the running deployment's expiry scheduler
+        doc.pop('leases', None)
+    return doc
+
+
+def _csvCell(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+def _csvLine(values):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow(values)
+    return buffer.getvalue()
+
+
+# ============================================================
+# CLI
+# ============================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of users, projects and hardware sets.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    imp = sub.add_parser('import', help="import records from a file ('-' for stdin)")
+    imp.add_argument('kind', choices=list(COLLECTIONS))
+    imp.add_argument('path')
+    imp.add_argument('--format', choices=FORMATS, default=None, help="default: from the file extension")
+    imp.add_argument('--mode', choices=MODES, default='insert')
+    imp.add_argument('--batch-size', type=int, default=BULK_BATCH_SIZE)
+
+    exp = sub.add_parser('export', help="export a collection")
+    exp.add_argument('kind', choices=list(COLLECTIONS))
+    exp.add_argument('-o', '--output', default='-')
+    exp.add_argument('--format', choices=FORMATS, default=None, help="default: from the file extension")
+
+    args = parser.parse_args(argv)
+
+    import storage
+    store = storage.getStorage()
+
+    if args.command == 'import':
+        fmt = args.format or _formatFor(args.path)
+        stream = sys.stdin if args.path == '-' else open(args.path, newline='', encoding='utf-8')
+        with stream:
+            for progress in importRecords(store, args.kind, stream, fmt, args.mode, args.batch_size):
+                print(
+                    f"{args.kind}: read {progress['read']}, inserted {progress['inserted']}, "
+                    f"updated {progress['updated']}, skipped {progress['skipped']}, "
+                    f"failed {progress['failed']} ({progress['elapsedSeconds']}s)",
+                    file=sys.stderr
+                )
+        for error in progress['errors']:
+            print(f"  {error}", file=sys.stderr)
+        return 0 if progress['failed'] == 0 else 1
+
+    fmt = args.format or _formatFor(args.output)
+    out = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    count = 0
+    with out:
+        for chunk in exportRecords(store, args.kind, fmt):
+            out.write(chunk)
+            count += 1
+    print(f"{args.kind}: exported {count - (1 if fmt == 'csv' else 0)} records", file=sys.stderr)
+    return 0
+
+
+def _formatFor(path):
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+if __name__ == '__main__':
+    sys.exit(main())
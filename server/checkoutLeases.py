@@ -0,0 +1,233 @@
+# checkoutLeases.py
+import datetime
+import heapq
+import os
+import threading
+import time
+import checkoutLedger
+import collectionVersions
+import inventoryEvents
+from bson import ObjectId
+
+'''
+Time-limited checkouts.
+
+POST /projects/checkout may carry "leaseSeconds". The lease is stored in the
+project document (project.leases) by the same atomic update that checks the
+units out:
+
+    {'leaseId', 'hwName', 'username', 'qty', 'expiresAt'}
+
+A manual check-in (or batch check-in) uses up the user's leases on that set
+by the amount returned, oldest first, in the same update, so a lease only
+ever covers units still out under it. When a lease expires, what is left of
+it goes back to the project's pool, clamped to what the user still holds.
+
+Each worker keeps the leases it knows about in a heap ordered by expiry and
+sleeps until the earliest one is due, so outstanding leases cost nothing
+until then. Due leases are returned in batches: one pipeline update per
+project, which returns the units and removes the leases together. Amounts
+come from the leases still in the document, so a lease is returned once even
+when several workers hold it, and only the worker that returned it records
+the units that actually went back in the ledger (checkoutLedger.py).
+
+On start, and every LEASE_RECOVERY_SECONDS, a worker also reads the due
+leases through the leases_expiry index (dbIndexes.py). That recovers leases
+whose worker crashed or restarted, and leases created by other workers,
+without scanning the project collection.
+
+Environment variables:
+    LEASE_MAX_SECONDS       longest lease accepted       (default 30 days)
+    LEASE_BATCH_SIZE        leases returned per batch    (default 500)
+    LEASE_RECOVERY_SECONDS  interval of the index sweep  (default 60)
+'''
+
+LEASE_MAX_SECONDS = int(os.environ.get('LEASE_MAX_SECONDS', 30 * 24 * 3600))
+LEASE_BATCH_SIZE = int(os.environ.get('LEASE_BATCH_SIZE', 500))
+LEASE_RECOVERY_SECONDS = float(os.environ.get('LEASE_RECOVERY_SECONDS', 60))
+
+_cond = threading.Condition()
+_heap = []            # (expiresAt timestamp, leaseId, projectName, lease)
+_scheduled = set()    # leaseIds in _heap
+_thread = None
+
+_stats = {
+    'scheduled': 0,
+    'expired': 0,
+    'projectsUpdated': 0,
+    'recovered': 0
+}
+
+
+# ============================================================
+# Creating leases
+# ============================================================
+def newLease(hwName, username, qty, leaseSeconds):
+    """
+    Build the lease for a checkout, or (None, None) if leaseSeconds is not set.
+    Returns (lease, error message).
+    """
+    if leaseSeconds is None:
+        return (None, None)
+    try:
+        seconds = int(leaseSeconds)
+    except (TypeError, ValueError):
+        return (None, "leaseSeconds must be a positive integer.")
+    try:
+        qty = int(qty)
+    except (TypeError, ValueError):
+        return (None, "Quantity must be a positive integer.")
+    if not 0 < seconds <= LEASE_MAX_SECONDS:
+        return (None, f"leaseSeconds must be between 1 and {LEASE_MAX_SECONDS}.")
+    # BSON dates have millisecond precision; round so the heap and MongoDB agree
+    expiresAt = _now() + datetime.timedelta(seconds=seconds)
+    lease = {
+        'leaseId': str(ObjectId()),
+        'hwName': hwName,
+        'username': username,
+        'qty': qty,
+        'expiresAt': expiresAt.replace(microsecond=expiresAt.microsecond // 1000 * 1000)
+    }
+    return (lease, None)
+
+
+def leaseSummary(lease):
+    """JSON-friendly view of a lease for API responses."""
+    return {
+        'leaseId': lease['leaseId'],
+        'qty': lease['qty'],
+        'expiresAt': lease['expiresAt'].isoformat()
+    }
+
+
+def schedule(projectName, lease):
+    """Track a lease stored by this worker; wakes the scheduler if it is due first."""
+    with _cond:
+        if _push(projectName, lease):
+            _stats['scheduled'] += 1
+            _cond.notify()
+
+
+def _push(projectName, lease):
+    if lease['leaseId'] in _scheduled:
+        return False
+    _scheduled.add(lease['leaseId'])
+    heapq.heappush(_heap, (_timestamp(lease['expiresAt']), lease['leaseId'], projectName, lease))
+    return True
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _timestamp(expiresAt):
+    # pymongo returns naive UTC datetimes unless the client is tz_aware
+    if expiresAt.tzinfo is None:
+        expiresAt = expiresAt.replace(tzinfo=datetime.timezone.utc)
+    return expiresAt.timestamp()
+
+
+def getStats():
+    with _cond:
+        stats = dict(_stats)
+        stats['outstanding'] = len(_heap)
+        stats['nextExpiry'] = (
+            datetime.datetime.fromtimestamp(_heap[0][0], datetime.timezone.utc).isoformat() if _heap else None
+        )
+    stats['running'] = _thread is not None and _thread.is_alive()
+    return stats
+
+
+# ============================================================
+# Scheduler
+# ============================================================
+def start(store):
+    """Load outstanding leases and start the expiry thread. Call once per worker."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return False
+    _recover(store, dueBefore=None)
+    _thread = threading.Thread(target=_run, args=(store,), name='lease-expiry', daemon=True)
+    _thread.start()
+    return True
+
+
+def _run(store):
+    nextRecovery = time.monotonic() + LEASE_RECOVERY_SECONDS
+    while True:
+        try:
+            with _cond:
+                timeout = nextRecovery - time.monotonic()
+                if _heap:
+                    timeout = min(timeout, _heap[0][0] - time.time())
+                if timeout > 0:
+                    _cond.wait(timeout)
+                due = _popDue()
+
+            if due:
+                expireLeases(store, due)
+            if time.monotonic() >= nextRecovery:
+                _recover(store, dueBefore=_now())
+                nextRecovery = time.monotonic() + LEASE_RECOVERY_SECONDS
+        except Exception as e:
+            print(f"Lease expiry error: {e}")
+            time.sleep(1)
+
+
+def _popDue():
+    # Caller holds _cond
+    now = time.time()
+    due = []
+    while _heap and _heap[0][0] <= now and len(due) < LEASE_BATCH_SIZE:
+        _, leaseId, projectName, lease = heapq.heappop(_heap)
+        _scheduled.discard(leaseId)
+        due.append((projectName, lease))
+    return due
+
+
+def _recover(store, dueBefore):
+    # Read through the leases_expiry index first; schedule() is not held up meanwhile
+    found = list(store.iterLeases(dueBefore))
+    added = 0
+    with _cond:
+        for projectName, lease in found:
+            added += _push(projectName, lease)
+        _stats['recovered'] += added
+        if added:
+            _cond.notify()
+    return added
+
+
+def expireLeases(store, due):
+    """Return the units of due [(projectName, lease)], one atomic update per project."""
+    byProject = {}
+    for projectName, lease in due:
+        byProject.setdefault(projectName, []).append(lease)
+    returned = store.returnLeases(byProject)
+    updated = {projectName for projectName, _, _ in returned}
+
+    with _cond:
+        _stats['expired'] += len(due)
+        _stats['projectsUpdated'] += len(updated)
+    if updated:
+        collectionVersions.bump(store, 'projects')
+        checkoutLedger.record(store, [
+            checkoutLedger.entry('leaseExpired', projectName, lease['hwName'], lease['username'], qty)
+            for projectName, lease, qty in returned
+        ])
+        # Amounts were clamped server-side; subscribers refetch
+        inventoryEvents.publish(dict(inventoryEvents.RESYNC))
+        print(f"Returned {len(due)} expired lease(s) in {len(updated)} project(s)")
+    return len(updated)
+
+
+def _resetAfterFork():
+    global _cond, _thread
+    _cond = threading.Condition()
+    _heap.clear()
+    _scheduled.clear()
+    _thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
@@ -0,0 +1,331 @@
+# checkoutLedger.py
+import argparse
+import datetime
+import os
+import sys
+import threading
+import time
+from bson import ObjectId
+from bson.errors import InvalidId
+from mongoQueries import LEDGER_DATABASE, LEDGER_ENTRIES
+
+'''
+Append-only ledger of hardware movements, with periodic snapshots.
+
+The project documents only hold current totals. Every movement is also
+appended to the ledger (Ledger.entries on MongoDB) once its write succeeded:
+
+    {'_id': ObjectId, 'at': datetime, 'action', 'projectName', 'hwName',
+     'username', 'qty'}
+
+    reserve       createProject took qty of hwName from the global pool
+                  (username None); the project's capacity for the set
+    checkout      username checked out qty (checkOutHW, batches)
+    checkin       username checked in qty (the processed amount)
+    leaseExpired  a lease ran out and qty went back from username (the
+                  amount actually returned, after the check-in clamp)
+
+Entries are single inserts, never updates, and are indexed by username,
+projectName and hwName together with _id, so "what did amy do last week"
+or "every movement of HW1" is an index range scan (GET /admin/ledger).
+
+A snapshot folds the ledger into per-project state ({hwName: {'capacity',
+'used', 'user_usage'}}) up to a boundary id. Rebuilding current state reads
+the latest snapshot and replays only the entries after it (currentState),
+which is how a bad update is found and undone: compare with `python
+checkoutLedger.py diff`. When the latest snapshot is older than
+LEDGER_SNAPSHOT_SECONDS, the worker that claims the current interval
+(Ledger.claims, one atomic upsert) takes the next. Entries from the last
+LEDGER_SETTLE_SECONDS are left to the tail, because ids come from several
+workers' clocks and a late insert could otherwise land before the boundary.
+
+Recording never fails the request it belongs to; a failed append is logged.
+Documents written around the app (bulkData imports, mongosh) are not in the
+ledger and show up in the diff.
+
+Environment variables:
+    LEDGER_SNAPSHOT_SECONDS  snapshot interval            (default 3600)
+    LEDGER_SETTLE_SECONDS    age before an entry is snapshotted (default 60)
+    LEDGER_PAGE_SIZE         max entries per query page   (default 500)
+'''
+
+LEDGER_SNAPSHOT_SECONDS = float(os.environ.get('LEDGER_SNAPSHOT_SECONDS', 3600))
+LEDGER_SETTLE_SECONDS = float(os.environ.get('LEDGER_SETTLE_SECONDS', 60))
+LEDGER_PAGE_SIZE = int(os.environ.get('LEDGER_PAGE_SIZE', 500))
+
+# Entry fields a query may filter on (all indexed with _id)
+FILTERS = ('username', 'projectName', 'hwName')
+
+_thread = None
+
+
+# ============================================================
+# Recording
+# ============================================================
+def entry(action, projectName, hwName, username, qty):
+    return {
+        'at': datetime.datetime.now(datetime.timezone.utc),
+        'action': action,
+        'projectName': projectName,
+        'hwName': hwName,
+        'username': username,
+        'qty': int(qty)
+    }
+
+
+def record(store, entries):
+    """Append entries (already applied). A failure is logged, never raised."""
+    entries = [e for e in entries if e['qty'] > 0]
+    if not entries:
+        return
+    try:
+        store.appendLedger(entries)
+    except Exception as e:
+        print(f"Error appending {len(entries)} ledger entries: {e}")
+
+
+async def recordAsync(client, entries):
+    """Motor counterpart of record, for the async* modules."""
+    entries = [e for e in entries if e['qty'] > 0]
+    if not entries:
+        return
+    try:
+        await client[LEDGER_DATABASE][LEDGER_ENTRIES].insert_many(entries, ordered=False)
+    except Exception as e:
+        print(f"Error appending {len(entries)} ledger entries: {e}")
+
+
+def reservationEntries(projectName, requested):
+    """Entries for a new project's reservations ({hwName: qty})."""
+    return [entry('reserve', projectName, hwName, None, qty) for hwName, qty in requested.items()]
+
+
+def batchEntries(projectName, username, results):
+    """Entries for the applied operations of a batch (projectsDatabase.batchResult dicts)."""
+    return [
+        entry(r['action'], projectName, r['hwName'], username, r['processedQty'])
+        for r in results if r['success']
+    ]
+
+
+# ============================================================
+# Range queries
+# ============================================================
+def query(store, filters, since=None, until=None, after=None, limit=None):
+    """
+    Entries matching filters ({field: value} over FILTERS) between since and
+    until (ISO 8601), oldest first. Returns (entries, nextCursor); pass
+    nextCursor back as after for the next page. Raises ValueError on bad input.
+    """
+    unknown = [f for f in filters if f not in FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown filter(s): {', '.join(unknown)}. Allowed: {', '.join(FILTERS)}")
+    limit = limit or LEDGER_PAGE_SIZE
+    if not 0 < limit <= LEDGER_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {LEDGER_PAGE_SIZE}.")
+
+    lower = _objectId(after, 'after') if after else None
+    if since:
+        bound = ObjectId.from_datetime(_parseTime(since, 'since'))
+        # from_datetime ids sort before every id of that second; step back so it is included
+        lower = max(lower, _previous(bound)) if lower else _previous(bound)
+    upper = ObjectId.from_datetime(_parseTime(until, 'until')) if until else None
+
+    entries = list(store.findLedger(filters, after=lower, before=upper, limit=limit))
+    nextCursor = str(entries[-1]['_id']) if len(entries) == limit else None
+    return ([_entrySummary(e) for e in entries], nextCursor)
+
+
+def _entrySummary(e):
+    summary = {k: e.get(k) for k in ('action', 'projectName', 'hwName', 'username', 'qty')}
+    summary['id'] = str(e['_id'])
+    summary['at'] = _aware(e['at']).isoformat()
+    return summary
+
+
+def _objectId(value, name):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        raise ValueError(f"{name} must be a ledger entry id.")
+
+
+def _parseTime(value, name):
+    try:
+        return _aware(datetime.datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an ISO 8601 date or time.")
+
+
+def _aware(at):
+    # pymongo returns naive UTC datetimes unless the client is tz_aware
+    return at if at.tzinfo is not None else at.replace(tzinfo=datetime.timezone.utc)
+
+
+def _previous(oid):
+    # Largest id below oid (from_datetime ids end in zeros; subtract one)
+    return ObjectId((int(str(oid), 16) - 1).to_bytes(12, 'big'))
+
+
+# ============================================================
+# Replay and snapshots
+# ============================================================
+def replay(state, entries):
+    """Apply entries, oldest first, to state {projectName: {hwName: {...}}}. Returns state."""
+    for e in entries:
+        hw = state.setdefault(e['projectName'], {}).setdefault(
+            e['hwName'], {'capacity': 0, 'used': 0, 'user_usage': {}}
+        )
+        qty = e['qty']
+        if e['action'] == 'reserve':
+            hw['capacity'] += qty
+        elif e['action'] == 'checkout':
+            hw['used'] += qty
+            hw['user_usage'][e['username']] = hw['user_usage'].get(e['username'], 0) + qty
+        else:
+            # checkin and leaseExpired: clamped to what the user holds, as on the server
+            held = hw['user_usage'].get(e['username'], 0)
+            returned = min(qty, held)
+            hw['used'] = max(0, hw['used'] - returned)
+            hw['user_usage'][e['username']] = held - returned
+    return state
+
+
+def currentState(store, projectName=None):
+    """
+    Rebuild the hardware state of every project (or just projectName) from
+    the latest snapshot plus the entries after it.
+    """
+    snapshot, projects = store.loadLedgerSnapshot()
+    state = {p['projectName']: p['hwSets'] for p in projects
+             if projectName is None or p['projectName'] == projectName}
+    after = snapshot['upTo'] if snapshot else None
+    filters = {'projectName': projectName} if projectName is not None else {}
+    return replay(state, store.findLedger(filters, after=after))
+
+
+def takeSnapshot(store):
+    """Fold the settled ledger into a new snapshot. Returns its header."""
+    snapshot, projects = store.loadLedgerSnapshot()
+    state = {p['projectName']: p['hwSets'] for p in projects}
+    settled = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=LEDGER_SETTLE_SECONDS)
+    upTo = _previous(ObjectId.from_datetime(settled))
+    if snapshot and snapshot['upTo'] >= upTo:
+        return snapshot
+
+    count = 0
+    entries = store.findLedger({}, after=snapshot['upTo'] if snapshot else None, before=ObjectId.from_datetime(settled))
+    for e in entries:
+        replay(state, [e])
+        count += 1
+    header = {
+        '_id': ObjectId(),
+        'createdAt': datetime.datetime.now(datetime.timezone.utc),
+        'upTo': upTo,
+        'entries': count + (snapshot['entries'] if snapshot else 0),
+        'projects': len(state)
+    }
+    store.saveLedgerSnapshot(header, [{'projectName': name, 'hwSets': hwSets} for name, hwSets in state.items()])
+    print(f"Ledger snapshot: {count} new entries, {len(state)} projects")
+    return header
+
+
+def diff(store, state=None, projectName=None):
+    """
+    [(projectName, hwName, field, ledger value, stored value)] wherever the
+    stored projects (or just projectName) disagree with the ledger state.
+    """
+    state = currentState(store, projectName) if state is None else state
+    if projectName is not None:
+        project = store.findProject(projectName)
+        stored = {projectName: project['hwSets']} if project else {}
+    else:
+        stored = {p['projectName']: p.get('hwSets', {}) for p in store.iterProjects(fields=['hwSets'])}
+
+    mismatches = []
+    for name in sorted(set(state) | set(stored)):
+        have = stored.get(name, {})
+        expected = state.get(name, {})
+        for hwName in sorted(set(have) | set(expected)):
+            want = expected.get(hwName, {'capacity': 0, 'used': 0, 'user_usage': {}})
+            hw = have.get(hwName, {})
+            for field in ('capacity', 'used'):
+                if want[field] != hw.get(field, 0):
+                    mismatches.append((name, hwName, field, want[field], hw.get(field, 0)))
+            wantUsage = {u: n for u, n in want['user_usage'].items() if n}
+            haveUsage = {u: n for u, n in hw.get('user_usage', {}).items() if n}
+            if wantUsage != haveUsage:
+                mismatches.append((name, hwName, 'user_usage', wantUsage, haveUsage))
+    return mismatches
+
+
+# ============================================================
+# Periodic snapshots
+# ============================================================
+def start(store):
+    """Start the snapshot thread. Call once per worker."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return False
+    _thread = threading.Thread(target=_run, args=(store,), name='ledger-snapshot', daemon=True)
+    _thread.start()
+    return True
+
+
+def _run(store):
+    while True:
+        try:
+            snapshot, _ = store.loadLedgerSnapshot(headerOnly=True)
+            now = time.time()
+            age = now - _aware(snapshot['createdAt']).timestamp() if snapshot else LEDGER_SNAPSHOT_SECONDS
+            wait = LEDGER_SNAPSHOT_SECONDS - age
+            if wait <= 0:
+                # Every worker finds the snapshot stale; the one that claims this interval takes the next
+                slot = now // LEDGER_SNAPSHOT_SECONDS * LEDGER_SNAPSHOT_SECONDS
+                if store.claimLedgerSnapshot(datetime.datetime.fromtimestamp(slot, datetime.timezone.utc)):
+                    takeSnapshot(store)
+                    wait = LEDGER_SNAPSHOT_SECONDS
+                else:
+                    wait = slot + LEDGER_SNAPSHOT_SECONDS - now
+            time.sleep(max(1.0, wait))
+        except Exception as e:
+            print(f"Ledger snapshot error: {e}")
+            time.sleep(60)
+
+
+def _resetAfterFork():
+    global _thread
+    _thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
+
+
+# ============================================================
+# Command line
+# ============================================================
+def main(argv=None):
+    import storage
+
+    parser = argparse.ArgumentParser(description="Checkout ledger snapshots and consistency checks.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('snapshot', help="fold the settled ledger into a new snapshot")
+    sub.add_parser('diff', help="list where the project documents disagree with the ledger")
+    args = parser.parse_args(argv)
+
+    store = storage.getStorage()
+    if args.command == 'snapshot':
+        header = takeSnapshot(store)
+        print(f"Snapshot {header['_id']} up to {header['upTo']} ({header['entries']} entries)")
+        return 0
+
+    mismatches = diff(store)
+    for projectName, hwName, field, want, have in mismatches:
+        print(f"{projectName} / {hwName} {field}: ledger {want}, stored {have}")
+    print(f"{len(mismatches)} mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
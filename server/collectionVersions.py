@@ -0,0 +1,79 @@
+# collectionVersions.py
+import hashlib
+from mongoQueries import VERSIONS_DATABASE, VERSIONS_COLLECTION, VERSION_INC, versionOps
+
+'''
+Per-collection change counters behind the ETags of GET /projects and
+GET /hardware.
+
+Every mutation in the database modules bumps the counter of each kind it
+touches (projects, hardware) once its write has succeeded. The list routes
+read the counter before the data, so the ETag they send never claims newer
+data than the body holds; a request whose If-None-Match still matches gets
+304 Not Modified for the price of one counter read, with no collection scan
+and no body. The counters live in the storage engine (Meta.versions on
+MongoDB), so every worker sees every other worker's writes.
+
+Writes made outside the app (mongosh, restores) do not bump the counters;
+bump them by hand or restart with a fresh counter after such changes.
+'''
+
+
+def bump(store, *kinds):
+    """Advance the counters of kinds. A failure is logged, never raised: the write already happened."""
+    try:
+        store.bumpVersion(kinds)
+    except Exception as e:
+        print(f"Error bumping version of {', '.join(kinds)}: {e}")
+
+
+# ============================================================
+# Motor counterparts for the async* modules
+# ============================================================
+async def bumpAsync(client, *kinds):
+    try:
+        versions = client[VERSIONS_DATABASE][VERSIONS_COLLECTION]
+        if len(kinds) == 1:
+            await versions.update_one({'_id': kinds[0]}, VERSION_INC, upsert=True)
+        else:
+            await versions.bulk_write(versionOps(kinds), ordered=False)
+    except Exception as e:
+        print(f"Error bumping version of {', '.join(kinds)}: {e}")
+
+
+async def getVersionAsync(client, kind):
+    doc = await client[VERSIONS_DATABASE][VERSIONS_COLLECTION].find_one({'_id': kind})
+    return doc['version'] if doc else 0
+
+
+# ============================================================
+# ETags
+# ============================================================
+def etag(kind, version, variant=None):
+    """
+    Strong ETag (quoted) for a listing of kind at version. variant identifies
+    the query (filters, page, fields) when the same version has several bodies.
+    """
+    tag = f'{kind}-{version}'
+    if variant:
+        tag += '-' + hashlib.sha1(variant.encode('utf-8')).hexdigest()[:12]
+    return f'"{tag}"'
+
+
+def notModified(ifNoneMatch, tag):
+    """True if an If-None-Match header value matches tag (weak comparison, RFC 9110)."""
+    if not ifNoneMatch:
+        return False
+    if ifNoneMatch.strip() == '*':
+        return True
+    for candidate in ifNoneMatch.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+# Sent with every tagged list so browsers revalidate instead of reusing silently
+CACHE_CONTROL = 'no-cache'
@@ -0,0 +1,416 @@
+# counterShards.py
+import os
+import random
+import threading
+import time
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+from mongoQueries import transactionsUnsupported
+
+'''
+Sharded counters for hot hardware sets (MongoDB engine, app.py).
+
+A checkout is one conditional update of the project document, and a project
+reservation one of the hardware set's document, so during a class-wide rush
+every writer to the same set queues on that one document. With
+COUNTER_SHARDS=N (N > 1) hardware sets and project sets created from then on
+keep their counters in N sub-counter documents in Counters.shards instead:
+
+    {'kind': 'projects' | 'hardware', 'name': projectName | hwName, 'hwName',
+     'shard': i, 'free': units left, 'usage': {username: units held}}
+
+The free units (a project set's headroom, a hardware set's availability) are
+split across the shards. A writer picks a random shard and takes from it with
+one conditional update, so N writers mostly land on N different documents.
+If that shard is short it takes from the fullest one, and if no single shard
+has enough but the shards do together, the free units are gathered into one
+shard first. Check-ins return units to the shards the user's holdings are on.
+
+Moving free units between shards (gather, rebalance) takes two updates. They
+run in a transaction where the server supports them. On a standalone server
+the donor records the move it is making ('moving': {'id', 'to', 'amount'})
+in the same update that takes the units, and the receiving shard lists the
+ids it has been credited with ('received'), so a move interrupted by a
+stopped worker counts as still free on the donor and is finished by the
+next rebalance of the set, without crediting anything twice.
+
+The parent document keeps 'capacity', marks the set with 'shards': N, and
+holds a merged copy of 'used' / 'user_usage' / 'availability'. MongoStorage
+merges the shards on read (findProject, iterProjects, the hardware reads);
+the background thread here re-spreads the free units of sets whose shards
+became uneven and writes the merged values back to the parent every
+COUNTER_REBALANCE_SECONDS, which is what /api/inventory aggregates.
+
+Whether a set is sharded never changes once created, so single-document
+updates carry a 'shards does not exist' guard and can never touch a sharded
+set; asyncApp.py (Motor) relies on that guard and leaves writes to sharded
+sets to app.py, merging their shards on its hardware reads (mergeAsync). The in-memory engine has no document locks and ignores the setting.
+
+Environment variables:
+    COUNTER_SHARDS             sub-counters per new set; 1 = off (default 1)
+    COUNTER_REBALANCE_SECONDS  rebalance / merge-back interval (default 5)
+'''
+
+COUNTER_SHARDS = int(os.environ.get('COUNTER_SHARDS', 1))
+COUNTER_REBALANCE_SECONDS = float(os.environ.get('COUNTER_REBALANCE_SECONDS', 5))
+
+SHARDS_DATABASE = 'Counters'
+SHARDS_COLLECTION = 'shards'
+
+_lock = threading.Lock()
+_known = {}           # (kind, name, hwName) -> shard count, for sets seen to be sharded
+_dirty = set()        # (kind, name, hwName) written since the last rebalance
+_thread = None
+_transactions = True  # cleared once the server turns out to have none
+
+_stats = {
+    'taken': 0,
+    'spilled': 0,
+    'gathered': 0,
+    'rebalanced': 0,
+    'recovered': 0,
+    'merged': 0
+}
+
+
+def enabled():
+    """True if new sets are created sharded."""
+    return COUNTER_SHARDS > 1
+
+
+def projectKey(projectName, hwName):
+    return {'kind': 'projects', 'name': projectName, 'hwName': hwName}
+
+
+def hardwareKey(hwName):
+    return {'kind': 'hardware', 'name': hwName, 'hwName': hwName}
+
+
+def _ident(key):
+    return (key['kind'], key['name'], key['hwName'])
+
+
+def remember(key, shards):
+    with _lock:
+        _known[_ident(key)] = shards
+
+
+def shardsOf(key):
+    """Shard count of a set seen to be sharded, else None (unknown or not sharded)."""
+    with _lock:
+        return _known.get(_ident(key))
+
+
+def _touch(key, stat):
+    with _lock:
+        _dirty.add(_ident(key))
+        _stats[stat] += 1
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats['knownSets'] = len(_known)
+        stats['pending'] = len(_dirty)
+    stats['shards'] = COUNTER_SHARDS
+    stats['running'] = _thread is not None and _thread.is_alive()
+    return stats
+
+
+# ============================================================
+# Creating shards
+# ============================================================
+def split(total, shards):
+    """Split total into shards near-equal non-negative parts."""
+    share, extra = divmod(max(0, total), shards)
+    return [share + (1 if i < extra else 0) for i in range(shards)]
+
+
+def newShards(key, free, shards=None, usage=None):
+    """Shard documents for a new set; any existing usage goes on shard 0."""
+    shards = shards or COUNTER_SHARDS
+    return [
+        {**key, 'shard': i, 'free': part, 'usage': dict(usage or {}) if i == 0 else {}}
+        for i, part in enumerate(split(free, shards))
+    ]
+
+
+# ============================================================
+# Counter operations (all take an optional session for transactions)
+# ============================================================
+def take(coll, key, shards, qty, username=None, session=None):
+    """
+    Move qty units from free to username's usage (or just out of free, for a
+    hardware reservation). Returns True if taken, False if the set has fewer
+    than qty free in total.
+    """
+    inc = {'free': -qty}
+    if username is not None:
+        inc[f'usage.{username}'] = qty
+
+    # A random shard first, so concurrent writers spread over the documents
+    shard = random.randrange(shards)
+    if coll.update_one({**key, 'shard': shard, 'free': {'$gte': qty}}, {'$inc': inc}, session=session).matched_count:
+        _touch(key, 'taken')
+        return True
+
+    # That one is short: the fullest shard that still fits
+    if _takeFullest(coll, key, qty, inc, session):
+        _touch(key, 'spilled')
+        return True
+
+    # Enough in total but spread too thin: gather into one shard and retry once
+    if _gather(coll, key, qty, session) and _takeFullest(coll, key, qty, inc, session):
+        _touch(key, 'gathered')
+        return True
+    return False
+
+
+def _takeFullest(coll, key, qty, inc, session):
+    return coll.find_one_and_update(
+        {**key, 'free': {'$gte': qty}}, {'$inc': inc},
+        sort=[('free', -1)], projection={'_id': 1}, session=session
+    ) is not None
+
+
+def give(coll, key, shards, qty, username=None, session=None):
+    """
+    Return units to free. With username, return up to qty of what the user
+    holds across the shards (clamped like checkIn) and return
+    (held before, returned); without, add qty to a random shard.
+    """
+    if username is None:
+        coll.update_one({**key, 'shard': random.randrange(shards)}, {'$inc': {'free': qty}}, session=session)
+        _touch(key, 'taken')
+        return (None, qty)
+
+    held_path = f'usage.{username}'
+    holdings = list(coll.find({**key, held_path: {'$gt': 0}}, {held_path: 1}, session=session))
+    heldBefore = sum(doc['usage'][username] for doc in holdings)
+    returned = 0
+    for doc in holdings:
+        remaining = qty - returned
+        if remaining <= 0:
+            break
+        amount = {'$min': [remaining, f'${held_path}']}
+        before = coll.find_one_and_update(
+            {'_id': doc['_id'], held_path: {'$gt': 0}},
+            [{'$set': {
+                'free': {'$add': ['$free', amount]},
+                held_path: {'$subtract': [f'${held_path}', amount]}
+            }}],
+            projection={held_path: 1},
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if before is not None:
+            returned += min(remaining, before['usage'][username])
+    if returned:
+        _touch(key, 'taken')
+    return (heldBefore, returned)
+
+
+def setFree(coll, key, shards, value, session=None):
+    """Move the set's total free units to value (hardware availability), shard by shard."""
+    docs = list(coll.find(key, {'free': 1, 'moving': 1, 'received': 1}, session=session).sort('free', -1))
+    delta = value - sum(doc['free'] for doc in docs) - _movingTotal(docs)
+    if delta > 0:
+        coll.update_one({**key, 'shard': random.randrange(shards)}, {'$inc': {'free': delta}}, session=session)
+    for doc in docs:
+        if delta >= 0:
+            break
+        # Conditional, so a concurrent take is never driven below zero
+        amount = min(doc['free'], -delta)
+        if amount and coll.update_one(
+            {'_id': doc['_id'], 'free': {'$gte': amount}}, {'$inc': {'free': -amount}}, session=session
+        ).matched_count:
+            delta += amount
+    _touch(key, 'taken')
+
+
+def _move(coll, fromId, toId, amount, session):
+    # Both updates in one transaction; journaled on a standalone server
+    global _transactions
+    if session is not None:
+        return _moveSteps(coll, fromId, toId, amount, session)
+    if _transactions:
+        try:
+            with coll.database.client.start_session() as session:
+                return session.with_transaction(lambda s: _moveSteps(coll, fromId, toId, amount, s))
+        except OperationFailure as e:
+            if not transactionsUnsupported(e):
+                raise
+            _transactions = False
+    return _journaledMove(coll, fromId, toId, amount)
+
+
+def _moveSteps(coll, fromId, toId, amount, session):
+    # Conditional on the donor, so free never goes negative
+    if not coll.update_one({'_id': fromId, 'free': {'$gte': amount}}, {'$inc': {'free': -amount}},
+                           session=session).matched_count:
+        return False
+    coll.update_one({'_id': toId}, {'$inc': {'free': amount}}, session=session)
+    return True
+
+
+def _journaledMove(coll, fromId, toId, amount):
+    # One move in flight per donor; the units leave free and enter 'moving' together
+    move = {'id': ObjectId(), 'to': toId, 'amount': amount}
+    if not coll.update_one({'_id': fromId, 'free': {'$gte': amount}, 'moving': {'$exists': False}},
+                           {'$inc': {'free': -amount}, '$set': {'moving': move}}).matched_count:
+        return False
+    _finishMove(coll, fromId, move)
+    return True
+
+
+def _finishMove(coll, fromId, move):
+    # Every step can be repeated, so a move stopped anywhere is finished by running this again
+    coll.update_one({'_id': move['to'], 'received': {'$ne': move['id']}},
+                    {'$inc': {'free': move['amount']}, '$push': {'received': move['id']}})
+    coll.update_one({'_id': fromId, 'moving.id': move['id']}, {'$unset': {'moving': ''}})
+    coll.update_one({'_id': move['to']}, {'$pull': {'received': move['id']}})
+
+
+def _movingTotal(docs):
+    # Units taken from a donor by a journaled move but not yet credited to its target
+    received = {moveId for doc in docs for moveId in doc.get('received', [])}
+    return sum(doc['moving']['amount'] for doc in docs
+               if 'moving' in doc and doc['moving']['id'] not in received)
+
+
+def recoverMoves(coll, key):
+    """Finish the set's journaled moves that a stopped worker left half done. Returns how many."""
+    # Credited ids are read before the donors, so an id no donor lists any more is finished with
+    received = {moveId for doc in coll.find({**key, 'received.0': {'$exists': True}}, {'received': 1})
+                for moveId in doc['received']}
+    moving = list(coll.find({**key, 'moving': {'$exists': True}}, {'moving': 1}))
+    for doc in moving:
+        _finishMove(coll, doc['_id'], doc['moving'])
+    finished = received - {doc['moving']['id'] for doc in moving}
+    if finished:
+        coll.update_many(key, {'$pull': {'received': {'$in': list(finished)}}})
+    return len(moving)
+
+
+def _gather(coll, key, qty, session):
+    docs = list(coll.find(key, {'free': 1}, session=session).sort('free', -1))
+    if not docs or sum(doc['free'] for doc in docs) < qty:
+        return False
+    target = docs[0]
+    needed = qty - target['free']
+    for doc in docs[1:]:
+        if needed <= 0:
+            break
+        amount = min(doc['free'], needed)
+        if amount and _move(coll, doc['_id'], target['_id'], amount, session):
+            needed -= amount
+    return needed <= 0
+
+
+def rebalance(coll, key, session=None):
+    """Re-spread the set's free units evenly when a shard ran low. Returns True if anything moved."""
+    if session is None:
+        recovered = recoverMoves(coll, key)
+        if recovered:
+            with _lock:
+                _stats['recovered'] += recovered
+    docs = list(coll.find(key, {'free': 1, 'shard': 1}, session=session).sort('shard', 1))
+    if len(docs) < 2:
+        return False
+    targets = split(sum(doc['free'] for doc in docs), len(docs))
+    share = max(1, targets[-1])
+    if all(abs(doc['free'] - target) * 2 < share for doc, target in zip(docs, targets)):
+        return False
+    donors = [[doc['_id'], doc['free'] - t] for doc, t in zip(docs, targets) if doc['free'] > t]
+    moved = False
+    for doc, target in zip(docs, targets):
+        needed = target - doc['free']
+        for donor in donors:
+            if needed <= 0:
+                break
+            amount = min(donor[1], needed)
+            if amount and _move(coll, donor[0], doc['_id'], amount, session):
+                donor[1] -= amount
+                needed -= amount
+                moved = True
+    return moved
+
+
+def merge(coll, keys, session=None):
+    """Merged state of each key: {(kind, name, hwName): {'free', 'usage'}}."""
+    if not keys:
+        return {}
+    return _mergeDocs(coll.find({'$or': list(keys)}, _MERGE_FIELDS, session=session))
+
+
+async def mergeAsync(coll, keys):
+    """merge for asyncApp, on a Motor collection."""
+    if not keys:
+        return {}
+    return _mergeDocs([doc async for doc in coll.find({'$or': list(keys)}, _MERGE_FIELDS)])
+
+
+_MERGE_FIELDS = {'_id': 0, 'kind': 1, 'name': 1, 'hwName': 1, 'free': 1, 'usage': 1, 'moving': 1, 'received': 1}
+
+
+def _mergeDocs(docs):
+    bySet = {}
+    for doc in docs:
+        bySet.setdefault(_ident(doc), []).append(doc)
+    merged = {}
+    for ident, setDocs in bySet.items():
+        entry = merged[ident] = {'free': _movingTotal(setDocs), 'usage': {}}
+        for doc in setDocs:
+            entry['free'] += doc['free']
+            for username, held in doc.get('usage', {}).items():
+                entry['usage'][username] = entry['usage'].get(username, 0) + held
+    return merged
+
+
+# ============================================================
+# Background rebalance and merge-back
+# ============================================================
+def start(coll, writeBack):
+    """
+    Start the rebalance thread. writeBack({ident: merged}) stores the merged
+    values in the parent documents. Call once per worker.
+    """
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return False
+    _thread = threading.Thread(target=_run, args=(coll, writeBack), name='counter-rebalance', daemon=True)
+    _thread.start()
+    return True
+
+
+def _run(coll, writeBack):
+    while True:
+        time.sleep(COUNTER_REBALANCE_SECONDS)
+        with _lock:
+            idents = list(_dirty)
+            _dirty.clear()
+        if not idents:
+            continue
+        try:
+            keys = [{'kind': kind, 'name': name, 'hwName': hwName} for kind, name, hwName in idents]
+            rebalanced = sum(1 for key in keys if rebalance(coll, key))
+            writeBack(merge(coll, keys))
+            with _lock:
+                _stats['rebalanced'] += rebalanced
+                _stats['merged'] += len(keys)
+        except Exception as e:
+            print(f"Counter rebalance error: {e}")
+            with _lock:
+                _dirty.update(idents)
+
+
+def _resetAfterFork():
+    global _lock, _thread
+    _lock = threading.Lock()
+    _dirty.clear()
+    _thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
@@ -0,0 +1,179 @@
+# dbClient.py
+import atexit
+import os
+import threading
+import time
+import metrics
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient
+
+'''
+Process-wide MongoDB client registry.
+
+Every route shares one pooled MongoClient per process instead of opening a new
+one per request (each new client pays a DNS SRV lookup, TLS handshake and
+server discovery before its first query).
+
+The registry is fork-safe: a client is only ever used by the process that
+created it. Gunicorn forks its workers from the master, so a child drops any
+inherited client and lazily builds its own on first use (or in the
+post_worker_init hook, see gunicorn.conf.py).
+
+asyncApp.py uses getAsyncClient() instead, a Motor client with the same pool
+settings that lives on the server's event loop.
+
+Pool sizing is configured through environment variables:
+    MONGODB_URI                        connection string (required; there is
+                                       no default deployment)
+    MONGODB_MAX_POOL_SIZE              max sockets per server   (default 50)
+    MONGODB_MIN_POOL_SIZE              sockets kept open        (default 0)
+    MONGODB_MAX_IDLE_TIME_MS           idle socket lifetime     (default 60000)
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS                         (default 5000)
+    MONGODB_CONNECT_TIMEOUT_MS                                  (default 5000)
+'''
+
+MONGODB_URI = os.environ.get('MONGODB_URI')
+
+MAX_POOL_SIZE = int(os.environ.get('MONGODB_MAX_POOL_SIZE', 50))
+MIN_POOL_SIZE = int(os.environ.get('MONGODB_MIN_POOL_SIZE', 0))
+MAX_IDLE_TIME_MS = int(os.environ.get('MONGODB_MAX_IDLE_TIME_MS', 60000))
+SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGODB_SERVER_SELECTION_TIMEOUT_MS', 5000))
+CONNECT_TIMEOUT_MS = int(os.environ.get('MONGODB_CONNECT_TIMEOUT_MS', 5000))
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+_async_client = None
+_async_client_pid = None
+_commandListener = metrics.CommandListener()
+
+
+# ============================================================
+# Get the shared client for this process
+# ============================================================
+def requireUri():
+    """Return MONGODB_URI, or raise a RuntimeError explaining how to set it."""
+    if not MONGODB_URI:
+        raise RuntimeError(
+            "MONGODB_URI is not set. Export the connection string of your MongoDB deployment "
+            "(e.g. MONGODB_URI='mongodb+srv://<user>:<password>@<cluster>/'), "
+            "or run app.py with STORAGE_BACKEND=memory."
+        )
+    return MONGODB_URI
+
+
+def _clientOptions():
+    return {
+        'maxPoolSize': MAX_POOL_SIZE,
+        'minPoolSize': MIN_POOL_SIZE,
+        'maxIdleTimeMS': MAX_IDLE_TIME_MS,
+        'serverSelectionTimeoutMS': SERVER_SELECTION_TIMEOUT_MS,
+        'connectTimeoutMS': CONNECT_TIMEOUT_MS,
+        # Round trips per request and collection, exported on /metrics
+        'event_listeners': [_commandListener]
+    }
+
+
+def getClient():
+    """Return this process's pooled MongoClient, creating it on first use."""
+    global _client, _client_pid
+
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(requireUri(), connect=False, **_clientOptions())
+            _client_pid = os.getpid()
+        return _client
+
+
+def getAsyncClient():
+    """
+    Return this process's Motor client for asyncApp, creating it on first use.
+    Must be called from the event loop thread.
+    """
+    global _async_client, _async_client_pid
+    if _async_client is None or _async_client_pid != os.getpid():
+        _async_client = AsyncIOMotorClient(requireUri(), **_clientOptions())
+        _async_client_pid = os.getpid()
+    return _async_client
+
+
+def _resetAfterFork():
+    # The child must not touch (or close) sockets owned by the parent,
+    # so just forget the inherited clients and build fresh ones on demand.
+    global _client, _client_pid, _async_client, _async_client_pid, _lock
+    _client = None
+    _client_pid = None
+    _async_client = None
+    _async_client_pid = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
+
+
+# ============================================================
+# Warm-up and health checking
+# ============================================================
+def warmUp():
+    """
+    Open the pool before the first request arrives.
+    Returns True if the cluster answered a ping.
+    """
+    try:
+        getClient().admin.command('ping')
+        print(f"MongoDB client ready in worker {os.getpid()}")
+        return True
+    except Exception as e:
+        print(f"Error warming up MongoDB client: {e}")
+        return False
+
+
+def healthCheck():
+    """Ping the cluster and report round-trip latency and pool settings."""
+    start = time.perf_counter()
+    try:
+        getClient().admin.command('ping')
+        ok = True
+        err = None
+    except Exception as e:
+        ok = False
+        err = str(e)
+
+    return {
+        'ok': ok,
+        'error': err,
+        'latencyMs': round((time.perf_counter() - start) * 1000, 2),
+        'pid': os.getpid(),
+        'maxPoolSize': MAX_POOL_SIZE,
+        'minPoolSize': MIN_POOL_SIZE
+    }
+
+
+# ============================================================
+# Shutdown
+# ============================================================
+def closeClient():
+    """Close the client if this process owns it."""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def closeAsyncClient():
+    """Close the Motor client if this process owns it."""
+    global _async_client, _async_client_pid
+    if _async_client is not None and _async_client_pid == os.getpid():
+        _async_client.close()
+    _async_client = None
+    _async_client_pid = None
+
+
+atexit.register(closeClient)
@@ -0,0 +1,92 @@
+# dbIndexes.py
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+'''
+Index bootstrap for the Users, Projects and Hardware collections.
+
+Every lookup in the database modules goes through one of these keys, and the
+unique indexes are what make "insert and catch DuplicateKeyError" safe in
+addUser, createProject and createHardwareSet. createIndexes is a no-op for
+indexes that already exist, so this runs at every worker start.
+
+Run once by hand with:  python dbIndexes.py
+'''
+
+# (database, collection) -> indexes
+INDEXES = {
+    ('User', 'users'): [
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+        IndexModel([('projects', ASCENDING)], name='projects_membership'),
+    ],
+    ('Projects', 'project'): [
+        IndexModel([('projectName', ASCENDING)], name='projectName_unique', unique=True),
+        IndexModel([('users', ASCENDING)], name='users_membership'),
+        # Lease expiry sweep (checkoutLeases.py)
+        IndexModel([('leases.expiresAt', ASCENDING)], name='leases_expiry'),
+    ],
+    ('Hardware', 'Hardware_Sets'): [
+        IndexModel([('hwName', ASCENDING)], name='hwName_unique', unique=True),
+    ],
+    # Sub-counters of sharded sets (counterShards.py)
+    ('Counters', 'shards'): [
+        IndexModel([('kind', ASCENDING), ('name', ASCENDING), ('hwName', ASCENDING), ('shard', ASCENDING)],
+                   name='counter_shard_unique', unique=True),
+    ],
+    # Checkout ledger range queries and snapshots (checkoutLedger.py)
+    ('Ledger', 'entries'): [
+        IndexModel([('username', ASCENDING), ('_id', ASCENDING)], name='ledger_username'),
+        IndexModel([('projectName', ASCENDING), ('_id', ASCENDING)], name='ledger_projectName'),
+        IndexModel([('hwName', ASCENDING), ('_id', ASCENDING)], name='ledger_hwName'),
+    ],
+    ('Ledger', 'snapshots'): [
+        IndexModel([('upTo', ASCENDING)], name='snapshot_upTo'),
+    ],
+    ('Ledger', 'snapshotProjects'): [
+        IndexModel([('snapshot', ASCENDING), ('projectName', ASCENDING)], name='snapshot_project_unique',
+                   unique=True),
+    ],
+    # Utilization rollups (utilizationSeries.py); minute and hour buckets expire
+    ('Utilization', 'rollups'): [
+        IndexModel([('hwName', ASCENDING), ('projectName', ASCENDING), ('granularity', ASCENDING),
+                    ('start', ASCENDING)], name='rollup_series_unique', unique=True),
+        IndexModel([('expiresAt', ASCENDING)], name='rollup_expiry', expireAfterSeconds=0),
+    ],
+    # Shared rate limit buckets (rateLimits.py); dropped once they would be full again
+    ('RateLimits', 'buckets'): [
+        IndexModel([('expiresAt', ASCENDING)], name='bucket_expiry', expireAfterSeconds=0),
+    ],
+}
+
+
+# ============================================================
+# Create all indexes (idempotent)
+# ============================================================
+def ensureIndexes(client):
+    """Create any missing indexes. Returns True if every collection succeeded."""
+    ok = True
+    for (database, collection), indexes in INDEXES.items():
+        try:
+            client[database][collection].create_indexes(indexes)
+        except OperationFailure as e:
+            # e.g. existing duplicate names prevent a unique index from being built
+            print(f"Error creating indexes on {database}.{collection}: {e}")
+            ok = False
+    return ok
+
+
+async def ensureIndexesAsync(client):
+    """Motor counterpart of ensureIndexes, used by asyncApp."""
+    ok = True
+    for (database, collection), indexes in INDEXES.items():
+        try:
+            await client[database][collection].create_indexes(indexes)
+        except OperationFailure as e:
+            print(f"Error creating indexes on {database}.{collection}: {e}")
+            ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    import dbClient
+    print("Indexes ready." if ensureIndexes(dbClient.getClient()) else "Some indexes could not be created.")
@@ -0,0 +1,31 @@
+# gunicorn.conf.py
+# Picked up automatically by `gunicorn --chdir server app:app` (see Procfile).
+import os
+import secrets
+
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# Threaded workers: an open /events/inventory stream holds one thread, not the
+# whole worker. At most half the threads stream (inventoryEvents.py), so API
+# requests always have the other half.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+os.environ.setdefault('EVENT_MAX_STREAMS', str(max(1, threads // 2)))
+
+# Session tokens must verify in every worker: when no SESSION_SECRET is
+# configured, pick one in the master so the forked workers inherit it.
+os.environ.setdefault('SESSION_SECRET', secrets.token_hex(32))
+
+
+# app.py starts the storage engine and its background threads on the first
+# request of each process; do it here already so a worker's first request does
+# not pay for it. The master never touches the database, so workers start with
+# a clean registry.
+def post_worker_init(worker):
+    import app
+    app.startProcess()
+
+
+def worker_exit(server, worker):
+    import storage
+    storage.getStorage().close()
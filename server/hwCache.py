@@ -0,0 +1,142 @@
+# hwCache.py
+import os
+import threading
+import time
+
+'''
+In-process read-through cache of the hardware inventory served by GET /hardware.
+
+The whole Hardware_Sets listing is cached per worker for HW_CACHE_TTL seconds
+(default 5). Every write path in this process that changes a set's capacity or
+availability calls invalidate(), so a worker always sees its own writes
+immediately; writes made by other workers are picked up when the TTL expires,
+or immediately when HW_CACHE_CHANGE_STREAM=1 starts a change stream watcher
+(requires a replica set, e.g. Atlas).
+
+Callers that read the hardware change counter first (collectionVersions, as
+GET /hardware does) pass it along; an entry filled at another version counts
+as a miss, so another worker's write is served as soon as its bump is seen.
+
+Hit, miss and invalidation counters are reported on GET /health.
+'''
+
+HW_CACHE_TTL = float(os.environ.get('HW_CACHE_TTL', 5))
+HW_CACHE_CHANGE_STREAM = os.environ.get('HW_CACHE_CHANGE_STREAM', '0') == '1'
+
+_lock = threading.Lock()
+_value = None
+_expires = 0.0
+_generation = 0
+_version = None
+_watcher = None
+
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'invalidations': 0,
+    'changeEvents': 0
+}
+
+
+# ============================================================
+# Lookup / store
+# ============================================================
+def lookup(version=None):
+    """
+    Return (hit, value, generation). On a miss the caller loads the inventory
+    and hands it to store() together with the generation it got here, so a
+    load that raced with an invalidation is never cached.
+    """
+    with _lock:
+        fresh = _value is not None and time.monotonic() < _expires
+        if fresh and (version is None or version == _version):
+            _stats['hits'] += 1
+            return (True, _value, _generation)
+        _stats['misses'] += 1
+        return (False, None, _generation)
+
+
+def store(value, generation, version=None):
+    global _value, _expires, _version
+    if HW_CACHE_TTL <= 0:
+        return
+    with _lock:
+        if generation == _generation:
+            _value = value
+            _expires = time.monotonic() + HW_CACHE_TTL
+            _version = version
+
+
+def getHardware(loader, version=None):
+    """Return the cached inventory, calling loader() to refill it on a miss."""
+    hit, value, generation = lookup(version)
+    if hit:
+        return value
+    value = loader()
+    store(value, generation, version)
+    return value
+
+
+def invalidate():
+    """Drop the cached inventory; call after any write to Hardware_Sets."""
+    global _value, _generation
+    with _lock:
+        _value = None
+        _generation += 1
+        _stats['invalidations'] += 1
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats['cached'] = _value is not None and time.monotonic() < _expires
+    stats['ttlSeconds'] = HW_CACHE_TTL
+    stats['changeStream'] = _watcher is not None and _watcher.is_alive()
+    return stats
+
+
+# ============================================================
+# Optional change stream feed
+# ============================================================
+def startChangeStream(client):
+    """
+    Watch Hardware_Sets in a daemon thread and invalidate on every change, so
+    writes from other workers show up without waiting for the TTL.
+    Does nothing unless HW_CACHE_CHANGE_STREAM=1.
+    """
+    global _watcher
+    if not HW_CACHE_CHANGE_STREAM or (_watcher is not None and _watcher.is_alive()):
+        return False
+    _watcher = threading.Thread(target=_watch, args=(client,), name='hw-cache-watch', daemon=True)
+    _watcher.start()
+    return True
+
+
+def _watch(client):
+    backoff = 1
+    while True:
+        try:
+            with client['Hardware'].Hardware_Sets.watch() as stream:
+                backoff = 1
+                # Anything may have changed while we were not watching
+                invalidate()
+                for _ in stream:
+                    with _lock:
+                        _stats['changeEvents'] += 1
+                    invalidate()
+        except Exception as e:
+            print(f"Hardware cache change stream error: {e}")
+            invalidate()
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+
+def _resetAfterFork():
+    global _lock, _value, _watcher
+    _lock = threading.Lock()
+    _value = None
+    _watcher = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
@@ -0,0 +1,389 @@
+# inventoryEvents.py
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+'''
+Push channel for inventory changes, served as Server-Sent Events on
+GET /events/inventory.
+
+checkOutHW, checkInHW, applyHWBatch (one delta per applied operation),
+addProjectUser, createProject and createHardwareSet publish a small delta
+once their write has succeeded:
+
+    {'type': 'hardwareCreated', 'hwName', 'capacity', 'availability'}
+    {'type': 'projectCreated', 'projectName', 'description', 'users',
+     'hwSets': {hwName: {'capacity', 'used'}}}
+        each set's capacity was taken from that hardware set's availability
+    {'type': 'checkout', 'projectName', 'hwName', 'username', 'qty'}
+    {'type': 'checkin', 'projectName', 'hwName', 'username', 'qty'}
+    {'type': 'userAdded', 'projectName', 'username'}
+    {'type': 'resync'}
+        the subscriber missed events; refetch /projects and /hardware
+    {'type': 'connected', 'origin'}
+        first message of every stream, without an id (see below)
+
+Every open stream has its own bounded queue, so one publish fans out to any
+number of subscribers in the worker without blocking the writer. A subscriber
+that falls EVENT_QUEUE_SIZE events behind is sent a resync instead. The last
+EVENT_HISTORY events are kept so a reconnecting EventSource (Last-Event-ID)
+receives what it missed.
+
+By default an event only reaches streams served by the worker that made the
+write. Event ids are then prefixed with this process's origin, so a
+Last-Event-ID from another worker is never mistaken for a local event and
+gets a resync. The origin is sent as the stream's first message and on every
+POST response (X-Inventory-Origin, see app.py); a client whose write was
+served by another origin than its stream refetches instead of waiting for
+the delta. With INVENTORY_EVENTS_SHARED=1 (MongoDB engine) events go through
+the capped collection Events.inventory instead: a background thread appends
+them and every worker tails the collection and fans out, so all streams see
+all writes and the origin is 'shared'. Tailable cursors also work on a
+standalone server.
+
+Environment variables:
+    EVENT_QUEUE_SIZE           events buffered per subscriber       (default 256)
+    EVENT_HISTORY              events kept for Last-Event-ID replay (default 1000)
+    EVENT_HEARTBEAT_SECONDS    keep-alive comment interval          (default 15)
+    EVENT_STREAM_SECONDS       max length of a WSGI stream; the browser
+                               reconnects and resumes (default 25, below the
+                               gunicorn timeout)
+    EVENT_MAX_STREAMS          WSGI streams open at once per process
+                               (default 2; gunicorn.conf.py sets half its threads)
+    INVENTORY_EVENTS_SHARED    1 = fan out across workers through MongoDB
+    INVENTORY_EVENTS_CAP_BYTES size of the capped collection        (default 1 MiB)
+'''
+
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', 256))
+EVENT_HISTORY = int(os.environ.get('EVENT_HISTORY', 1000))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', 15))
+EVENT_STREAM_SECONDS = float(os.environ.get('EVENT_STREAM_SECONDS', 25))
+EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', 2))
+INVENTORY_EVENTS_SHARED = os.environ.get('INVENTORY_EVENTS_SHARED', '0') == '1'
+INVENTORY_EVENTS_CAP_BYTES = int(os.environ.get('INVENTORY_EVENTS_CAP_BYTES', 1024 * 1024))
+
+EVENTS_DATABASE = 'Events'
+EVENTS_COLLECTION = 'inventory'
+# Browser reconnect delay sent at the start of every stream, and to streams
+# turned away because EVENT_MAX_STREAMS are open
+RETRY_MS = 3000
+BUSY_RETRY_MS = 30000
+RESYNC = {'type': 'resync'}
+
+_lock = threading.Lock()
+_subscribers = set()
+_history = collections.deque()
+_historyIds = set()
+_sequence = itertools.count(1)
+_origin = os.urandom(4).hex()
+_outbox = None
+_threads = []
+_wsgiStreams = 0
+
+_stats = {
+    'published': 0,
+    'delivered': 0,
+    'resyncs': 0,
+    'streamsTurnedAway': 0
+}
+
+
+class Subscription:
+    """
+    Queue of (eventId, event) for one open stream. Threads block in wait();
+    an event loop passes a wakeup callback and calls drain() when woken.
+    """
+
+    def __init__(self, wakeup=None):
+        self._events = collections.deque()
+        self._cond = threading.Condition(threading.Lock())
+        self._wakeup = wakeup
+
+    def _put(self, item):
+        with self._cond:
+            if len(self._events) >= EVENT_QUEUE_SIZE:
+                # Too far behind to be worth catching up; start over from a refetch
+                self._events.clear()
+                item = (None, RESYNC)
+                with _lock:
+                    _stats['resyncs'] += 1
+            self._events.append(item)
+            self._cond.notify()
+        if self._wakeup is not None:
+            try:
+                self._wakeup()
+            except RuntimeError:
+                # The subscriber's event loop is gone; unsubscribe will follow
+                pass
+
+    def drain(self):
+        with self._cond:
+            items = list(self._events)
+            self._events.clear()
+        return items
+
+    def wait(self, timeout):
+        """Return the queued events, waiting up to timeout seconds for the first one."""
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            items = list(self._events)
+            self._events.clear()
+        return items
+
+
+# ============================================================
+# Subscribe / publish
+# ============================================================
+def subscribe(lastEventId=None, wakeup=None):
+    """
+    Register a subscriber. With lastEventId, the events published after it
+    are queued first, or a resync if it is no longer in the history.
+    """
+    subscription = Subscription(wakeup)
+    with _lock:
+        if lastEventId:
+            if lastEventId in _historyIds:
+                ids = [eventId for eventId, _ in _history]
+                for item in itertools.islice(_history, ids.index(lastEventId) + 1, None):
+                    subscription._events.append(item)
+            else:
+                subscription._events.append((None, RESYNC))
+        _subscribers.add(subscription)
+    return subscription
+
+
+def unsubscribe(subscription):
+    with _lock:
+        _subscribers.discard(subscription)
+
+
+def publish(event):
+    """Send event to every subscriber (of every worker in shared mode). Never raises."""
+    try:
+        with _lock:
+            _stats['published'] += 1
+        if _outbox is not None:
+            _outbox.put(event)
+        else:
+            _deliver(f'{_origin}-{next(_sequence)}', event)
+    except Exception as e:
+        print(f"Error publishing inventory event: {e}")
+
+
+def _deliver(eventId, event):
+    with _lock:
+        if eventId in _historyIds:
+            return
+        if len(_history) >= EVENT_HISTORY:
+            oldId, _ = _history.popleft()
+            _historyIds.discard(oldId)
+        _history.append((eventId, event))
+        _historyIds.add(eventId)
+        subscribers = list(_subscribers)
+        _stats['delivered'] += len(subscribers)
+    for subscription in subscribers:
+        subscription._put((eventId, event))
+
+
+def origin():
+    """Which streams see this process's events: 'shared' (all of them) or this process's id."""
+    return 'shared' if _outbox is not None else _origin
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats['subscribers'] = len(_subscribers)
+        stats['wsgiStreams'] = _wsgiStreams
+    stats['shared'] = _outbox is not None
+    stats['origin'] = origin()
+    return stats
+
+
+# ============================================================
+# Server-Sent Events framing
+# ============================================================
+def formatEvent(eventId, event):
+    lines = []
+    if eventId is not None:
+        lines.append(f'id: {eventId}')
+    lines.append('event: inventory')
+    lines.append(f'data: {json.dumps(event, separators=(",", ":"))}')
+    return '\n'.join(lines) + '\n\n'
+
+
+STREAM_HEADERS = {
+    'Cache-Control': 'no-cache',
+    # Stop proxies (nginx, Heroku router) from buffering the stream
+    'X-Accel-Buffering': 'no'
+}
+ORIGIN_HEADER = 'X-Inventory-Origin'
+
+
+def _opening():
+    return f'retry: {RETRY_MS}\n\n' + formatEvent(None, {'type': 'connected', 'origin': origin()})
+
+
+def stream(lastEventId=None):
+    """
+    Generator of SSE text for a WSGI response. Ends after EVENT_STREAM_SECONDS
+    so a worker is not killed mid-stream; EventSource reconnects with
+    Last-Event-ID and loses nothing. Each open stream holds a server thread,
+    so past EVENT_MAX_STREAMS the browser is told to come back later (the
+    portal refetches after its writes meanwhile).
+    """
+    global _wsgiStreams
+    with _lock:
+        busy = _wsgiStreams >= EVENT_MAX_STREAMS
+        if busy:
+            _stats['streamsTurnedAway'] += 1
+        else:
+            _wsgiStreams += 1
+    if busy:
+        yield f'retry: {BUSY_RETRY_MS}\n\n'
+        return
+
+    try:
+        yield from _stream(lastEventId)
+    finally:
+        with _lock:
+            _wsgiStreams -= 1
+
+
+def _stream(lastEventId):
+    subscription = subscribe(lastEventId)
+    deadline = time.monotonic() + EVENT_STREAM_SECONDS
+    try:
+        yield _opening()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            items = subscription.wait(min(EVENT_HEARTBEAT_SECONDS, remaining))
+            if not items:
+                yield ': keepalive\n\n'
+            for eventId, event in items:
+                yield formatEvent(eventId, event)
+    finally:
+        unsubscribe(subscription)
+
+
+async def asyncStream(lastEventId=None):
+    """Async generator of SSE text for an ASGI response; runs until the client disconnects."""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    subscription = subscribe(lastEventId, wakeup=lambda: loop.call_soon_threadsafe(ready.set))
+    try:
+        yield _opening()
+        while True:
+            try:
+                await asyncio.wait_for(ready.wait(), EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            ready.clear()
+            items = subscription.drain()
+            if not items:
+                yield ': keepalive\n\n'
+            for eventId, event in items:
+                yield formatEvent(eventId, event)
+    finally:
+        unsubscribe(subscription)
+
+
+# ============================================================
+# Optional fan-out across workers (MongoDB capped collection)
+# ============================================================
+def start(client):
+    """
+    Start the writer and tailer threads for INVENTORY_EVENTS_SHARED=1.
+    Call once per worker after fork. Does nothing otherwise.
+    """
+    global _outbox
+    if not INVENTORY_EVENTS_SHARED or _outbox is not None:
+        return False
+    coll = client[EVENTS_DATABASE][EVENTS_COLLECTION]
+    try:
+        client[EVENTS_DATABASE].create_collection(
+            EVENTS_COLLECTION, capped=True, size=INVENTORY_EVENTS_CAP_BYTES
+        )
+    except CollectionInvalid:
+        # Already created by another worker
+        pass
+    except Exception as e:
+        print(f"Inventory events stay local to this worker: {e}")
+        return False
+
+    _outbox = queue.Queue()
+    for target, name in ((_write, 'inventory-events-write'), (_tail, 'inventory-events-tail')):
+        thread = threading.Thread(target=target, args=(coll,), name=name, daemon=True)
+        thread.start()
+        _threads.append(thread)
+    return True
+
+
+def _write(coll):
+    while True:
+        events = [_outbox.get()]
+        while len(events) < 100:
+            try:
+                events.append(_outbox.get_nowait())
+            except queue.Empty:
+                break
+        docs = [{'_id': ObjectId(), 'event': event} for event in events]
+        try:
+            coll.insert_many(docs, ordered=True)
+        except Exception as e:
+            # Better that this worker's streams see it than nobody
+            print(f"Error writing inventory events: {e}")
+            for doc in docs:
+                _deliver(str(doc['_id']), doc['event'])
+
+
+def _tail(coll):
+    backoff = 1
+    lastSeen = None
+    while True:
+        try:
+            # The first pass reads the existing documents, refilling the history.
+            # After a reconnect, resume a little before the last event seen (ids
+            # come from several workers' clocks); repeats are skipped by _deliver.
+            query = {}
+            if lastSeen is not None:
+                query = {'_id': {'$gt': ObjectId.from_datetime(lastSeen - datetime.timedelta(seconds=60))}}
+            cursor = coll.find(query, cursor_type=CursorType.TAILABLE_AWAIT, max_await_time_ms=1000)
+            while cursor.alive:
+                for doc in cursor:
+                    backoff = 1
+                    lastSeen = doc['_id'].generation_time
+                    _deliver(str(doc['_id']), doc['event'])
+            # An empty capped collection returns a dead cursor straight away
+            time.sleep(0.5)
+        except Exception as e:
+            print(f"Inventory event tail error: {e}; retrying in {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+
+def _resetAfterFork():
+    global _lock, _outbox, _origin, _wsgiStreams
+    # Threads and open streams belong to the parent; ids must not collide with its events
+    _lock = threading.Lock()
+    _origin = os.urandom(4).hex()
+    _wsgiStreams = 0
+    _subscribers.clear()
+    _outbox = None
+    _threads.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
@@ -0,0 +1,604 @@
+# memoryStorage.py
+import bisect
+import collections
+import copy
+import os
+import threading
+import time
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from storage import KINDS, Storage
+
+'''
+In-process engine for the storage interface (see storage.py).
+
+Each collection is a dict keyed by its unique name, with secondary indexes
+kept alongside (projects by _id for keyset pagination, by member and by
+hardware set). Writes to one record hold only that record's lock, taken from
+a fixed array of lock stripes, so checkouts on different projects never
+contend; the table lock is held just long enough to add a key or update an
+index. Documents are copied in and out, so callers never share state with the
+tables.
+
+Lock order is always record stripes (sorted) before a table lock, which rules
+out deadlocks between multi-record operations such as project creation.
+
+Data lives in this process only: use one worker, and expect it to be gone on
+restart.
+'''
+
+LOCK_STRIPES = 64
+# Ledger fields kept indexed, as in dbIndexes.py
+LEDGER_FIELDS = ('username', 'projectName', 'hwName')
+LEDGER_SNAPSHOTS_KEPT = 2
+# Shared rate limit buckets kept, least recently used evicted (as rateLimits' local ones)
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+
+def _duplicate(kind, key, value):
+    return DuplicateKeyError(
+        f"E11000 duplicate key error collection: {kind} index: {key}_unique dup key: {{ {key}: \"{value}\" }}",
+        code=11000
+    )
+
+
+def _entryId(entry):
+    return entry['_id']
+
+
+def _consumeLeases(doc, hwName, username, returned):
+    # A check-in of `returned` units uses up username's leases on hwName, oldest first
+    if not doc.get('leases'):
+        return
+    kept = []
+    for lease in doc['leases']:
+        if returned > 0 and lease['hwName'] == hwName and lease['username'] == username:
+            take = min(returned, lease['qty'])
+            returned -= take
+            if lease['qty'] == take:
+                continue
+            lease['qty'] -= take
+        kept.append(lease)
+    doc['leases'] = kept
+
+
+class _Table:
+    """A dict of documents keyed by a unique field, with striped record locks."""
+
+    def __init__(self, kind, key):
+        self.kind = kind
+        self.key = key
+        self.docs = {}
+        self.lock = threading.Lock()
+        self._stripes = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def stripe(self, name):
+        return self._stripes[hash(name) % LOCK_STRIPES]
+
+    def stripes(self, names):
+        # Distinct stripes in a fixed order, so multi-record locking cannot deadlock
+        indexes = sorted({hash(name) % LOCK_STRIPES for name in names})
+        return [self._stripes[i] for i in indexes]
+
+    def insert(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault('_id', ObjectId())
+        value = doc[self.key]
+        with self.lock:
+            if value in self.docs:
+                raise _duplicate(self.kind, self.key, value)
+            self.docs[value] = doc
+        return doc
+
+    def get(self, name):
+        with self.stripe(name):
+            doc = self.docs.get(name)
+            return copy.deepcopy(doc) if doc is not None else None
+
+    def sortedNames(self):
+        with self.lock:
+            return sorted(self.docs)
+
+
+class _Locked:
+    """Hold several locks at once, in the order given."""
+
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *exc):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class MemoryStorage(Storage):
+    name = 'memory'
+
+    def __init__(self):
+        self.users = _Table('User.users', 'username')
+        self.hardware = _Table('Hardware.Hardware_Sets', 'hwName')
+        self.projects = _Table('Projects.project', 'projectName')
+        # Secondary project indexes, guarded by self.projects.lock
+        self._projectIds = []      # sorted [(ObjectId, projectName)]
+        self._byMember = {}        # username -> {projectName}
+        self._byHw = {}            # hwName -> {projectName}
+        # Change counters; seeded from the clock so a restarted process never
+        # reissues an ETag a client still holds
+        self._versionLock = threading.Lock()
+        self._versions = dict.fromkeys(KINDS, time.time_ns() // 1000)
+        # Checkout ledger: entries in _id order, plus per-field lists (also in
+        # _id order) standing in for the MongoDB indexes; the latest snapshots
+        self._ledgerLock = threading.Lock()
+        self._ledger = []
+        self._ledgerBy = {field: {} for field in LEDGER_FIELDS}
+        self._snapshots = []       # [(header, projects)], oldest first
+        self._snapshotSlot = None
+        # Utilization rollups: series (granularity, hwName, projectName) -> sorted
+        # bucket starts and {start: bucket}; the latest claimed sample slot
+        self._rollupLock = threading.Lock()
+        self._rollupStarts = {}
+        self._rollups = {}
+        self._sampleSlot = None
+        # Rate limit buckets: key -> [tokens, monotonic time], LRU order
+        self._tokenLock = threading.Lock()
+        self._tokenBuckets = collections.OrderedDict()
+
+    def _table(self, kind):
+        return {'users': self.users, 'projects': self.projects, 'hardware': self.hardware}[kind]
+
+    # ---------------- lifecycle ----------------
+    def healthCheck(self):
+        return {
+            'ok': True,
+            'error': None,
+            'latencyMs': 0.0,
+            'backend': self.name,
+            'users': len(self.users.docs),
+            'projects': len(self.projects.docs),
+            'hardwareSets': len(self.hardware.docs)
+        }
+
+    # ---------------- users ----------------
+    def insertUser(self, doc):
+        self.users.insert(doc)
+
+    def findUser(self, username, fields=None):
+        doc = self.users.get(username)
+        if doc is None or not fields:
+            return doc
+        return {f: doc[f] for f in ('_id', *fields) if f in doc}
+
+    def replaceUserPassword(self, username, oldHash, newHash):
+        with self.users.stripe(username):
+            doc = self.users.docs.get(username)
+            if doc is None or doc.get('password') != oldHash:
+                return False
+            doc['password'] = newHash
+            return True
+
+    # ---------------- hardware ----------------
+    def insertHardware(self, doc):
+        self.hardware.insert(doc)
+
+    def findHardware(self, hwName):
+        return self.hardware.get(hwName)
+
+    def findHardwareMany(self, hwNames):
+        found = {}
+        for hwName in hwNames:
+            doc = self.hardware.get(hwName)
+            if doc is not None:
+                found[hwName] = doc
+        return found
+
+    def listHardware(self):
+        return [doc for doc in (self.hardware.get(name) for name in self.hardware.sortedNames()) if doc]
+
+    def setAvailability(self, hwName, availability):
+        with self.hardware.stripe(hwName):
+            doc = self.hardware.docs.get(hwName)
+            if doc is None:
+                return False
+            doc['availability'] = max(0, min(doc['capacity'], availability))
+            return True
+
+    # ---------------- projects ----------------
+    def insertProjectWithReservations(self, doc, amounts):
+        amounts = {hwName: qty for hwName, qty in amounts.items() if qty > 0}
+        with _Locked(self.hardware.stripes(amounts)):
+            sets = self.hardware.docs
+            if any(hwName not in sets or sets[hwName]['availability'] < qty for hwName, qty in amounts.items()):
+                return False
+            # Raises DuplicateKeyError before anything is deducted
+            self._insertProject(doc)
+            for hwName, qty in amounts.items():
+                sets[hwName]['availability'] -= qty
+        return True
+
+    def _insertProject(self, doc):
+        doc = copy.deepcopy(doc)
+        doc.setdefault('_id', ObjectId())
+        name = doc['projectName']
+        with self.projects.lock:
+            if name in self.projects.docs:
+                raise _duplicate(self.projects.kind, 'projectName', name)
+            self.projects.docs[name] = doc
+            self._indexProject(doc)
+        return doc
+
+    def _indexProject(self, doc):
+        # Caller holds self.projects.lock
+        name = doc['projectName']
+        bisect.insort(self._projectIds, (doc['_id'], name))
+        for username in doc.get('users', []):
+            self._byMember.setdefault(username, set()).add(name)
+        for hwName in doc.get('hwSets', {}):
+            self._byHw.setdefault(hwName, set()).add(name)
+
+    def _unindexProject(self, doc):
+        name = doc['projectName']
+        i = bisect.bisect_left(self._projectIds, (doc['_id'], name))
+        if i < len(self._projectIds) and self._projectIds[i] == (doc['_id'], name):
+            del self._projectIds[i]
+        for username in doc.get('users', []):
+            self._byMember.get(username, set()).discard(name)
+        for hwName in doc.get('hwSets', {}):
+            self._byHw.get(hwName, set()).discard(name)
+
+    def findProject(self, projectName, hwNames=None):
+        doc = self.projects.get(projectName)
+        if doc is None:
+            return None
+        hwSets = doc.get('hwSets', {})
+        if hwNames is not None:
+            hwSets = {hw: hwSets[hw] for hw in hwNames if hw in hwSets}
+        return {'users': doc.get('users', []), 'hwSets': hwSets}
+
+    def iterProjects(self, after=None, limit=None, fields=None, member=None, hwName=None):
+        with self.projects.lock:
+            start = bisect.bisect_right(self._projectIds, (after, chr(0x10FFFF))) if after else 0
+            ids = self._projectIds[start:]
+            wanted = None
+            if member:
+                wanted = set(self._byMember.get(member, ()))
+            if hwName:
+                byHw = self._byHw.get(hwName, set())
+                wanted = byHw.copy() if wanted is None else wanted & byHw
+
+        fields = ('projectName', *(fields or ()))
+        count = 0
+        for _id, name in ids:
+            if limit and count >= limit:
+                return
+            if wanted is not None and name not in wanted:
+                continue
+            doc = self.projects.get(name)
+            if doc is None:
+                continue
+            count += 1
+            yield {'_id': _id, **{f: doc[f] for f in fields if f in doc}}
+
+    def projectUsage(self, includeProjects=True):
+        usage = {}
+        for name in self.projects.sortedNames():
+            doc = self.projects.get(name)
+            if doc is None:
+                continue
+            for hwName, hw in doc.get('hwSets', {}).items():
+                entry = usage.setdefault(hwName, {'_id': hwName, 'reserved': 0, 'checkedOut': 0, 'projects': []})
+                entry['reserved'] += hw.get('capacity', 0)
+                entry['checkedOut'] += hw.get('used', 0)
+                entry['projects'].append({
+                    'projectName': doc['projectName'],
+                    'reserved': hw.get('capacity', 0),
+                    'checkedOut': hw.get('used', 0)
+                })
+        result = [usage[hwName] for hwName in sorted(usage)]
+        if not includeProjects:
+            for entry in result:
+                del entry['projects']
+        return result
+
+    def addProjectUser(self, projectName, username):
+        # The only place holding two stripes: project's first, then the user's
+        with self.projects.stripe(projectName), self.users.stripe(username):
+            doc = self.projects.docs.get(projectName)
+            if doc is None:
+                return None
+            changed = False
+            if username not in doc['users']:
+                doc['users'].append(username)
+                with self.projects.lock:
+                    self._byMember.setdefault(username, set()).add(projectName)
+                changed = True
+            user = self.users.docs.get(username)
+            if user is not None and projectName not in user.setdefault('projects', []):
+                user['projects'].append(projectName)
+                changed = True
+            return changed
+
+    def checkOut(self, projectName, hwName, qty, username, lease=None):
+        with self.projects.stripe(projectName):
+            doc = self.projects.docs.get(projectName)
+            if doc is None or username not in doc['users']:
+                return None
+            hw = doc['hwSets'].get(hwName)
+            if hw is None or 'capacity' not in hw or hw.get('used', 0) + qty > hw['capacity']:
+                return None
+            hw['used'] = hw.get('used', 0) + qty
+            usage = hw.setdefault('user_usage', {})
+            usage[username] = usage.get(username, 0) + qty
+            if lease is not None:
+                doc.setdefault('leases', []).append(copy.deepcopy(lease))
+            return copy.deepcopy(hw)
+
+    def checkIn(self, projectName, hwName, qty, username):
+        with self.projects.stripe(projectName):
+            doc = self.projects.docs.get(projectName)
+            if doc is None or username not in doc['users']:
+                return None
+            hw = doc['hwSets'].get(hwName)
+            held = (hw or {}).get('user_usage', {}).get(username, 0)
+            if held <= 0:
+                return None
+            returned = min(qty, held)
+            hw['used'] = max(0, hw.get('used', 0) - returned)
+            hw['user_usage'][username] = held - returned
+            _consumeLeases(doc, hwName, username, returned)
+            return held
+
+    def applyBatch(self, projectName, ops, username, atomic):
+        with self.projects.stripe(projectName):
+            doc = self.projects.docs.get(projectName)
+            if doc is None or username not in doc['users']:
+                return False if atomic else None
+            hwNames = {op['hwName'] for op in ops}
+            before = {
+                'users': list(doc['users']),
+                'hwSets': {hw: copy.deepcopy(doc['hwSets'][hw]) for hw in hwNames if hw in doc['hwSets']}
+            }
+            if atomic:
+                return self._applyAtomic(doc, ops, username)
+            self._applyBestEffort(doc, ops, username)
+            return before
+
+    def _applyAtomic(self, doc, ops, username):
+        # Same rule as the MongoDB filter: check-ins first, check-outs against the freed headroom
+        totals = {}
+        for op in ops:
+            t = totals.setdefault(op['hwName'], {'checkout': 0, 'checkin': 0})
+            t[op['action']] += op['qty']
+        for hwName, t in totals.items():
+            hw = doc['hwSets'].get(hwName)
+            if hw is None or 'capacity' not in hw:
+                return False
+            held = hw.get('user_usage', {}).get(username, 0)
+            if held < t['checkin'] or hw.get('used', 0) - t['checkin'] + t['checkout'] > hw['capacity']:
+                return False
+        for hwName, t in totals.items():
+            delta = t['checkout'] - t['checkin']
+            if delta:
+                hw = doc['hwSets'][hwName]
+                hw['used'] = hw.get('used', 0) + delta
+                usage = hw.setdefault('user_usage', {})
+                usage[username] = usage.get(username, 0) + delta
+            _consumeLeases(doc, hwName, username, t['checkin'])
+        return True
+
+    def _applyBestEffort(self, doc, ops, username):
+        for op in ops:
+            hw = doc['hwSets'].get(op['hwName'])
+            if hw is None or 'capacity' not in hw:
+                continue
+            usage = hw.setdefault('user_usage', {})
+            held = usage.get(username, 0)
+            if op['action'] == 'checkout':
+                if hw.get('used', 0) + op['qty'] <= hw['capacity']:
+                    hw['used'] = hw.get('used', 0) + op['qty']
+                    usage[username] = held + op['qty']
+            elif held > 0:
+                returned = min(op['qty'], held)
+                hw['used'] = max(0, hw.get('used', 0) - returned)
+                usage[username] = held - returned
+                _consumeLeases(doc, op['hwName'], username, returned)
+
+    # ---------------- leases ----------------
+    def iterLeases(self, dueBefore=None):
+        for name in self.projects.sortedNames():
+            with self.projects.stripe(name):
+                doc = self.projects.docs.get(name)
+                leases = copy.deepcopy(doc.get('leases', [])) if doc is not None else []
+            for lease in leases:
+                if dueBefore is None or lease['expiresAt'] <= dueBefore:
+                    yield (name, lease)
+
+    def returnLeases(self, leasesByProject):
+        returned = []
+        for projectName, leases in leasesByProject.items():
+            ids = {lease['leaseId'] for lease in leases}
+            with self.projects.stripe(projectName):
+                doc = self.projects.docs.get(projectName)
+                stored = doc.get('leases', []) if doc is not None else []
+                # Leases already returned (or used up by check-ins) are skipped
+                for lease in stored:
+                    if lease['leaseId'] not in ids:
+                        continue
+                    hw = doc['hwSets'].get(lease['hwName'])
+                    usage = (hw or {}).get('user_usage', {})
+                    held = usage.get(lease['username'], 0)
+                    qty = min(lease['qty'], held)
+                    if qty > 0:
+                        hw['used'] = max(0, hw.get('used', 0) - qty)
+                        usage[lease['username']] = held - qty
+                    returned.append((projectName, copy.deepcopy(lease), qty))
+                if doc is not None and 'leases' in doc:
+                    doc['leases'] = [lease for lease in stored if lease['leaseId'] not in ids]
+        return returned
+
+    # ---------------- ledger ----------------
+    def appendLedger(self, entries):
+        with self._ledgerLock:
+            for entry in entries:
+                # Ids are taken under the lock, so the lists stay in _id order
+                entry = copy.deepcopy(entry)
+                entry['_id'] = ObjectId()
+                self._ledger.append(entry)
+                for field, index in self._ledgerBy.items():
+                    index.setdefault(entry.get(field), []).append(entry)
+
+    def findLedger(self, filters, after=None, before=None, limit=None):
+        with self._ledgerLock:
+            # Narrowest indexed list, then the remaining filters
+            candidates = self._ledger
+            for field, value in filters.items():
+                indexed = self._ledgerBy[field].get(value, [])
+                if len(indexed) < len(candidates):
+                    candidates = indexed
+            start = bisect.bisect_right(candidates, after, key=_entryId) if after is not None else 0
+            end = bisect.bisect_left(candidates, before, key=_entryId) if before is not None else len(candidates)
+            found = []
+            for entry in candidates[start:end]:
+                if all(entry.get(field) == value for field, value in filters.items()):
+                    found.append(copy.deepcopy(entry))
+                    if limit and len(found) == limit:
+                        break
+        return iter(found)
+
+    def saveLedgerSnapshot(self, header, projects):
+        with self._ledgerLock:
+            self._snapshots.append((copy.deepcopy(header), copy.deepcopy(projects)))
+            self._snapshots.sort(key=lambda snapshot: (snapshot[0]['upTo'], snapshot[0]['_id']))
+            del self._snapshots[:-LEDGER_SNAPSHOTS_KEPT]
+
+    def loadLedgerSnapshot(self, headerOnly=False):
+        with self._ledgerLock:
+            if not self._snapshots:
+                return (None, [])
+            header, projects = self._snapshots[-1]
+            return (copy.deepcopy(header), [] if headerOnly else copy.deepcopy(projects))
+
+    def claimLedgerSnapshot(self, slot):
+        with self._ledgerLock:
+            if self._snapshotSlot is not None and self._snapshotSlot >= slot:
+                return False
+            self._snapshotSlot = slot
+            return True
+
+    # ---------------- utilization rollups ----------------
+    def updateRollups(self, rows):
+        with self._rollupLock:
+            for row in rows:
+                key = row['key']
+                series = (key['granularity'], key['hwName'], key['projectName'])
+                buckets = self._rollups.setdefault(series, {})
+                bucket = buckets.get(key['start'])
+                if bucket is None:
+                    bucket = buckets[key['start']] = dict(key)
+                    bisect.insort(self._rollupStarts.setdefault(series, []), key['start'])
+                for field, value in row['inc'].items():
+                    bucket[field] = bucket.get(field, 0) + value
+                for field, value in row['max'].items():
+                    bucket[field] = max(bucket.get(field, value), value)
+                for field, value in row['min'].items():
+                    bucket[field] = min(bucket.get(field, value), value)
+                bucket.update(row['set'])
+
+    def findRollups(self, granularity, hwName, projectName, start, end):
+        series = (granularity, hwName, projectName)
+        with self._rollupLock:
+            starts = self._rollupStarts.get(series, [])
+            buckets = self._rollups.get(series, {})
+            found = starts[bisect.bisect_left(starts, start):bisect.bisect_right(starts, end)]
+            return [dict(buckets[at]) for at in found]
+
+    def findPreviousRollup(self, granularity, hwName, projectName, before):
+        series = (granularity, hwName, projectName)
+        with self._rollupLock:
+            starts = self._rollupStarts.get(series, [])
+            buckets = self._rollups.get(series, {})
+            for at in reversed(starts[:bisect.bisect_left(starts, before)]):
+                if buckets[at].get('samples'):
+                    return dict(buckets[at])
+        return None
+
+    def claimSampleSlot(self, slot):
+        with self._rollupLock:
+            if self._sampleSlot is not None and self._sampleSlot >= slot:
+                return False
+            self._sampleSlot = slot
+            return True
+
+    # ---------------- rate limits ----------------
+    def takeTokens(self, key, cost, capacity, refillPerSecond):
+        now = time.monotonic()
+        with self._tokenLock:
+            bucket = self._tokenBuckets.setdefault(key, [capacity, now])
+            self._tokenBuckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * refillPerSecond)
+            bucket[1] = now
+            allowed = bucket[0] >= cost
+            if allowed:
+                bucket[0] -= cost
+            # Evicting the least recently used buckets only forgets nearly full ones
+            while len(self._tokenBuckets) > RATE_LIMIT_MAX_KEYS:
+                self._tokenBuckets.popitem(last=False)
+            return (allowed, bucket[0])
+
+    # ---------------- change counters ----------------
+    def bumpVersion(self, kinds):
+        with self._versionLock:
+            for kind in kinds:
+                self._versions[kind] += 1
+
+    def getVersion(self, kind):
+        with self._versionLock:
+            return self._versions[kind]
+
+    # ---------------- bulk ----------------
+    def bulkLoad(self, kind, docs, upsert=False):
+        table = self._table(kind)
+        counts = {'inserted': 0, 'updated': 0, 'duplicates': 0, 'errors': []}
+        for i, doc in enumerate(docs):
+            try:
+                if upsert and self._replace(kind, table, doc):
+                    counts['updated'] += 1
+                    continue
+                if kind == 'projects':
+                    self._insertProject(doc)
+                else:
+                    table.insert(doc)
+                counts['inserted'] += 1
+            except DuplicateKeyError:
+                counts['duplicates'] += 1
+            except Exception as e:
+                counts['errors'].append((i, str(e)))
+        return counts
+
+    def _replace(self, kind, table, doc):
+        name = doc[table.key]
+        with table.stripe(name):
+            existing = table.docs.get(name)
+            if existing is None:
+                return False
+            replacement = copy.deepcopy(doc)
+            replacement['_id'] = existing['_id']
+            if kind == 'projects':
+                with table.lock:
+                    self._unindexProject(existing)
+                    table.docs[name] = replacement
+                    self._indexProject(replacement)
+            else:
+                table.docs[name] = replacement
+            return True
+
+    def exportDocs(self, kind):
+        table = self._table(kind)
+        for name in table.sortedNames():
+            doc = table.get(name)
+            if doc is not None:
+                doc.pop('_id', None)
+                yield doc
@@ -0,0 +1,283 @@
+# metrics.py
+import contextvars
+import os
+import threading
+import time
+from pymongo import monitoring
+
+'''
+Per-process request and database instrumentation, exported on GET /metrics
+in the Prometheus text format.
+
+Each HTTP request gets a context (startRequest / finishRequest, wired up by
+app.py's request hooks and by MetricsMiddleware in asyncApp.py). The pymongo
+CommandListener installed by dbClient attributes every MongoDB command to the
+request that issued it, so the exported series show how many round trips and
+how much database time each handler costs, per database, collection and
+command. Commands issued outside a request (index builds, the change stream
+watcher) are reported under handler="none".
+
+Handlers are labelled by their view function name, which is the same in the
+Flask and Starlette apps. Counters are per worker process; Prometheus sums
+them across workers when scraping each one.
+'''
+
+# Upper bounds in seconds for request latency
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds for MongoDB commands issued by one request
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+
+_lock = threading.Lock()
+_requests = {}        # (handler, method, status) -> count
+_latency = {}         # (handler, method) -> histogram
+_roundTrips = {}      # handler -> histogram
+_commands = {}        # (handler, database, collection, command) -> [count, seconds, failures]
+_pending = {}         # (connection id, request id) -> (request context, database, collection, command)
+_inFlight = 0
+
+
+class _RequestContext:
+    __slots__ = ('started', 'commands', 'roundTrips')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.commands = {}
+        self.roundTrips = 0
+
+
+# ============================================================
+# Request tracking
+# ============================================================
+def startRequest():
+    """Begin tracking a request in the current context. Returns a token for finishRequest."""
+    global _inFlight
+    context = _RequestContext()
+    token = _current.set(context)
+    with _lock:
+        _inFlight += 1
+    return (context, token)
+
+
+def finishRequest(started, handler, method, status):
+    """Record the request's latency, status and database usage under handler."""
+    global _inFlight
+    context, token = started
+    elapsed = time.perf_counter() - context.started
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Finished from a different context (e.g. a streamed response); nothing to restore
+        pass
+
+    handler = handler or 'unmatched'
+    with _lock:
+        _inFlight -= 1
+        key = (handler, method, str(status))
+        _requests[key] = _requests.get(key, 0) + 1
+        _observe(_latency, (handler, method), LATENCY_BUCKETS, elapsed)
+        _observe(_roundTrips, handler, ROUND_TRIP_BUCKETS, context.roundTrips)
+        for (database, collection, command), stats in context.commands.items():
+            _addCommand((handler, database, collection, command), *stats)
+
+
+def _observe(histograms, key, buckets, value):
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            histogram['buckets'][i] += 1
+            break
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def _addCommand(key, count, seconds, failures):
+    totals = _commands.get(key)
+    if totals is None:
+        totals = _commands[key] = [0, 0.0, 0]
+    totals[0] += count
+    totals[1] += seconds
+    totals[2] += failures
+
+
+# ============================================================
+# MongoDB command listener
+# ============================================================
+class CommandListener(monitoring.CommandListener):
+    """Counts round trips and time per database/collection/command for the current request."""
+
+    def started(self, event):
+        command = event.command
+        name = event.command_name
+        # getMore names the cursor, not the collection
+        collection = command.get('collection') if name == 'getMore' else command.get(name)
+        if not isinstance(collection, str):
+            collection = ''
+        with _lock:
+            _pending[(event.connection_id, event.request_id)] = (
+                _current.get(), event.database_name, collection, name
+            )
+
+    def succeeded(self, event):
+        self._record(event, failed=False)
+
+    def failed(self, event):
+        self._record(event, failed=True)
+
+    def _record(self, event, failed):
+        with _lock:
+            pending = _pending.pop((event.connection_id, event.request_id), None)
+            if pending is None:
+                return
+            context, database, collection, name = pending
+            seconds = event.duration_micros / 1e6
+            if context is None:
+                _addCommand(('none', database, collection, name), 1, seconds, int(failed))
+                return
+            context.roundTrips += 1
+            totals = context.commands.get((database, collection, name))
+            if totals is None:
+                totals = context.commands[(database, collection, name)] = [0, 0.0, 0]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += int(failed)
+
+
+# ============================================================
+# ASGI middleware for asyncApp.py
+# ============================================================
+class MetricsMiddleware:
+    """Starlette/ASGI counterpart of the Flask request hooks in app.py."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        started = startRequest()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # The router stores the matched endpoint on the shared scope
+            endpoint = scope.get('endpoint')
+            finishRequest(started, getattr(endpoint, '__name__', None), scope['method'], status[0])
+
+
+# ============================================================
+# Prometheus text exposition
+# ============================================================
+def render():
+    """Return all metrics in the Prometheus text format (version 0.0.4)."""
+    with _lock:
+        requests = dict(_requests)
+        latency = {k: _copyHistogram(v) for k, v in _latency.items()}
+        roundTrips = {k: _copyHistogram(v) for k, v in _roundTrips.items()}
+        commands = {k: list(v) for k, v in _commands.items()}
+        inFlight = _inFlight
+
+    lines = [
+        '# HELP http_requests_total HTTP requests by handler, method and status.',
+        '# TYPE http_requests_total counter',
+    ]
+    for (handler, method, status), count in sorted(requests.items()):
+        lines.append(f'http_requests_total{_labels(handler=handler, method=method, status=status)} {count}')
+
+    lines += [
+        '# HELP http_requests_in_flight HTTP requests currently being served by this process.',
+        '# TYPE http_requests_in_flight gauge',
+        f'http_requests_in_flight {inFlight}',
+        '# HELP http_request_duration_seconds Time to produce the response, by handler and method.',
+        '# TYPE http_request_duration_seconds histogram',
+    ]
+    for (handler, method), histogram in sorted(latency.items()):
+        lines += _histogramLines('http_request_duration_seconds', LATENCY_BUCKETS, histogram,
+                                 handler=handler, method=method)
+
+    lines += [
+        '# HELP http_request_mongodb_round_trips MongoDB commands issued per request, by handler.',
+        '# TYPE http_request_mongodb_round_trips histogram',
+    ]
+    for handler, histogram in sorted(roundTrips.items()):
+        lines += _histogramLines('http_request_mongodb_round_trips', ROUND_TRIP_BUCKETS, histogram,
+                                 handler=handler)
+
+    lines += [
+        '# HELP mongodb_commands_total MongoDB commands by handler, database, collection and command.',
+        '# TYPE mongodb_commands_total counter',
+    ]
+    for key, (count, _, _) in sorted(commands.items()):
+        lines.append(f'mongodb_commands_total{_commandLabels(key)} {count}')
+    lines += [
+        '# HELP mongodb_command_seconds_total Time spent in MongoDB commands.',
+        '# TYPE mongodb_command_seconds_total counter',
+    ]
+    for key, (_, seconds, _) in sorted(commands.items()):
+        lines.append(f'mongodb_command_seconds_total{_commandLabels(key)} {seconds:.6f}')
+    lines += [
+        '# HELP mongodb_command_failures_total MongoDB commands that returned an error.',
+        '# TYPE mongodb_command_failures_total counter',
+    ]
+    for key, (_, _, failures) in sorted(commands.items()):
+        lines.append(f'mongodb_command_failures_total{_commandLabels(key)} {failures}')
+
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _copyHistogram(histogram):
+    return {'buckets': list(histogram['buckets']), 'sum': histogram['sum'], 'count': histogram['count']}
+
+
+def _histogramLines(name, bounds, histogram, **labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(bounds, histogram['buckets']):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=str(bound))} {cumulative}')
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram["count"]}')
+    lines.append(f'{name}_sum{_labels(**labels)} {histogram["sum"]:.6f}')
+    lines.append(f'{name}_count{_labels(**labels)} {histogram["count"]}')
+    return lines
+
+
+def _commandLabels(key):
+    handler, database, collection, command = key
+    return _labels(handler=handler, database=database, collection=collection, command=command)
+
+
+def _labels(**labels):
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return '{' + ','.join(parts) + '}'
+
+
+def _resetAfterFork():
+    global _lock, _inFlight
+    _lock = threading.Lock()
+    _requests.clear()
+    _latency.clear()
+    _roundTrips.clear()
+    _commands.clear()
+    _pending.clear()
+    _inFlight = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
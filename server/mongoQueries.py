@@ -0,0 +1,414 @@
+# mongoQueries.py
+from pymongo import UpdateOne
+
+'''
+MongoDB collection names and the query, update and pipeline builders shared
+by the MongoDB engine (mongoStorage.py), the Motor modules used by
+asyncApp.py (async*Database.py) and the modules that talk to their own
+collections (collectionVersions, checkoutLedger, utilizationSeries,
+rateLimits). Only plain documents and pymongo operation objects are built
+here, so importing it needs no client, and the in-memory engine never loads
+mongoStorage.
+'''
+
+# kind -> (database, collection, unique key)
+COLLECTIONS = {
+    'users': ('User', 'users', 'username'),
+    'projects': ('Projects', 'project', 'projectName'),
+    'hardware': ('Hardware', 'Hardware_Sets', 'hwName'),
+}
+STREAM_BATCH_SIZE = 200
+BULK_BATCH_SIZE = 1000
+DUPLICATE_KEY = 11000
+
+# Change counters behind the list ETags, one document per kind: {_id: kind, version: n}
+VERSIONS_DATABASE = 'Meta'
+VERSIONS_COLLECTION = 'versions'
+VERSION_INC = {'$inc': {'version': 1}}
+
+# Append-only checkout ledger and its snapshots (checkoutLedger.py)
+LEDGER_DATABASE = 'Ledger'
+LEDGER_ENTRIES = 'entries'
+LEDGER_SNAPSHOTS = 'snapshots'
+LEDGER_SNAPSHOT_PROJECTS = 'snapshotProjects'
+LEDGER_SNAPSHOTS_KEPT = 2
+LEDGER_CLAIMS = 'claims'
+
+# Utilization rollups and the sample slot claim (utilizationSeries.py)
+ROLLUPS_DATABASE = 'Utilization'
+ROLLUPS_COLLECTION = 'rollups'
+SAMPLE_SLOTS_COLLECTION = 'sampleSlots'
+
+# Token buckets shared by all workers (rateLimits.py)
+RATE_LIMITS_DATABASE = 'RateLimits'
+RATE_LIMITS_COLLECTION = 'buckets'
+
+
+class ReservationFailed(Exception):
+    pass
+
+
+# ============================================================
+# Query builders
+# ============================================================
+def versionOps(kinds):
+    return [UpdateOne({'_id': kind}, VERSION_INC, upsert=True) for kind in kinds]
+
+
+def ledgerQuery(filters, after, before):
+    query = dict(filters)
+    bounds = {}
+    if after is not None:
+        bounds['$gt'] = after
+    if before is not None:
+        bounds['$lt'] = before
+    if bounds:
+        query['_id'] = bounds
+    return query
+
+
+def rollupQuery(granularity, hwName, projectName, start, end):
+    return {'granularity': granularity, 'hwName': hwName, 'projectName': projectName,
+            'start': {'$gte': start, '$lte': end}}
+
+
+def previousRollupQuery(granularity, hwName, projectName, before):
+    return {'granularity': granularity, 'hwName': hwName, 'projectName': projectName,
+            'start': {'$lt': before}, 'samples': {'$gt': 0}}
+
+
+def rollupUpdate(row):
+    update = {}
+    for operator, field in (('$inc', 'inc'), ('$max', 'max'), ('$min', 'min'), ('$set', 'set')):
+        if row[field]:
+            update[operator] = row[field]
+    if row['expiresAt'] is not None:
+        update['$setOnInsert'] = {'expiresAt': row['expiresAt']}
+    return update
+
+
+def tokenBucketUpdate(cost, capacity, refillPerSecond):
+    # Refill by the time since the last take (server clock), then take cost if
+    # there is enough; expiresAt is when the bucket would be full again (TTL)
+    elapsed = {'$divide': [{'$subtract': ['$$NOW', {'$ifNull': ['$at', '$$NOW']}]}, 1000]}
+    return [
+        {'$set': {'tokens': {'$min': [capacity, {'$add': [
+            {'$ifNull': ['$tokens', capacity]}, {'$multiply': [elapsed, refillPerSecond]}
+        ]}]}}},
+        {'$set': {'allowed': {'$gte': ['$tokens', cost]}}},
+        {'$set': {
+            'tokens': {'$cond': ['$allowed', {'$subtract': ['$tokens', cost]}, '$tokens']},
+            'at': '$$NOW'
+        }},
+        {'$set': {'expiresAt': {'$add': [
+            '$$NOW', {'$multiply': [{'$divide': [{'$subtract': [capacity, '$tokens']}, refillPerSecond]}, 1000]}
+        ]}}}
+    ]
+
+
+def projectListQuery(after, fields, member, hwName):
+    # Arguments are already validated by projectsDatabase.parseListArgs
+    query = {}
+    if after:
+        query['_id'] = {'$gt': after}
+    if member:
+        query['users'] = member
+    if hwName:
+        query[f'hwSets.{hwName}'] = {'$exists': True}
+    projection = {f: 1 for f in fields}
+    projection['projectName'] = 1
+    return (query, projection)
+
+
+def membershipOps(projectName, username):
+    # Membership lives on both sides; $addToSet keeps each a set without reading it
+    return (
+        ({'projectName': projectName}, {'$addToSet': {'users': username}}),
+        ({'username': username}, {'$addToSet': {'projects': projectName}})
+    )
+
+
+def batchProjection(ops):
+    return {'_id': 0, 'users': 1, **{f"hwSets.{op['hwName']}": 1 for op in ops}}
+
+
+def checkOutQuery(projectName, hwName, qty, username, lease=None):
+    # Membership, set existence and headroom are all part of the filter
+    used_path = f'hwSets.{hwName}.used'
+    capacity_path = f'hwSets.{hwName}.capacity'
+    query = {
+        'projectName': projectName,
+        'users': username,
+        capacity_path: {'$exists': True},
+        # Sharded sets are written through counterShards, never here
+        f'hwSets.{hwName}.shards': {'$exists': False},
+        '$expr': {'$lte': [{'$add': [f'${used_path}', qty]}, f'${capacity_path}']}
+    }
+    update = {
+        '$inc': {
+            used_path: qty,
+            f'hwSets.{hwName}.user_usage.{username}': qty
+        }
+    }
+    if lease is not None:
+        update['$push'] = {'leases': lease}
+    projection = {'_id': 0, f'hwSets.{hwName}': 1}
+    return (query, update, projection)
+
+
+def checkInQuery(projectName, hwName, qty, username):
+    # Clamp to what the user holds; both counters see the same pre-update value
+    used_path = f'hwSets.{hwName}.used'
+    held_path = f'hwSets.{hwName}.user_usage.{username}'
+    returned = {'$min': [qty, f'${held_path}']}
+    query = {
+        'projectName': projectName,
+        'users': username,
+        held_path: {'$gt': 0},
+        f'hwSets.{hwName}.shards': {'$exists': False}
+    }
+    update = [
+        {
+            '$set': {
+                used_path: {'$max': [0, {'$subtract': [f'${used_path}', returned]}]},
+                held_path: {'$subtract': [f'${held_path}', returned]},
+                'leases': consumeLeases(hwName, username, returned)
+            }
+        }
+    ]
+    projection = {'_id': 0, held_path: 1}
+    return (query, update, projection)
+
+
+def consumeLeases(hwName, username, returned, leases='$leases'):
+    # New value of project.leases once username has checked in `returned` units of
+    # hwName: their leases on the set are used up oldest first, so a lease never
+    # outlives the units it covered. Left unset on projects without leases.
+    mine = {'$and': [
+        {'$eq': ['$$this.hwName', {'$literal': hwName}]},
+        {'$eq': ['$$this.username', {'$literal': username}]},
+        {'$gt': ['$$value.left', 0]}
+    ]}
+    take = {'$min': ['$$value.left', '$$this.qty']}
+    step = {'$cond': [
+        mine,
+        {
+            'left': {'$subtract': ['$$value.left', take]},
+            'leases': {'$cond': [
+                {'$gt': ['$$this.qty', take]},
+                {'$concatArrays': ['$$value.leases', [
+                    {'$mergeObjects': ['$$this', {'qty': {'$subtract': ['$$this.qty', take]}}]}
+                ]]},
+                '$$value.leases'
+            ]}
+        },
+        {'left': '$$value.left', 'leases': {'$concatArrays': ['$$value.leases', ['$$this']]}}
+    ]}
+    consumed = {'$reduce': {'input': leases, 'initialValue': {'left': returned, 'leases': []}, 'in': step}}
+    return {'$cond': [
+        {'$isArray': leases},
+        {'$let': {'vars': {'result': consumed}, 'in': '$$result.leases'}},
+        '$$REMOVE'
+    ]}
+
+
+def leaseQuery(dueBefore):
+    # Served by the leases_expiry index; due leases are picked out of each document
+    if dueBefore is None:
+        query = {'leases.0': {'$exists': True}}
+    else:
+        query = {'leases.expiresAt': {'$lte': dueBefore}}
+    return (query, {'_id': 0, 'projectName': 1, 'leases': 1})
+
+
+def returnLeasesQuery(projectName, leases, skipSets=()):
+    # One pipeline update per project. The amounts come from the leases still
+    # stored (check-ins may have used them up), so leases already returned by
+    # another worker add nothing; every (set, user) gets back up to its leased
+    # total, clamped to what the user still holds, as in checkInQuery.
+    # skipSets (sharded) only have their leases removed.
+    ids = [lease['leaseId'] for lease in leases]
+    pairs = sorted({(lease['hwName'], lease['username']) for lease in leases if lease['hwName'] not in skipSets})
+
+    returnedBySet = {}
+    for hwName, username in pairs:
+        held = {'$ifNull': [f'$hwSets.{hwName}.user_usage.{username}', 0]}
+        leased = {'$sum': {'$map': {
+            'input': {'$filter': {'input': {'$ifNull': ['$leases', []]}, 'cond': {'$and': [
+                {'$in': ['$$this.leaseId', ids]},
+                {'$eq': ['$$this.hwName', {'$literal': hwName}]},
+                {'$eq': ['$$this.username', {'$literal': username}]}
+            ]}}},
+            'in': '$$this.qty'
+        }}}
+        returnedBySet.setdefault(hwName, []).append((username, held, {'$min': [leased, held]}))
+
+    fields = {}
+    projection = {'_id': 0, 'leases': 1}
+    for hwName, entries in returnedBySet.items():
+        used_path = f'hwSets.{hwName}.used'
+        returned = {'$add': [entry[2] for entry in entries]}
+        fields[used_path] = {'$max': [0, {'$subtract': [f'${used_path}', returned]}]}
+        for username, held, userReturned in entries:
+            fields[f'hwSets.{hwName}.user_usage.{username}'] = {'$subtract': [held, userReturned]}
+            projection[f'hwSets.{hwName}.user_usage.{username}'] = 1
+    fields['leases'] = {
+        '$filter': {'input': '$leases', 'cond': {'$not': [{'$in': ['$$this.leaseId', ids]}]}}
+    }
+
+    # Matches while any of the leases is still there; each is returned exactly once
+    query = {'projectName': projectName, 'leases.leaseId': {'$in': ids}}
+    return (query, [{'$set': fields}], projection)
+
+
+def leaseReturns(before, leases, skipSets=()):
+    # [(stored lease, units returned)] for the listed leases still in the
+    # project before the update, worked out the way returnLeasesQuery does:
+    # each user's holding is used up by their leases in order. Leases on
+    # skipSets get None (their shards say what came back).
+    ids = {lease['leaseId'] for lease in leases}
+    held = {}
+    result = []
+    for lease in before.get('leases', []):
+        if lease['leaseId'] not in ids:
+            continue
+        if lease['hwName'] in skipSets:
+            result.append((lease, None))
+            continue
+        key = (lease['hwName'], lease['username'])
+        if key not in held:
+            hw = before.get('hwSets', {}).get(lease['hwName'], {})
+            held[key] = hw.get('user_usage', {}).get(lease['username'], 0)
+        returned = min(lease['qty'], held[key])
+        held[key] -= returned
+        result.append((lease, returned))
+    return result
+
+
+def failureProjection(hwName):
+    return {'_id': 0, 'users': 1, f'hwSets.{hwName}': 1}
+
+
+def atomicBatchQuery(projectName, ops, username):
+    # Net the batch per set: check-ins first, then check-outs against the freed headroom
+    totals = {}
+    for op in ops:
+        t = totals.setdefault(op['hwName'], {'checkout': 0, 'checkin': 0})
+        t[op['action']] += op['qty']
+
+    conditions = []
+    query = {'projectName': projectName, 'users': username}
+    fields = {}
+    leases = '$leases'
+    for hwName, t in totals.items():
+        used = f'$hwSets.{hwName}.used'
+        held = f'$hwSets.{hwName}.user_usage.{username}'
+        query[f'hwSets.{hwName}.capacity'] = {'$exists': True}
+        query[f'hwSets.{hwName}.shards'] = {'$exists': False}
+        if t['checkin']:
+            conditions.append({'$gte': [{'$ifNull': [held, 0]}, t['checkin']]})
+        if t['checkout']:
+            conditions.append({'$lte': [
+                {'$add': [{'$subtract': [used, t['checkin']]}, t['checkout']]},
+                f'$hwSets.{hwName}.capacity'
+            ]})
+        delta = t['checkout'] - t['checkin']
+        if delta:
+            fields[f'hwSets.{hwName}.used'] = {'$add': [{'$ifNull': [used, 0]}, delta]}
+            fields[f'hwSets.{hwName}.user_usage.{username}'] = {'$add': [{'$ifNull': [held, 0]}, delta]}
+        if t['checkin']:
+            # The whole check-in is applied (the filter requires it), so it uses up that much lease
+            leases = consumeLeases(hwName, username, t['checkin'], leases)
+
+    if conditions:
+        query['$expr'] = {'$and': conditions}
+    if leases != '$leases':
+        fields['leases'] = leases
+    # A batch that nets to zero still has to match, so touch nothing but the filter
+    update = [{'$set': fields or {'projectName': '$projectName'}}]
+    return (query, update)
+
+
+def bestEffortBatchPipeline(ops, username):
+    # One $set stage per operation; each stage sees the result of the previous one
+    stages = []
+    for op in ops:
+        hwName, qty = op['hwName'], op['qty']
+        entry = f'$hwSets.{hwName}'
+        used = f'$hwSets.{hwName}.used'
+        held = {'$ifNull': [f'$hwSets.{hwName}.user_usage.{username}', 0]}
+        # Sharded sets count as absent here; MongoStorage applies them on their shards
+        exists = {'$and': [
+            {'$ne': [{'$type': f'$hwSets.{hwName}.capacity'}, 'missing']},
+            {'$eq': [{'$type': f'$hwSets.{hwName}.shards'}, 'missing']}
+        ]}
+
+        if op['action'] == 'checkout':
+            allowed = {'$and': [exists, {'$lte': [{'$add': [used, qty]}, f'$hwSets.{hwName}.capacity']}]}
+            new_used = {'$add': [used, qty]}
+            new_held = {'$add': [held, qty]}
+        else:
+            returned = {'$min': [qty, held]}
+            allowed = {'$and': [exists, {'$gt': [held, 0]}]}
+            new_used = {'$max': [0, {'$subtract': [used, returned]}]}
+            new_held = {'$subtract': [held, returned]}
+
+        new_entry = {'$mergeObjects': [entry, {
+            'used': new_used,
+            'user_usage': {'$mergeObjects': [
+                {'$ifNull': [f'$hwSets.{hwName}.user_usage', {}]},
+                {username: new_held}
+            ]}
+        }]}
+        stage = {'hwSets': {'$cond': [
+            allowed,
+            {'$mergeObjects': ['$hwSets', {hwName: new_entry}]},
+            '$hwSets'
+        ]}}
+        if op['action'] == 'checkin':
+            stage['leases'] = {'$cond': [allowed, consumeLeases(hwName, username, returned), '$leases']}
+        stages.append({'$set': stage})
+    return stages
+
+
+def inventoryPipeline(includeProjects):
+    group = {
+        '_id': '$hw.k',
+        'reserved': {'$sum': '$hw.v.capacity'},
+        'checkedOut': {'$sum': '$hw.v.used'}
+    }
+    if includeProjects:
+        group['projects'] = {'$push': {
+            'projectName': '$projectName',
+            'reserved': '$hw.v.capacity',
+            'checkedOut': '$hw.v.used'
+        }}
+    return [
+        {'$project': {'_id': 0, 'projectName': 1, 'hw': {'$objectToArray': '$hwSets'}}},
+        {'$unwind': '$hw'},
+        {'$group': group},
+        {'$sort': {'_id': 1}}
+    ]
+
+
+def reserveOps(amounts):
+    return [
+        UpdateOne({'hwName': hwName, 'shards': {'$exists': False}, 'availability': {'$gte': qty}},
+                  {'$inc': {'availability': -qty}})
+        for hwName, qty in amounts.items() if qty > 0
+    ]
+
+
+def releaseOps(amounts):
+    return [
+        UpdateOne(
+            {'hwName': hwName, 'shards': {'$exists': False}},
+            [{'$set': {'availability': {'$min': ['$capacity', {'$add': ['$availability', qty]}]}}}]
+        )
+        for hwName, qty in amounts.items() if qty > 0
+    ]
+
+
+def transactionsUnsupported(e):
+    # IllegalOperation: "Transaction numbers are only allowed on a replica set member or mongos"
+    return e.code == 20 or 'Transaction numbers' in str(e)
@@ -0,0 +1,737 @@
+# mongoStorage.py
+import counterShards
+import dbClient
+import dbIndexes
+import hwCache
+import inventoryEvents
+from mongoQueries import (
+    BULK_BATCH_SIZE, COLLECTIONS, DUPLICATE_KEY, LEDGER_CLAIMS, LEDGER_DATABASE, LEDGER_ENTRIES,
+    LEDGER_SNAPSHOT_PROJECTS, LEDGER_SNAPSHOTS, LEDGER_SNAPSHOTS_KEPT, RATE_LIMITS_COLLECTION,
+    RATE_LIMITS_DATABASE, ROLLUPS_COLLECTION, ROLLUPS_DATABASE, SAMPLE_SLOTS_COLLECTION,
+    STREAM_BATCH_SIZE, VERSION_INC, VERSIONS_COLLECTION, VERSIONS_DATABASE, ReservationFailed,
+    atomicBatchQuery, batchProjection, bestEffortBatchPipeline, checkInQuery, checkOutQuery,
+    consumeLeases, inventoryPipeline, leaseQuery, leaseReturns, ledgerQuery, membershipOps,
+    previousRollupQuery, projectListQuery, releaseOps, reserveOps, returnLeasesQuery, rollupQuery,
+    rollupUpdate, tokenBucketUpdate, transactionsUnsupported, versionOps,
+)
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from storage import Storage
+
+'''
+MongoDB engine for the storage interface (see storage.py).
+
+Every call goes through the process's pooled client from dbClient, so the
+engine is fork-safe. Each operation is a single conditional write where
+possible; the queries themselves are built in mongoQueries.py, which the
+Motor modules used by asyncApp.py share.
+'''
+
+
+class _BatchFailed(Exception):
+    pass
+
+
+class MongoStorage(Storage):
+    name = 'mongodb'
+
+    def __init__(self):
+        # Fail at startup rather than on the first query
+        dbClient.requireUri()
+
+    @property
+    def client(self):
+        return dbClient.getClient()
+
+    def _users(self):
+        return self.client['User'].users
+
+    def _projects(self):
+        return self.client['Projects'].project
+
+    def _hardware(self):
+        return self.client['Hardware'].Hardware_Sets
+
+    def _versions(self):
+        return self.client[VERSIONS_DATABASE][VERSIONS_COLLECTION]
+
+    def _shards(self):
+        return self.client[counterShards.SHARDS_DATABASE][counterShards.SHARDS_COLLECTION]
+
+    # ---------------- lifecycle ----------------
+    def start(self):
+        ok = dbClient.warmUp()
+        if ok:
+            dbIndexes.ensureIndexes(self.client)
+        hwCache.startChangeStream(self.client)
+        inventoryEvents.start(self.client)
+        if ok and (counterShards.enabled() or self._shards().find_one({}, {'_id': 1})):
+            counterShards.start(self._shards(), self._writeBackCounters)
+        return ok
+
+    def healthCheck(self):
+        status = dbClient.healthCheck()
+        status['counterShards'] = counterShards.getStats()
+        return status
+
+    def close(self):
+        dbClient.closeClient()
+
+    # ---------------- users ----------------
+    def insertUser(self, doc):
+        self._users().insert_one(doc)
+
+    def findUser(self, username, fields=None):
+        projection = {f: 1 for f in fields} if fields else None
+        return self._users().find_one({'username': username}, projection)
+
+    def replaceUserPassword(self, username, oldHash, newHash):
+        result = self._users().update_one(
+            {'username': username, 'password': oldHash},
+            {'$set': {'password': newHash}}
+        )
+        return result.modified_count == 1
+
+    # ---------------- hardware ----------------
+    def insertHardware(self, doc):
+        if not counterShards.enabled():
+            self._hardware().insert_one(doc)
+            return
+        doc = {**doc, 'shards': counterShards.COUNTER_SHARDS}
+        key = counterShards.hardwareKey(doc['hwName'])
+        self._hardware().insert_one(doc)
+        try:
+            self._shards().insert_many(counterShards.newShards(key, doc.get('availability', 0)))
+        except Exception:
+            # A sharded set is unusable without its shards
+            self._hardware().delete_one({'hwName': doc['hwName']})
+            self._shards().delete_many(key)
+            raise
+        counterShards.remember(key, doc['shards'])
+
+    def findHardware(self, hwName):
+        hwSet = self._hardware().find_one({'hwName': hwName})
+        return self._mergeHardware([hwSet])[0] if hwSet else None
+
+    def findHardwareMany(self, hwNames, session=None):
+        found = self._mergeHardware(list(self._hardware().find({'hwName': {'$in': list(hwNames)}}, session=session)),
+                                    session=session)
+        return {hwSet['hwName']: hwSet for hwSet in found}
+
+    def listHardware(self):
+        return self._mergeHardware(list(self._hardware().find({})))
+
+    def _mergeHardware(self, hwSets, session=None):
+        # Sharded sets: availability is the sum of the shards' free units
+        keys = [counterShards.hardwareKey(hwSet['hwName']) for hwSet in hwSets if 'shards' in hwSet]
+        if keys:
+            merged = counterShards.merge(self._shards(), keys, session=session)
+            for hwSet in hwSets:
+                entry = merged.get(('hardware', hwSet['hwName'], hwSet['hwName']))
+                if entry is not None:
+                    hwSet['availability'] = entry['free']
+        return hwSets
+
+    def _shardedHardware(self, hwNames, session=None):
+        # {hwName: shard count} for the sharded sets among hwNames
+        sharded = {}
+        unknown = []
+        for hwName in hwNames:
+            shards = counterShards.shardsOf(counterShards.hardwareKey(hwName))
+            if shards:
+                sharded[hwName] = shards
+            else:
+                unknown.append(hwName)
+        if unknown:
+            found = self._hardware().find(
+                {'hwName': {'$in': unknown}, 'shards': {'$exists': True}}, {'hwName': 1, 'shards': 1}, session=session
+            )
+            for hwSet in found:
+                sharded[hwSet['hwName']] = hwSet['shards']
+                counterShards.remember(counterShards.hardwareKey(hwSet['hwName']), hwSet['shards'])
+        return sharded
+
+    def setAvailability(self, hwName, availability):
+        # Clamp on the server so the update is a single round trip
+        result = self._hardware().update_one(
+            {'hwName': hwName, 'shards': {'$exists': False}},
+            [{'$set': {'availability': {'$max': [0, {'$min': ['$capacity', availability]}]}}}]
+        )
+        if result.matched_count:
+            return True
+        hwSet = self._hardware().find_one({'hwName': hwName, 'shards': {'$exists': True}}, {'capacity': 1, 'shards': 1})
+        if hwSet is None:
+            return False
+        counterShards.setFree(self._shards(), counterShards.hardwareKey(hwName), hwSet['shards'],
+                              max(0, min(hwSet['capacity'], availability)))
+        return True
+
+    def reserveHardware(self, amounts, session=None):
+        """
+        Deduct { hwName: qty } in a single bulk write. Each update only applies
+        while availability still covers the request; returns True only if every
+        set was reserved (run inside a transaction to roll back partial ones).
+        """
+        amounts = {hwName: qty for hwName, qty in amounts.items() if qty > 0}
+        plain = {hwName: qty for hwName, qty in amounts.items()
+                 if not counterShards.shardsOf(counterShards.hardwareKey(hwName))}
+        sharded = [hwName for hwName in amounts if hwName not in plain]
+        ops = reserveOps(plain)
+        if ops:
+            result = self._hardware().bulk_write(ops, ordered=False, session=session)
+            if result.matched_count < len(ops):
+                # The guard skips sharded sets this worker has not seen yet
+                found = self._shardedHardware(plain, session=session)
+                if result.matched_count + len(found) < len(ops):
+                    return False
+                sharded.extend(found)
+        for hwName in sharded:
+            key = counterShards.hardwareKey(hwName)
+            if not counterShards.take(self._shards(), key, counterShards.shardsOf(key), amounts[hwName], session=session):
+                return False
+        return True
+
+    def reserveHardwareSet(self, hwName, qty):
+        if qty <= 0:
+            return True
+        key = counterShards.hardwareKey(hwName)
+        if not counterShards.shardsOf(key):
+            result = self._hardware().update_one(
+                {'hwName': hwName, 'shards': {'$exists': False}, 'availability': {'$gte': qty}},
+                {'$inc': {'availability': -qty}}
+            )
+            if result.matched_count:
+                return True
+            if not self._shardedHardware([hwName]):
+                return False
+        return counterShards.take(self._shards(), key, counterShards.shardsOf(key), qty)
+
+    def releaseHardware(self, amounts, session=None):
+        amounts = {hwName: qty for hwName, qty in amounts.items() if qty > 0}
+        plain = {hwName: qty for hwName, qty in amounts.items()
+                 if not counterShards.shardsOf(counterShards.hardwareKey(hwName))}
+        sharded = [hwName for hwName in amounts if hwName not in plain]
+        ops = releaseOps(plain)
+        if ops:
+            result = self._hardware().bulk_write(ops, ordered=False, session=session)
+            if result.matched_count < len(ops):
+                sharded.extend(self._shardedHardware(plain, session=session))
+        for hwName in sharded:
+            key = counterShards.hardwareKey(hwName)
+            counterShards.give(self._shards(), key, counterShards.shardsOf(key), amounts[hwName], session=session)
+
+    # ---------------- projects ----------------
+    def insertProjectWithReservations(self, doc, amounts):
+        shardDocs = []
+        if counterShards.enabled():
+            doc, shardDocs = _shardedProject(doc)
+        try:
+            inserted = self._reserveAndInsertInTransaction(doc, amounts, shardDocs)
+        except OperationFailure as e:
+            if not transactionsUnsupported(e):
+                raise
+            inserted = self._reserveAndInsertWithRollback(doc, amounts, shardDocs)
+        if inserted:
+            for hwName, hw in doc['hwSets'].items():
+                if 'shards' in hw:
+                    counterShards.remember(counterShards.projectKey(doc['projectName'], hwName), hw['shards'])
+        return inserted
+
+    def _reserveAndInsertInTransaction(self, doc, amounts, shardDocs=()):
+        # Multi-document transaction: the reservations and the insert commit together
+        client = self.client
+
+        def reserve_and_insert(session):
+            if not self.reserveHardware(amounts, session=session):
+                raise ReservationFailed()
+            client['Projects'].project.insert_one(doc, session=session)
+            if shardDocs:
+                self._shards().insert_many(shardDocs, session=session)
+
+        with client.start_session() as session:
+            try:
+                session.with_transaction(reserve_and_insert)
+            except ReservationFailed:
+                return False
+        return True
+
+    def _reserveAndInsertWithRollback(self, doc, amounts, shardDocs=()):
+        # Standalone servers have no transactions: reserve set by set with conditional
+        # updates and give back what was taken if any reservation or the insert fails.
+        taken = {}
+        try:
+            for hwName, qty in amounts.items():
+                if not self.reserveHardwareSet(hwName, qty):
+                    self.releaseHardware(taken)
+                    return False
+                taken[hwName] = qty
+            self._projects().insert_one(doc)
+        except Exception:
+            self.releaseHardware(taken)
+            raise
+        if shardDocs:
+            try:
+                self._shards().insert_many(shardDocs)
+            except Exception:
+                self._projects().delete_one({'projectName': doc['projectName']})
+                self._shards().delete_many({'kind': 'projects', 'name': doc['projectName']})
+                self.releaseHardware(taken)
+                raise
+        return True
+
+    def findProject(self, projectName, hwNames=None):
+        if hwNames is None:
+            projection = {'_id': 0, 'users': 1, 'hwSets': 1}
+        else:
+            projection = {'_id': 0, 'users': 1, **{f'hwSets.{hw}': 1 for hw in hwNames}}
+        project = self._projects().find_one({'projectName': projectName}, projection)
+        if project is not None:
+            self._mergeProjectSets([(projectName, project)])
+        return project
+
+    def iterProjects(self, after=None, limit=None, fields=None, member=None, hwName=None):
+        query, projection = projectListQuery(after, fields, member, hwName)
+        cursor = self._projects().find(query, projection).sort('_id', 1).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        return self._mergedProjects(cursor)
+
+    def _mergedProjects(self, cursor):
+        # Sharded sets are merged a cursor batch at a time: at most one more query per batch
+        page = []
+        for project in cursor:
+            page.append((project['projectName'], project))
+            if len(page) == STREAM_BATCH_SIZE:
+                yield from (project for _, project in self._mergeProjectSets(page))
+                page = []
+        yield from (project for _, project in self._mergeProjectSets(page))
+
+    def _mergeProjectSets(self, pairs, session=None):
+        # Sharded sets: used and user_usage are the sums over the shards
+        keys = [counterShards.projectKey(name, hwName)
+                for name, project in pairs
+                for hwName, hw in project.get('hwSets', {}).items() if 'shards' in hw]
+        if keys:
+            merged = counterShards.merge(self._shards(), keys, session=session)
+            for name, project in pairs:
+                for hwName, hw in project.get('hwSets', {}).items():
+                    entry = merged.get(('projects', name, hwName))
+                    if entry is not None:
+                        hw['used'] = sum(entry['usage'].values())
+                        hw['user_usage'] = entry['usage']
+        return pairs
+
+    def _shardedProjectSets(self, projectName, hwNames, session=None):
+        # {hwName: shard count} for the sharded sets among hwNames
+        sharded = {}
+        for hwName in hwNames:
+            shards = counterShards.shardsOf(counterShards.projectKey(projectName, hwName))
+            if shards:
+                sharded[hwName] = shards
+        unknown = [hwName for hwName in hwNames if hwName not in sharded]
+        if unknown:
+            project = self._projects().find_one(
+                {'projectName': projectName},
+                {'_id': 0, **{f'hwSets.{hwName}.shards': 1 for hwName in unknown}},
+                session=session
+            )
+            for hwName, hw in (project or {}).get('hwSets', {}).items():
+                if 'shards' in hw:
+                    sharded[hwName] = hw['shards']
+                    counterShards.remember(counterShards.projectKey(projectName, hwName), hw['shards'])
+        return sharded
+
+    def projectUsage(self, includeProjects=True):
+        return list(self._projects().aggregate(inventoryPipeline(includeProjects)))
+
+    def addProjectUser(self, projectName, username):
+        try:
+            with self.client.start_session() as session:
+                # Both sides of the membership commit together
+                return session.with_transaction(
+                    lambda s: self._addMembership(projectName, username, session=s)
+                )
+        except OperationFailure as e:
+            if not transactionsUnsupported(e):
+                raise
+            return self._addMembership(projectName, username)
+
+    def _addMembership(self, projectName, username, session=None):
+        # Without a transaction the two writes are separate, but $addToSet is
+        # idempotent, so repeating the call repairs a half-recorded membership
+        (projectFilter, projectUpdate), (userFilter, userUpdate) = membershipOps(projectName, username)
+        project = self._projects().update_one(projectFilter, projectUpdate, session=session)
+        if not project.matched_count:
+            return None
+        user = self._users().update_one(userFilter, userUpdate, session=session)
+        return bool(project.modified_count or user.modified_count)
+
+    def checkOut(self, projectName, hwName, qty, username, lease=None):
+        if not counterShards.shardsOf(counterShards.projectKey(projectName, hwName)):
+            query, update, projection = checkOutQuery(projectName, hwName, qty, username, lease)
+            updated = self._projects().find_one_and_update(
+                query, update,
+                projection=projection,
+                return_document=ReturnDocument.AFTER
+            )
+            if updated:
+                return updated['hwSets'][hwName]
+            if not self._shardedProjectSets(projectName, [hwName]):
+                return None
+        return self._checkOutSharded(projectName, hwName, qty, username, lease)
+
+    def _checkOutSharded(self, projectName, hwName, qty, username, lease):
+        # Membership is read, not written, so concurrent checkouts only meet on the shards
+        project = self._projects().find_one(
+            {'projectName': projectName, 'users': username}, {'_id': 0, f'hwSets.{hwName}': 1}
+        )
+        hw = (project or {}).get('hwSets', {}).get(hwName)
+        if hw is None or 'shards' not in hw:
+            return None
+        key = counterShards.projectKey(projectName, hwName)
+        if not counterShards.take(self._shards(), key, hw['shards'], qty, username):
+            return None
+        if lease is not None and not self._projects().update_one(
+            {'projectName': projectName}, {'$push': {'leases': lease}}
+        ).matched_count:
+            counterShards.give(self._shards(), key, hw['shards'], qty, username)
+            return None
+        # used here is the merged copy from the last write-back
+        return hw
+
+    def checkIn(self, projectName, hwName, qty, username):
+        if not counterShards.shardsOf(counterShards.projectKey(projectName, hwName)):
+            query, update, projection = checkInQuery(projectName, hwName, qty, username)
+            before = self._projects().find_one_and_update(
+                query, update,
+                projection=projection,
+                return_document=ReturnDocument.BEFORE
+            )
+            if before:
+                return before['hwSets'][hwName]['user_usage'][username]
+            if not self._shardedProjectSets(projectName, [hwName]):
+                return None
+        project = self._projects().find_one(
+            {'projectName': projectName, 'users': username}, {'_id': 0, f'hwSets.{hwName}.shards': 1}
+        )
+        shards = (project or {}).get('hwSets', {}).get(hwName, {}).get('shards')
+        if not shards:
+            return None
+        heldBefore, returned = counterShards.give(
+            self._shards(), counterShards.projectKey(projectName, hwName), shards, qty, username
+        )
+        if not returned:
+            return None
+        self._consumeShardedLeases(projectName, hwName, username, returned)
+        return heldBefore
+
+    def _consumeShardedLeases(self, projectName, hwName, username, returned, session=None):
+        # Sharded check-ins are not part of the project update; use up the leases after them
+        self._projects().update_one(
+            {'projectName': projectName, 'leases': {'$elemMatch': {'hwName': hwName, 'username': username}}},
+            [{'$set': {'leases': consumeLeases(hwName, username, returned)}}],
+            session=session
+        )
+
+    def applyBatch(self, projectName, ops, username, atomic):
+        projection = batchProjection(ops)
+        hwNames = sorted({op['hwName'] for op in ops})
+        if atomic:
+            if not any(counterShards.shardsOf(counterShards.projectKey(projectName, hw)) for hw in hwNames):
+                query, update = atomicBatchQuery(projectName, ops, username)
+                if self._projects().find_one_and_update(query, update, projection=projection) is not None:
+                    return True
+            sharded = self._shardedProjectSets(projectName, hwNames)
+            if not sharded:
+                return False
+            return self._applyAtomicSharded(projectName, ops, username, sharded)
+
+        before = self._projects().find_one_and_update(
+            {'projectName': projectName, 'users': username},
+            bestEffortBatchPipeline(ops, username),
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is None:
+            return None
+        sharded = {hwName: hw['shards'] for hwName, hw in before.get('hwSets', {}).items() if 'shards' in hw}
+        if sharded:
+            # The pipeline skipped these sets; apply their operations on the shards,
+            # in order, and report what each one moved
+            self._mergeProjectSets([(projectName, before)])
+            processed = {}
+            for i, op in enumerate(ops):
+                shards = sharded.get(op['hwName'])
+                if shards is None:
+                    continue
+                key = counterShards.projectKey(projectName, op['hwName'])
+                if op['action'] == 'checkout':
+                    taken = counterShards.take(self._shards(), key, shards, op['qty'], username)
+                    processed[i] = op['qty'] if taken else 0
+                else:
+                    _, returned = counterShards.give(self._shards(), key, shards, op['qty'], username)
+                    if returned:
+                        self._consumeShardedLeases(projectName, op['hwName'], username, returned)
+                    processed[i] = returned
+            before['processed'] = processed
+        return before
+
+    def _applyAtomicSharded(self, projectName, ops, username, sharded):
+        def apply(session):
+            if not self._applyBatchShards(projectName, ops, username, sharded, session):
+                raise _BatchFailed()
+
+        try:
+            with self.client.start_session() as session:
+                session.with_transaction(apply)
+            return True
+        except _BatchFailed:
+            return False
+        except OperationFailure as e:
+            if not transactionsUnsupported(e):
+                raise
+        return self._applyBatchShards(projectName, ops, username, sharded, None)
+
+    def _applyBatchShards(self, projectName, ops, username, sharded, session):
+        # Same netting as atomicBatchQuery: per set, check-ins first, then check-outs.
+        # Without a transaction (session None) the applied steps are undone on failure.
+        totals = {}
+        for op in ops:
+            t = totals.setdefault(op['hwName'], {'checkout': 0, 'checkin': 0})
+            t[op['action']] += op['qty']
+        if self._projects().find_one({'projectName': projectName, 'users': username}, {'_id': 1},
+                                     session=session) is None:
+            return False
+
+        coll = self._shards()
+        undo = []
+        ok = True
+        for hwName, t in totals.items():
+            shards = sharded.get(hwName)
+            if shards is None:
+                continue
+            key = counterShards.projectKey(projectName, hwName)
+            if t['checkin']:
+                _, returned = counterShards.give(coll, key, shards, t['checkin'], username, session=session)
+                if returned:
+                    undo.append((counterShards.take, key, shards, returned))
+                if returned < t['checkin']:
+                    ok = False
+                    break
+            if t['checkout']:
+                if not counterShards.take(coll, key, shards, t['checkout'], username, session=session):
+                    ok = False
+                    break
+                undo.append((counterShards.give, key, shards, t['checkout']))
+
+        plainOps = [op for op in ops if op['hwName'] not in sharded]
+        if ok and plainOps:
+            query, update = atomicBatchQuery(projectName, plainOps, username)
+            ok = self._projects().update_one(query, update, session=session).matched_count == 1
+        if not ok and session is None:
+            for action, key, shards, qty in reversed(undo):
+                action(coll, key, shards, qty, username)
+        if ok:
+            for hwName, t in totals.items():
+                if hwName in sharded and t['checkin']:
+                    self._consumeShardedLeases(projectName, hwName, username, t['checkin'], session=session)
+        return ok
+
+    # ---------------- leases ----------------
+    def iterLeases(self, dueBefore=None):
+        query, projection = leaseQuery(dueBefore)
+        for doc in self._projects().find(query, projection).batch_size(STREAM_BATCH_SIZE):
+            for lease in doc.get('leases', []):
+                if dueBefore is None or lease['expiresAt'] <= dueBefore.replace(tzinfo=None):
+                    yield (doc['projectName'], lease)
+
+    def returnLeases(self, leasesByProject):
+        if not leasesByProject:
+            return []
+        sharded = self._leaseShards(leasesByProject)
+        # One update per project rather than a bulk write: the ledger needs the
+        # amounts, and expiries are rare next to checkouts
+        returned = []
+        for projectName, leases in leasesByProject.items():
+            sets = sharded.get(projectName, {})
+            query, update, projection = returnLeasesQuery(projectName, leases, skipSets=sets)
+            before = self._projects().find_one_and_update(
+                query, update, projection=projection, return_document=ReturnDocument.BEFORE
+            )
+            if before is None:
+                continue
+            for lease, qty in leaseReturns(before, leases, skipSets=sets):
+                if qty is None:
+                    # Sharded set: the lease is removed (at most once), now give back
+                    _, qty = counterShards.give(
+                        self._shards(), counterShards.projectKey(projectName, lease['hwName']),
+                        sets[lease['hwName']], lease['qty'], lease['username']
+                    )
+                returned.append((projectName, lease, qty))
+        return returned
+
+    def _leaseShards(self, leasesByProject):
+        # {projectName: {hwName: shard count}} for the sharded sets the leases are on
+        hwNames = {lease['hwName'] for leases in leasesByProject.values() for lease in leases}
+        projection = {'_id': 0, 'projectName': 1, **{f'hwSets.{hwName}.shards': 1 for hwName in hwNames}}
+        sharded = {}
+        for project in self._projects().find({'projectName': {'$in': list(leasesByProject)}}, projection):
+            sets = {hwName: hw['shards'] for hwName, hw in project.get('hwSets', {}).items() if 'shards' in hw}
+            if sets:
+                sharded[project['projectName']] = sets
+        return sharded
+
+    # ---------------- ledger ----------------
+    def _ledger(self, collection):
+        return self.client[LEDGER_DATABASE][collection]
+
+    def appendLedger(self, entries):
+        self._ledger(LEDGER_ENTRIES).insert_many(entries, ordered=False)
+
+    def findLedger(self, filters, after=None, before=None, limit=None):
+        cursor = self._ledger(LEDGER_ENTRIES).find(ledgerQuery(filters, after, before)).sort('_id', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        return iter(cursor.batch_size(BULK_BATCH_SIZE))
+
+    def saveLedgerSnapshot(self, header, projects):
+        # Projects first, header last: a snapshot without its header is never read
+        docs = [{'snapshot': header['_id'], **project} for project in projects]
+        for i in range(0, len(docs), BULK_BATCH_SIZE):
+            self._ledger(LEDGER_SNAPSHOT_PROJECTS).insert_many(docs[i:i + BULK_BATCH_SIZE], ordered=False)
+        self._ledger(LEDGER_SNAPSHOTS).insert_one(header)
+
+        stale = [doc['_id'] for doc in self._ledger(LEDGER_SNAPSHOTS).find({}, {'_id': 1})
+                 .sort([('upTo', -1), ('_id', -1)]).skip(LEDGER_SNAPSHOTS_KEPT)]
+        if stale:
+            self._ledger(LEDGER_SNAPSHOTS).delete_many({'_id': {'$in': stale}})
+            self._ledger(LEDGER_SNAPSHOT_PROJECTS).delete_many({'snapshot': {'$in': stale}})
+
+    def loadLedgerSnapshot(self, headerOnly=False):
+        header = self._ledger(LEDGER_SNAPSHOTS).find_one({}, sort=[('upTo', -1), ('_id', -1)])
+        if header is None or headerOnly:
+            return (header, [])
+        projects = self._ledger(LEDGER_SNAPSHOT_PROJECTS).find(
+            {'snapshot': header['_id']}, {'_id': 0, 'projectName': 1, 'hwSets': 1}
+        ).batch_size(BULK_BATCH_SIZE)
+        return (header, list(projects))
+
+    def claimLedgerSnapshot(self, slot):
+        return self._claimSlot(self._ledger(LEDGER_CLAIMS), 'snapshot', slot)
+
+    # ---------------- utilization rollups ----------------
+    def _rollups(self):
+        return self.client[ROLLUPS_DATABASE][ROLLUPS_COLLECTION]
+
+    def updateRollups(self, rows):
+        ops = [UpdateOne(row['key'], rollupUpdate(row), upsert=True) for row in rows]
+        for i in range(0, len(ops), BULK_BATCH_SIZE):
+            self._rollups().bulk_write(ops[i:i + BULK_BATCH_SIZE], ordered=False)
+
+    def findRollups(self, granularity, hwName, projectName, start, end):
+        return list(self._rollups().find(rollupQuery(granularity, hwName, projectName, start, end)).sort('start', 1))
+
+    def findPreviousRollup(self, granularity, hwName, projectName, before):
+        return self._rollups().find_one(previousRollupQuery(granularity, hwName, projectName, before),
+                                        sort=[('start', -1)])
+
+    def claimSampleSlot(self, slot):
+        return self._claimSlot(self.client[ROLLUPS_DATABASE][SAMPLE_SLOTS_COLLECTION], 'utilization', slot)
+
+    def _claimSlot(self, coll, name, slot):
+        # Moves the claim document forward to slot; only one upsert can do that
+        try:
+            result = coll.update_one({'_id': name, 'slot': {'$lt': slot}}, {'$set': {'slot': slot}}, upsert=True)
+        except DuplicateKeyError:
+            # Another worker already holds this slot (or a later one)
+            return False
+        return bool(result.modified_count or result.upserted_id)
+
+    # ---------------- rate limits ----------------
+    def takeTokens(self, key, cost, capacity, refillPerSecond):
+        buckets = self.client[RATE_LIMITS_DATABASE][RATE_LIMITS_COLLECTION]
+        update = tokenBucketUpdate(cost, capacity, refillPerSecond)
+        try:
+            doc = buckets.find_one_and_update({'_id': key}, update, projection={'allowed': 1, 'tokens': 1},
+                                              upsert=True, return_document=ReturnDocument.AFTER)
+        except DuplicateKeyError:
+            # Two first requests raced to create the bucket; it exists now
+            doc = buckets.find_one_and_update({'_id': key}, update, projection={'allowed': 1, 'tokens': 1},
+                                              return_document=ReturnDocument.AFTER)
+        return (doc['allowed'], doc['tokens'])
+
+    # ---------------- sharded counters ----------------
+    def _writeBackCounters(self, merged):
+        # Store merged shard totals in the parent documents (counterShards' background thread)
+        projectOps, hardwareOps = [], []
+        for (kind, name, hwName), entry in merged.items():
+            if kind == 'projects':
+                projectOps.append(UpdateOne({'projectName': name}, {'$set': {
+                    f'hwSets.{hwName}.used': sum(entry['usage'].values()),
+                    f'hwSets.{hwName}.user_usage': entry['usage']
+                }}))
+            else:
+                hardwareOps.append(UpdateOne({'hwName': name}, {'$set': {'availability': entry['free']}}))
+        if projectOps:
+            self._projects().bulk_write(projectOps, ordered=False)
+        if hardwareOps:
+            self._hardware().bulk_write(hardwareOps, ordered=False)
+
+    # ---------------- change counters ----------------
+    def bumpVersion(self, kinds):
+        if len(kinds) == 1:
+            self._versions().update_one({'_id': kinds[0]}, VERSION_INC, upsert=True)
+        else:
+            self._versions().bulk_write(versionOps(kinds), ordered=False)
+
+    def getVersion(self, kind):
+        doc = self._versions().find_one({'_id': kind})
+        return doc['version'] if doc else 0
+
+    # ---------------- bulk ----------------
+    def bulkLoad(self, kind, docs, upsert=False):
+        database, collection, key = COLLECTIONS[kind]
+        coll = self.client[database][collection]
+        counts = {'inserted': 0, 'updated': 0, 'duplicates': 0, 'errors': []}
+        try:
+            if upsert:
+                result = coll.bulk_write(
+                    [ReplaceOne({key: doc[key]}, doc, upsert=True) for doc in docs],
+                    ordered=False
+                )
+                counts['inserted'] = result.upserted_count
+                counts['updated'] = result.matched_count
+            else:
+                result = coll.insert_many(docs, ordered=False)
+                counts['inserted'] = len(result.inserted_ids)
+        except BulkWriteError as e:
+            details = e.details
+            counts['inserted'] = details.get('nInserted', 0) + details.get('nUpserted', 0)
+            counts['updated'] = details.get('nMatched', 0)
+            for error in details.get('writeErrors', []):
+                if error.get('code') == DUPLICATE_KEY and not upsert:
+                    counts['duplicates'] += 1
+                else:
+                    counts['errors'].append((error['index'], error.get('errmsg')))
+        return counts
+
+    def exportDocs(self, kind):
+        database, collection, key = COLLECTIONS[kind]
+        cursor = self.client[database][collection].find({}, {'_id': 0}).sort(key, 1).batch_size(BULK_BATCH_SIZE)
+        return iter(cursor)
+
+
+# ============================================================
+# Helpers
+# ============================================================
+def _shardedProject(doc):
+    # Copy of a new project marked sharded, and the shard documents holding its headroom
+    doc = {**doc, 'hwSets': {hwName: dict(hw) for hwName, hw in doc['hwSets'].items()}}
+    shardDocs = []
+    for hwName, hw in doc['hwSets'].items():
+        hw['shards'] = counterShards.COUNTER_SHARDS
+        shardDocs.extend(counterShards.newShards(
+            counterShards.projectKey(doc['projectName'], hwName),
+            hw['capacity'] - hw.get('used', 0), usage=hw.get('user_usage')
+        ))
+    return (doc, shardDocs)
@@ -0,0 +1,356 @@
+# passwordHasher.py
+import asyncio
+import atexit
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from passlib.context import CryptContext
+
+'''
+Bounded bcrypt worker pool.
+
+bcrypt is deliberately slow, so hashing and verification run in a small
+process pool instead of on the request thread. At most BCRYPT_MAX_PENDING
+jobs may be queued or running per worker process; beyond that callers get
+HasherBusy and the route answers 503 with a Retry-After header instead of
+piling more CPU work onto an overloaded worker. A job that takes longer than
+JOB_TIMEOUT_SECONDS, or a pool whose processes died, raises HasherUnavailable
+(a HasherBusy, so the routes answer it the same way) rather than looking like
+wrong credentials; a broken pool is replaced on the next job.
+
+Environment variables:
+    BCRYPT_ROUNDS          cost factor for new hashes            (default 12)
+    BCRYPT_WORKERS         hashing processes, 0 = run inline     (default CPU count)
+    BCRYPT_MAX_PENDING     queued + running jobs before 503      (default 4 per process)
+    BCRYPT_RETRY_AFTER     Retry-After seconds on back-pressure  (default 1)
+    BCRYPT_VERIFY_CACHE_TTL  seconds a successful verification is remembered (default 300, 0 = off)
+
+Hashes created with a different cost are upgraded on the next successful
+login (see CryptContext.needs_update).
+'''
+
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+HASH_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1))
+MAX_PENDING = int(os.environ.get('BCRYPT_MAX_PENDING', max(1, HASH_WORKERS) * 4))
+RETRY_AFTER_SECONDS = int(os.environ.get('BCRYPT_RETRY_AFTER', 1))
+VERIFY_CACHE_TTL = float(os.environ.get('BCRYPT_VERIFY_CACHE_TTL', 300))
+VERIFY_CACHE_SIZE = 4096
+JOB_TIMEOUT_SECONDS = 30
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+
+# Verify latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class HasherBusy(Exception):
+    """Raised when the hashing queue is full; the caller should retry later."""
+
+    def __init__(self, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__("Password hashing queue is full. Please retry shortly.")
+        self.retry_after = retry_after
+
+
+class HasherUnavailable(HasherBusy):
+    """Raised when a job timed out or the pool failed; the caller should retry later."""
+
+    def __init__(self, retry_after=RETRY_AFTER_SECONDS):
+        super().__init__(retry_after)
+        self.args = ("Password hashing is temporarily unavailable. Please retry shortly.",)
+
+
+# ============================================================
+# Jobs (run inside the pool processes)
+# ============================================================
+def _hashJob(password):
+    return pwd_context.hash(password)
+
+
+def _hashBatchJob(passwords):
+    return [pwd_context.hash(password) for password in passwords]
+
+
+def _verifyJob(password, hashed):
+    # Returns (matches, replacement_hash_or_None)
+    if not pwd_context.verify(password, hashed):
+        return (False, None)
+    if pwd_context.needs_update(hashed):
+        return (True, pwd_context.hash(password))
+    return (True, None)
+
+
+# ============================================================
+# Per-process state
+# ============================================================
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = threading.BoundedSemaphore(MAX_PENDING)
+_cache_key = os.urandom(32)
+_verify_cache = OrderedDict()
+
+_stats = {
+    'verifyCount': 0,
+    'verifyFailures': 0,
+    'verifySecondsTotal': 0.0,
+    'verifySecondsMax': 0.0,
+    'verifyBuckets': [0] * len(LATENCY_BUCKETS),
+    'hashCount': 0,
+    'rehashCount': 0,
+    'cacheHits': 0,
+    'rejected': 0,
+    'unavailable': 0
+}
+
+
+def _getPool():
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # spawn, not fork: the web worker is multi-threaded
+            _pool = ProcessPoolExecutor(
+                max_workers=HASH_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _resetAfterFork():
+    global _pool, _pool_pid, _lock, _slots, _cache_key
+    _pool = None
+    _pool_pid = None
+    _lock = threading.Lock()
+    _slots = threading.BoundedSemaphore(MAX_PENDING)
+    _cache_key = os.urandom(32)
+    _verify_cache.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
+
+
+def _submit(job, *args):
+    """Queue a job on the pool, or raise HasherBusy if the queue is full."""
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        with _lock:
+            _stats['rejected'] += 1
+        raise HasherBusy()
+
+    try:
+        if HASH_WORKERS <= 0:
+            future = Future()
+            try:
+                future.set_result(job(*args))
+            except Exception as e:
+                future.set_exception(e)
+        else:
+            future = _getPool().submit(job, *args)
+    except BrokenProcessPool as e:
+        slots.release()
+        _unavailable(e)
+    except Exception:
+        slots.release()
+        raise
+
+    future.add_done_callback(lambda _: slots.release())
+    return future
+
+
+def _unavailable(e):
+    """Count a timed out or failed job, drop a broken pool and raise HasherUnavailable."""
+    global _pool, _pool_pid
+    with _lock:
+        _stats['unavailable'] += 1
+        if isinstance(e, BrokenProcessPool) and _pool is not None and getattr(_pool, '_broken', True):
+            _pool = None
+            _pool_pid = None
+    print(f"Password hashing unavailable: {e!r}")
+    raise HasherUnavailable() from e
+
+
+def _result(future):
+    try:
+        return future.result(timeout=JOB_TIMEOUT_SECONDS)
+    except (TimeoutError, BrokenProcessPool) as e:
+        _unavailable(e)
+
+
+async def _resultAsync(future):
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), JOB_TIMEOUT_SECONDS)
+    except (TimeoutError, BrokenProcessPool) as e:
+        _unavailable(e)
+
+
+# ============================================================
+# Verification cache
+# ============================================================
+def _cacheKey(password, hashed):
+    # Keyed with a per-process secret so the cache never holds anything reusable
+    return hmac.new(_cache_key, f"{hashed}\0{password}".encode(), hashlib.sha256).digest()
+
+
+def _cacheLookup(key):
+    if VERIFY_CACHE_TTL <= 0:
+        return False
+    with _lock:
+        expires = _verify_cache.get(key)
+        if expires is None:
+            return False
+        if expires < time.monotonic():
+            del _verify_cache[key]
+            return False
+        _verify_cache.move_to_end(key)
+        _stats['cacheHits'] += 1
+        return True
+
+
+def _cacheStore(key):
+    if VERIFY_CACHE_TTL <= 0:
+        return
+    with _lock:
+        _verify_cache[key] = time.monotonic() + VERIFY_CACHE_TTL
+        _verify_cache.move_to_end(key)
+        while len(_verify_cache) > VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+
+
+def _recordVerify(started, result):
+    elapsed = time.perf_counter() - started
+    with _lock:
+        _stats['verifyCount'] += 1
+        _stats['verifySecondsTotal'] += elapsed
+        _stats['verifySecondsMax'] = max(_stats['verifySecondsMax'], elapsed)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if elapsed <= bound:
+                _stats['verifyBuckets'][i] += 1
+                break
+        if not result[0]:
+            _stats['verifyFailures'] += 1
+        if result[1]:
+            _stats['rehashCount'] += 1
+
+
+# ============================================================
+# Public API
+# ============================================================
+def submitHash(password):
+    """Queue a hash job and return its Future. Raises HasherBusy."""
+    with _lock:
+        _stats['hashCount'] += 1
+    return _submit(_hashJob, password)
+
+
+def submitVerify(password, hashed):
+    """
+    Queue a verification and return a Future of (matches, new_hash_or_None).
+    Raises HasherBusy. Recently verified credentials resolve immediately.
+    """
+    key = _cacheKey(password, hashed)
+    if _cacheLookup(key):
+        future = Future()
+        future.set_result((True, None))
+        return future
+
+    started = time.perf_counter()
+    future = _submit(_verifyJob, password, hashed)
+
+    def on_done(f):
+        if f.exception() is not None:
+            return
+        result = f.result()
+        _recordVerify(started, result)
+        if result[0] and not result[1]:
+            _cacheStore(key)
+
+    future.add_done_callback(on_done)
+    return future
+
+
+def hashPassword(password):
+    """Hash a password on the pool. Raises HasherBusy (or HasherUnavailable)."""
+    return _result(submitHash(password))
+
+
+async def hashPasswordAsync(password):
+    """hashPassword for asyncApp, awaited on the event loop."""
+    return await _resultAsync(submitHash(password))
+
+
+def hashMany(passwords):
+    """
+    Hash a batch of passwords across every pool process, preserving order.
+    Meant for bulk imports: the batch is split into one chunk per process and
+    does not count against BCRYPT_MAX_PENDING, so call it from the import path
+    only, never per request.
+    """
+    passwords = list(passwords)
+    if not passwords:
+        return []
+    with _lock:
+        _stats['hashCount'] += len(passwords)
+    if HASH_WORKERS <= 0:
+        return _hashBatchJob(passwords)
+
+    size = -(-len(passwords) // HASH_WORKERS)
+    chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    futures = [_getPool().submit(_hashBatchJob, chunk) for chunk in chunks]
+    hashes = []
+    for future in futures:
+        hashes.extend(future.result(timeout=JOB_TIMEOUT_SECONDS * len(chunks[0])))
+    return hashes
+
+
+def verifyPassword(password, hashed):
+    """
+    Check a password against its stored hash on the pool.
+    Returns (matches, new_hash); new_hash is set when the stored hash should be
+    replaced because it was created with different settings. Raises HasherBusy
+    (or HasherUnavailable).
+    """
+    return _result(submitVerify(password, hashed))
+
+
+async def verifyPasswordAsync(password, hashed):
+    """verifyPassword for asyncApp, awaited on the event loop."""
+    return await _resultAsync(submitVerify(password, hashed))
+
+
+def getStats():
+    """Snapshot of verify latency and queue counters for this process."""
+    with _lock:
+        stats = dict(_stats)
+        stats['verifyBuckets'] = {str(bound): count for bound, count in zip(LATENCY_BUCKETS, _stats['verifyBuckets'])}
+        stats['cacheSize'] = len(_verify_cache)
+    stats['maxPending'] = MAX_PENDING
+    stats['workers'] = HASH_WORKERS
+    stats['rounds'] = BCRYPT_ROUNDS
+    return stats
+
+
+def shutdown():
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pool_pid = None
+
+
+atexit.register(shutdown)
@@ -1,10 +1,22 @@
 # projectsDatabase.py
-from pymongo import MongoClient
 import HWDatabase as HWDB
+import checkoutLedger
+import checkoutLeases
+import collectionVersions
+import hwCache
+import inventoryEvents
+import utilizationSeries
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
-# In-memory project storage (replace with MongoDB for persistence)
-_projects_storage = []
+
+# Fields a client may ask for on GET /projects, and page size limits
+PROJECT_FIELDS = ('projectName', 'description', 'hwSets', 'users')
+MAX_PAGE_SIZE = 500
+# Returned by getUserProjects; the member list is left out
+USER_PROJECT_FIELDS = ('projectName', 'description', 'hwSets')
 
 '''
 Structure of Project entry:
@@ -28,31 +40,24 @@ class ProjectData(BaseModel):
 # ============================================================
 # Create a new project
 # ============================================================
-def createProject(client, projectName, description, hwSets_dict):
+def createProject(store, projectName, description, hwSets_dict):
     """
     Create a new project and allocate hardware from the global HW pool.
     hwSets_dict: { 'HWSet1': 100, 'HWSet2': 50 } → reserve from global pool
+
+    The cost is constant in the number of sets: one query to validate, then
+    the storage engine reserves and inserts all or nothing (a transaction on
+    MongoDB), so concurrent creations cannot oversubscribe the pool.
+    Duplicate names raise DuplicateKeyError, which also undoes the reservations.
     """
     try:
-        # Prevent duplicate project names
-        existing = client['Projects'].project.find_one({"projectName": projectName})
-        if existing:
-            return (False, f"Project '{projectName}' already exists.")
-
-        # 1) Validate all requested hw sets exist and have sufficient availability
-        hwSets = {}
-        validation_errors = []
-        for hwName, reserve_amount in hwSets_dict.items():
-            hw_info = HWDB.queryHardwareSet(client, hwName)
-            if not hw_info:
-                validation_errors.append(f"Hardware set '{hwName}' not found.")
-                continue
-
-            availability = hw_info.get('availability', 0)
-            if reserve_amount > availability:
-                validation_errors.append(
-                    f"Not enough '{hwName}' available. Requested {reserve_amount}, only {availability} left."
-                )
+        requested, err = parseReservations(hwSets_dict)
+        if err:
+            return (False, err)
+
+        # 1) Validate all requested hw sets exist and have sufficient availability (one query)
+        hw_infos = HWDB.queryHardwareSets(store, requested.keys())
+        validation_errors = validateReservations(requested, hw_infos)
 
         # If any validation failed, abort creation and do not modify global HW state
         if validation_errors:
@@ -61,83 +66,232 @@ def createProject(client, projectName, description, hwSets_dict):
             print(f"Project creation for '{projectName}' aborted due to insufficient hardware or missing sets.")
             return (False, '; '.join(validation_errors))
 
-        # 2) All validations passed — reserve hardware from the global pool and build project hwSets
-        for hwName, reserve_amount in hwSets_dict.items():
-            hw_info = HWDB.queryHardwareSet(client, hwName)
-            capacity = hw_info.get('capacity', 0)
-            availability = hw_info.get('availability', 0)
-
-            # Deduct reserved amount from global availability
-            new_global_avail = availability - reserve_amount
-            HWDB.updateAvailability(client, hwName, new_global_avail)
-
-            # Add reserved pool to project (starts unused)
-            hwSets[hwName] = {
-                'used': 0,
-                'capacity': reserve_amount
-            }
-
-        # Build project document
-        project_doc = ProjectData(
-            projectName=projectName,
-            description=description,
-            hwSets=hwSets,
-            users=[]
-        )
-
-        proj_model_dump = project_doc.model_dump()
-        client['Projects'].project.insert_one(proj_model_dump)
-        print(f"Created project '{projectName}' with hardware: {hwSets}")
+        # 2) Build the project; each reserved pool starts unused
+        proj_model_dump = newProjectDoc(projectName, description, requested)
+
+        # 3) Reserve from the global pool and insert the project atomically
+        reserved = store.insertProjectWithReservations(proj_model_dump, requested)
+
+        if not reserved:
+            print(f"Project creation for '{projectName}' aborted: hardware was taken concurrently.")
+            return (False, "Hardware availability changed while creating the project. Please try again.")
+
+        # Reservations are only visible once the transaction has committed
+        hwCache.invalidate()
+        collectionVersions.bump(store, 'projects', 'hardware')
+        checkoutLedger.record(store, checkoutLedger.reservationEntries(projectName, requested))
+        inventoryEvents.publish(projectCreatedEvent(proj_model_dump))
+
+        print(f"Created project '{projectName}' with hardware: {proj_model_dump['hwSets']}")
         return (True, None)
 
+    except DuplicateKeyError:
+        return (False, f"Project '{projectName}' already exists.")
     except Exception as e:
         print(f"Error creating project: {e}")
         return (False, f"Error creating project: {e}")
 
 
+def parseReservations(hwSets_dict):
+    # { hwName: amount } with names checked and amounts coerced to non-negative ints
+    requested = {}
+    for hwName, reserve_amount in (hwSets_dict or {}).items():
+        if not isValidKey(hwName):
+            return (None, f"Invalid hardware set name '{hwName}'.")
+        reserve_amount = int(reserve_amount)
+        if reserve_amount < 0:
+            return (None, f"Reserved amount for '{hwName}' must not be negative.")
+        requested[hwName] = reserve_amount
+    return (requested, None)
+
+
+def validateReservations(requested, hw_infos):
+    validation_errors = []
+    for hwName, reserve_amount in requested.items():
+        hw_info = hw_infos.get(hwName)
+        if not hw_info:
+            validation_errors.append(f"Hardware set '{hwName}' not found.")
+            continue
+
+        availability = hw_info.get('availability', 0)
+        if reserve_amount > availability:
+            validation_errors.append(
+                f"Not enough '{hwName}' available. Requested {reserve_amount}, only {availability} left."
+            )
+    return validation_errors
+
+
+def newProjectDoc(projectName, description, requested):
+    hwSets = {
+        hwName: {'used': 0, 'capacity': reserve_amount}
+        for hwName, reserve_amount in requested.items()
+    }
+    project_doc = ProjectData(
+        projectName=projectName,
+        description=description,
+        hwSets=hwSets,
+        users=[]
+    )
+    return project_doc.model_dump()
+
+
+# Deltas pushed to /events/inventory subscribers (see inventoryEvents)
+def projectCreatedEvent(project_doc):
+    hwSets = {
+        hwName: {'capacity': entry['capacity'], 'used': entry['used']}
+        for hwName, entry in project_doc['hwSets'].items()
+    }
+    return {
+        'type': 'projectCreated',
+        'projectName': project_doc['projectName'],
+        'description': project_doc['description'],
+        'users': project_doc['users'],
+        'hwSets': hwSets
+    }
+
+
+def _recordMovements(store, entries):
+    # Applied check-outs/check-ins go to the ledger and the utilization rollups
+    checkoutLedger.record(store, entries)
+    utilizationSeries.note(entries)
+
+
+def usageEvent(action, projectName, hwName, username, qty):
+    return {'type': action, 'projectName': projectName, 'hwName': hwName, 'username': username, 'qty': qty}
+
+
+def batchEvents(projectName, username, results):
+    # One checkout/checkin delta per applied batch operation, in order
+    return [
+        usageEvent(r['action'], projectName, r['hwName'], username, r['processedQty'])
+        for r in results if r['success'] and r['processedQty'] > 0
+    ]
+
+
+def userAddedEvent(projectName, username):
+    return {'type': 'userAdded', 'projectName': projectName, 'username': username}
+
+
 # ============================================================
 # Get all projects
 # ============================================================
-def getProjects(client):
+def getProjects(store):
     """Return all project entries."""
     try:
-        project_sets = list(client['Projects'].project.find({}))
-
-        _projects_storage =[]
-
-        for projSet in project_sets:
-            _projects_storage.append({
-                'projectName': projSet['projectName'],
-                'description': projSet['description'],
-                'hwSets': projSet['hwSets'],
-                'users': projSet['users']
-            })
-        return _projects_storage
+        return [summary for _, summary in iterProjects(store)]
     except Exception as e:
         print(f"Error getting projects: {e}")
         return []
 
 
+# ============================================================
+# Page through projects
+# ============================================================
+def iterProjects(store, after=None, limit=None, fields=None, member=None, hwName=None):
+    """
+    Yield (cursor, project) pairs in _id order without materialising the list.
+      after:  keyset cursor, the _id (hex string) of the last project already seen
+      limit:  page size (None = everything after the cursor)
+      fields: subset of PROJECT_FIELDS to return (None = all)
+      member: only projects this username belongs to
+      hwName: only projects that reserve this hardware set
+    The cursor of the last yielded project resumes the listing on the next page.
+    Raises ValueError for a malformed cursor, field list or filter.
+    """
+    after, fields, member, hwName = parseListArgs(after, fields, member, hwName)
+    for projSet in store.iterProjects(after, limit, fields, member, hwName):
+        yield (str(projSet['_id']), projectSummary(projSet))
+
+
+def parseListArgs(after, fields, member, hwName):
+    # Returns (after as ObjectId, fields, member, hwName); raises ValueError
+    if after:
+        try:
+            after = ObjectId(after)
+        except (InvalidId, TypeError):
+            raise ValueError(f"Invalid cursor '{after}'.")
+    if hwName and not isValidKey(hwName):
+        raise ValueError(f"Invalid hardware set name '{hwName}'.")
+
+    fields = list(fields) if fields else list(PROJECT_FIELDS)
+    unknown = [f for f in fields if f not in PROJECT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown project field(s): {', '.join(unknown)}.")
+    return (after or None, fields, member or None, hwName or None)
+
+
+def projectSummary(projSet):
+    return {f: projSet[f] for f in PROJECT_FIELDS if f in projSet}
+
+
+# ============================================================
+# Projects a user belongs to
+# ============================================================
+def getMemberProjects(store, username):
+    """Names of the projects listing username as a member (users_membership index)."""
+    return [project['projectName'] for _, project in iterProjects(store, member=username, fields=['projectName'])]
+
+
+def getUserProjects(store, username):
+    """
+    Projects username belongs to with their hardware state (hwSets: used,
+    capacity and per-user usage), from one query on the users_membership index.
+    """
+    return [project for _, project in iterProjects(store, member=username, fields=USER_PROJECT_FIELDS)]
+
+
+# ============================================================
+# Inventory across all projects
+# ============================================================
+def getInventory(store, includeProjects=True):
+    """
+    Per-hardware-set totals: global capacity and availability, units reserved
+    by projects, units checked out, and (optionally) a per-project breakdown.
+    The project side is a single aggregation on MongoDB; Hardware and Projects
+    live in different databases, so the global numbers come from getAllHwSets (cached).
+    """
+    per_set = store.projectUsage(includeProjects)
+    return mergeInventory(HWDB.getAllHwSets(store), per_set, includeProjects)
+
+
+def mergeInventory(hw_list, per_set, includeProjects):
+    usage = {entry['_id']: entry for entry in per_set}
+    names = sorted({hw['hwName'] for hw in hw_list} | set(usage))
+    hw_by_name = {hw['hwName']: hw for hw in hw_list}
+
+    inventory = []
+    for hwName in names:
+        hw = hw_by_name.get(hwName, {})
+        used = usage.get(hwName, {})
+        entry = {
+            'hwName': hwName,
+            'capacity': hw.get('capacity', 0),
+            'availability': hw.get('availability', 0),
+            'reserved': used.get('reserved', 0),
+            'checkedOut': used.get('checkedOut', 0)
+        }
+        entry['reservedIdle'] = entry['reserved'] - entry['checkedOut']
+        if includeProjects:
+            entry['projects'] = used.get('projects', [])
+        inventory.append(entry)
+    return inventory
+
+
 # ============================================================
 # Add user to project
 # ============================================================
-def addProjectUser(client, projectName, username):
+def addProjectUser(store, projectName, username):
     """Add a user to an existing project."""
     try:
-        existing = client['Projects'].project.find_one({"projectName": projectName})
-        if existing:
-            users = existing['users']
-            if username not in users:
-                users.append(username)
-                client['Projects'].project.update_one(
-                    {'projectName': projectName},
-                    {'$set': {'users': users}}
-                )
-                print(f"Added user '{username}' to project '{projectName}'")
-                return True
-            else:
-                print(f"User '{username}' already in project '{projectName}'")
-                return False
+        added = store.addProjectUser(projectName, username)
+        if added:
+            collectionVersions.bump(store, 'projects')
+            inventoryEvents.publish(userAddedEvent(projectName, username))
+            print(f"Added user '{username}' to project '{projectName}'")
+            return True
+        if added is False:
+            print(f"User '{username}' already in project '{projectName}'")
+            return False
         print(f"Project '{projectName}' not found.")
         return False
     except Exception as e:
@@ -150,67 +304,259 @@ def addProjectUser(client, projectName, username):
 # ============================================================
 # Return signature: (success: bool, processed_qty: int, error_msg: str | None)
 
-def checkOutHW(client, projectName, hwName, qty, username=None):
+def checkOutHW(store, projectName, hwName, qty, username=None, lease=None):
+    """
+    Check out qty units of hwName for username in a single round trip.
+    Membership, set existence and remaining headroom are part of the update
+    filter, so concurrent checkouts can never push 'used' past 'capacity'.
+    A lease (checkoutLeases.newLease) is stored by the same update and the
+    units are returned when it expires.
+    """
     try:
-        existing = client['Projects'].project.find_one({"projectName": projectName})
-        if existing:
-            users = existing['users']
-            if username not in users:
-                return (False, 0, f"User '{username}' is not part of project '{projectName}'")
-            if hwName not in existing['hwSets']:
-                return (False, 0, f"'{hwName}' not found in project '{projectName}'")
-            hw_entry = existing['hwSets'][hwName]
-            available = hw_entry['capacity'] - hw_entry['used'] 
-            if qty > available:
-                return (False, 0, f"Not enough '{hwName}' available. Requested {qty}, only {available} left.")
-            hw_entry.setdefault('user_usage', {})
-
-            client['Projects'].project.update_one(
-                {"projectName": projectName},
-                {
-                    '$set': {
-                        f'hwSets.{hwName}.used': hw_entry['used'] + qty,
-                        f'hwSets.{hwName}.user_usage.{username}': hw_entry['user_usage'].get(username, 0) + qty
-                    }
-                }
-            )
+        qty = int(qty)
+        if qty <= 0:
+            return (False, 0, "Quantity must be a positive integer.")
+        if not isValidKey(hwName) or not isValidKey(username):
+            return (False, 0, "Invalid hardware set or user name.")
+
+        hw_entry = store.checkOut(projectName, hwName, qty, username, lease)
+        if hw_entry:
+            print(f"Checked out {qty} '{hwName}' in '{projectName}' → {hw_entry['used']}/{hw_entry['capacity']}")
+            if lease:
+                checkoutLeases.schedule(projectName, lease)
+            collectionVersions.bump(store, 'projects')
+            _recordMovements(store, [checkoutLedger.entry('checkout', projectName, hwName, username, qty)])
+            inventoryEvents.publish(usageEvent('checkout', projectName, hwName, username, qty))
             return (True, qty, None)
 
-        return (False, 0, f"Project '{projectName}' not found.")
+        # The conditional update matched nothing; read once to explain why
+        existing = store.findProject(projectName, [hwName])
+        return (False, 0, checkOutFailureReason(existing, projectName, hwName, qty, username))
     except Exception as e:
         return (False, 0, f"Error checking out HW: {e}")
 
+
+def checkOutFailureReason(existing, projectName, hwName, qty, username):
+    if not existing:
+        return f"Project '{projectName}' not found."
+    if username not in existing.get('users', []):
+        return f"User '{username}' is not part of project '{projectName}'"
+    if hwName not in existing.get('hwSets', {}):
+        return f"'{hwName}' not found in project '{projectName}'"
+    hw_entry = existing['hwSets'][hwName]
+    available = hw_entry['capacity'] - hw_entry['used']
+    return f"Not enough '{hwName}' available. Requested {qty}, only {available} left."
+
+
+def isValidKey(name):
+    # Names are embedded in update paths, so they must not contain '.' or start with '$'
+    return isinstance(name, str) and name != '' and '.' not in name and not name.startswith('$')
+
 # ============================================================
 # Check in hardware within a project
 # ============================================================
-def checkInHW(client, projectName, hwName, qty, username=None):
+def checkInHW(store, projectName, hwName, qty, username=None):
+    """
+    Check in up to qty units of hwName that username currently holds, in a
+    single write by the storage engine, which clamps to the user's own usage
+    and decrements 'used' and 'user_usage.<username>' together: on MongoDB
+    the pipeline from mongoQueries.checkInQuery, with mongoQueries.consumeLeases
+    using up the user's leases (counterShards.give for sharded sets), and
+    MemoryStorage.checkIn in memory. The processed quantity is derived from
+    the units held before the update, which the engine returns.
+    """
     try:
-        existing = client['Projects'].project.find_one({"projectName": projectName})
-        if existing:
-            if username not in existing['users']:
-                return (False, 0, f"User '{username}' is not part of project '{projectName}'")
-            if hwName not in existing['hwSets']:
-                return (False, 0, f"'{hwName}' not found in project '{projectName}'")
-
-            hw_entry = existing['hwSets'][hwName]
-            current_used = hw_entry.get('used', 0)
-
-            if current_used <= 0:
-                return (False, 0, f"No '{hwName}' currently checked out in project '{projectName}'")
-
-            # Only process up to what is actually used
-            processed = min(qty, current_used)
-            new_used = current_used - processed
-
-            client['Projects'].project.update_one(
-                {"projectName": projectName},
-                {
-                    '$set': {f'hwSets.{hwName}.used': new_used}
-                }
-            )
+        qty = int(qty)
+        if qty <= 0:
+            return (False, 0, "Quantity must be a positive integer.")
+        if not isValidKey(hwName) or not isValidKey(username):
+            return (False, 0, "Invalid hardware set or user name.")
 
+        held = store.checkIn(projectName, hwName, qty, username)
+        if held is not None:
+            processed = min(qty, held)
+            collectionVersions.bump(store, 'projects')
+            _recordMovements(store, [checkoutLedger.entry('checkin', projectName, hwName, username, processed)])
+            inventoryEvents.publish(usageEvent('checkin', projectName, hwName, username, processed))
             return (True, processed, None)
 
-        return (False, 0, f"Project '{projectName}' not found.")
+        # The conditional update matched nothing; read once to explain why
+        existing = store.findProject(projectName, [hwName])
+        return (False, 0, checkInFailureReason(existing, projectName, hwName, username))
     except Exception as e:
         return (False, 0, f"Error checking in HW: {e}")
+
+
+def checkInFailureReason(existing, projectName, hwName, username):
+    if not existing:
+        return f"Project '{projectName}' not found."
+    if username not in existing.get('users', []):
+        return f"User '{username}' is not part of project '{projectName}'"
+    if hwName not in existing.get('hwSets', {}):
+        return f"'{hwName}' not found in project '{projectName}'"
+    return f"User '{username}' has no '{hwName}' checked out in project '{projectName}'"
+
+
+# ============================================================
+# Batch check out / check in within a project
+# ============================================================
+# operations: [ {'action': 'checkout' | 'checkin', 'hwName': str, 'qty': int}, ... ]
+# Return signature: (success: bool, results: list, error_msg: str | None)
+#   results[i] = {'action', 'hwName', 'qty', 'processedQty', 'success', 'message'}
+
+BATCH_MODES = ('atomic', 'bestEffort')
+MAX_BATCH_OPERATIONS = 100
+
+
+def applyHWBatch(store, projectName, operations, username=None, mode='atomic'):
+    """
+    Apply several check-outs/check-ins to one project in a single write.
+
+    atomic:     all operations apply or none do. Per set, check-ins are bounded
+                by what the user holds and check-outs by the headroom left
+                after those check-ins; the whole batch is one conditional write.
+    bestEffort: operations apply in order, each on its own merits (check-outs
+                are all-or-nothing, check-ins are clamped like checkInHW), in
+                one write. Per-item results are replayed from the pre-update
+                document the storage engine returns, except for sets with
+                sharded counters, whose operations the engine reports itself.
+    """
+    try:
+        ops, err = parseBatch(operations, mode, username)
+        if err:
+            return (False, [], err)
+
+        hwNames = sorted({op['hwName'] for op in ops})
+
+        if mode == 'atomic':
+            if store.applyBatch(projectName, ops, username, atomic=True):
+                results = [batchResult(op, op['qty'], None) for op in ops]
+                collectionVersions.bump(store, 'projects')
+                _recordMovements(store, checkoutLedger.batchEntries(projectName, username, results))
+                for event in batchEvents(projectName, username, results):
+                    inventoryEvents.publish(event)
+                return (True, results, None)
+            existing = store.findProject(projectName, hwNames)
+            return batchFailure(existing, projectName, ops, username, atomic=True)
+
+        before = store.applyBatch(projectName, ops, username, atomic=False)
+        if not before:
+            existing = store.findProject(projectName, hwNames)
+            return batchFailure(existing, projectName, ops, username, atomic=False)
+        results = simulateBatch(before, projectName, ops, username)
+        for i, processed in before.get('processed', {}).items():
+            results[i] = processedResult(ops[i], processed, projectName, username)
+        if any(r['success'] for r in results):
+            collectionVersions.bump(store, 'projects')
+            _recordMovements(store, checkoutLedger.batchEntries(projectName, username, results))
+            for event in batchEvents(projectName, username, results):
+                inventoryEvents.publish(event)
+        return (all(r['success'] for r in results), results, None)
+
+    except Exception as e:
+        return (False, [], f"Error applying hardware batch: {e}")
+
+
+def parseBatch(operations, mode, username):
+    if mode not in BATCH_MODES:
+        return (None, f"Mode must be one of: {', '.join(BATCH_MODES)}.")
+    if not isValidKey(username):
+        return (None, "Invalid user name.")
+    if not isinstance(operations, list) or not operations:
+        return (None, "At least one operation is required.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return (None, f"At most {MAX_BATCH_OPERATIONS} operations per batch.")
+
+    ops = []
+    for i, op in enumerate(operations):
+        if not isinstance(op, dict):
+            return (None, f"Operation {i} must be an object.")
+        action = op.get('action')
+        hwName = op.get('hwName')
+        if action not in ('checkout', 'checkin'):
+            return (None, f"Operation {i}: action must be 'checkout' or 'checkin'.")
+        if not isValidKey(hwName):
+            return (None, f"Operation {i}: invalid hardware set name.")
+        try:
+            qty = int(op.get('qty'))
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            return (None, f"Operation {i}: quantity must be a positive integer.")
+        ops.append({'action': action, 'hwName': hwName, 'qty': qty})
+    return (ops, None)
+
+
+def simulateBatch(existing, projectName, ops, username):
+    # Replays the best-effort pipeline in Python against the pre-update document
+    hwSets = {
+        hwName: {
+            'used': hw.get('used', 0),
+            'capacity': hw.get('capacity', 0),
+            'held': hw.get('user_usage', {}).get(username, 0)
+        }
+        for hwName, hw in existing.get('hwSets', {}).items()
+    }
+    results = []
+    for op in ops:
+        hwName, qty = op['hwName'], op['qty']
+        hw = hwSets.get(hwName)
+        if hw is None:
+            results.append(batchResult(op, 0, f"'{hwName}' not found in project '{projectName}'"))
+        elif op['action'] == 'checkout':
+            available = hw['capacity'] - hw['used']
+            if qty > available:
+                results.append(batchResult(
+                    op, 0, f"Not enough '{hwName}' available. Requested {qty}, only {available} left."
+                ))
+            else:
+                hw['used'] += qty
+                hw['held'] += qty
+                results.append(batchResult(op, qty, None))
+        else:
+            if hw['held'] <= 0:
+                results.append(batchResult(
+                    op, 0, f"User '{username}' has no '{hwName}' checked out in project '{projectName}'"
+                ))
+            else:
+                returned = min(qty, hw['held'])
+                hw['used'] = max(0, hw['used'] - returned)
+                hw['held'] -= returned
+                results.append(batchResult(op, returned, None))
+    return results
+
+
+def processedResult(op, processed, projectName, username):
+    # Result of an operation the storage engine applied on its own (sharded sets)
+    if processed:
+        return batchResult(op, processed, None)
+    if op['action'] == 'checkout':
+        return batchResult(op, 0, f"Not enough '{op['hwName']}' available. Requested {op['qty']}.")
+    return batchResult(
+        op, 0, f"User '{username}' has no '{op['hwName']}' checked out in project '{projectName}'"
+    )
+
+
+def batchFailure(existing, projectName, ops, username, atomic):
+    if not existing:
+        return (False, [], f"Project '{projectName}' not found.")
+    if username not in existing.get('users', []):
+        return (False, [], f"User '{username}' is not part of project '{projectName}'")
+    results = simulateBatch(existing, projectName, ops, username)
+    if atomic:
+        # Nothing was applied; report what would have failed
+        for r in results:
+            r['processedQty'] = 0
+        return (False, results, "Batch rejected; no operations were applied.")
+    return (False, results, None)
+
+
+def batchResult(op, processed, err):
+    return {
+        'action': op['action'],
+        'hwName': op['hwName'],
+        'qty': op['qty'],
+        'processedQty': processed,
+        'success': err is None,
+        'message': err
+    }
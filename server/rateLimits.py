@@ -0,0 +1,298 @@
+# rateLimits.py
+import collections
+import math
+import os
+import threading
+import time
+import sessionTokens
+from pymongo import ReturnDocument
+from mongoQueries import RATE_LIMITS_DATABASE, RATE_LIMITS_COLLECTION, tokenBucketUpdate
+
+'''
+Token-bucket rate limiting per route and client, for app.py (before_request)
+and asyncApp.py (RateLimitMiddleware).
+
+Every request takes its route's cost in tokens from one bucket per identity:
+the client IP and, when known, the user (from a valid session token). Routes
+in ACCOUNT_ROUTES (/user/login) take the user bucket themselves, for the
+username being logged in to, so each bucket is charged once per request. Buckets are keyed by
+(route, identity), hold RATE_LIMIT_CAPACITY tokens and refill at
+RATE_LIMIT_REFILL_PER_SECOND, so a client gets a burst of capacity / cost
+requests on a route and then refill / cost per second. Routes are named by
+their view function, as in metrics.py; expensive ones cost more:
+
+    login, register             10    bcrypt work and several queries
+    get_projects, check_inventory 5   collection scans
+    anything else                1    (RATE_LIMIT_DEFAULT_COST)
+    health, metrics, static files,
+    admin routes                 0    never limited
+
+Override with RATE_LIMIT_COSTS="login=20,get_hardware=0.5". A request that
+would overdraw a bucket gets 429 Too Many Requests with Retry-After set to
+when enough tokens will be back.
+
+Buckets live in this worker's memory: a lock, a dict lookup and some
+arithmetic per request, and no I/O. Each worker limits on its own, so with N
+workers a client can get up to N times the limit. With RATE_LIMIT_SHARED=1,
+routes costing at least RATE_LIMIT_SHARED_MIN_COST are also taken from a
+bucket in the storage engine (RateLimits.buckets on MongoDB, one atomic
+update) that all workers share; cheap routes stay in-process. If the shared
+store fails, requests are let through.
+
+Behind a proxy, set RATE_LIMIT_TRUSTED_PROXIES to the number of proxies that
+append to X-Forwarded-For (1 on Heroku); otherwise every client looks like
+the proxy.
+
+Environment variables:
+    RATE_LIMIT_ENABLED            0 turns limiting off          (default 1)
+    RATE_LIMIT_CAPACITY           bucket size in tokens         (default 60)
+    RATE_LIMIT_REFILL_PER_SECOND  tokens added per second       (default 20)
+    RATE_LIMIT_DEFAULT_COST       cost of unlisted routes       (default 1)
+    RATE_LIMIT_COSTS              route=cost overrides, comma separated
+    RATE_LIMIT_SHARED             1 = share expensive buckets   (default 0)
+    RATE_LIMIT_SHARED_MIN_COST    cheapest shared route         (default 5)
+    RATE_LIMIT_TRUSTED_PROXIES    proxies in X-Forwarded-For    (default 0)
+    RATE_LIMIT_MAX_KEYS           buckets kept per worker (LRU) (default 100000)
+'''
+
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+RATE_LIMIT_CAPACITY = float(os.environ.get('RATE_LIMIT_CAPACITY', 60))
+RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get('RATE_LIMIT_REFILL_PER_SECOND', 20))
+RATE_LIMIT_DEFAULT_COST = float(os.environ.get('RATE_LIMIT_DEFAULT_COST', 1))
+RATE_LIMIT_SHARED = os.environ.get('RATE_LIMIT_SHARED', '0') == '1'
+RATE_LIMIT_SHARED_MIN_COST = float(os.environ.get('RATE_LIMIT_SHARED_MIN_COST', 5))
+RATE_LIMIT_TRUSTED_PROXIES = int(os.environ.get('RATE_LIMIT_TRUSTED_PROXIES', 0))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+# Route (view function name) -> tokens per request
+ROUTE_COSTS = {
+    'login': 10,
+    'register': 10,
+    'refresh_token': 2,
+    'get_projects': 5,
+    'check_inventory': 5,
+    'get_user_projects_list': 2,
+    'get_user_projects': 2,
+    'create_project': 5,
+    'create_hardware': 2,
+    'get_hardware_utilization': 2,
+    'inventory_events': 2,
+    'health': 0,
+    'prometheus_metrics': 0,
+    'serve_react_routes': 0,
+    # Admin routes are behind ADMIN_TOKEN already
+    'bulk_import': 0,
+    'bulk_export': 0,
+    'ledger_entries': 0,
+    'ledger_state': 0,
+}
+# Routes that check the user bucket themselves, for the account named in the request
+ACCOUNT_ROUTES = frozenset({'login'})
+
+_lock = threading.Lock()
+_buckets = collections.OrderedDict()   # (route, kind, identity) -> [tokens, monotonic time], LRU order
+
+_stats = {
+    'allowed': 0,
+    'limited': 0,
+    'sharedChecks': 0,
+    'sharedErrors': 0
+}
+
+
+def _parseCosts(spec):
+    costs = {}
+    for part in spec.split(','):
+        route, _, cost = part.partition('=')
+        if route.strip() and cost.strip():
+            try:
+                costs[route.strip()] = float(cost)
+            except ValueError:
+                print(f"Ignoring rate limit cost '{part.strip()}': not a number")
+    return costs
+
+
+ROUTE_COSTS.update(_parseCosts(os.environ.get('RATE_LIMIT_COSTS', '')))
+
+
+def costOf(route):
+    # A cost above the capacity could never be paid; cap it
+    return min(ROUTE_COSTS.get(route, RATE_LIMIT_DEFAULT_COST), RATE_LIMIT_CAPACITY)
+
+
+def applies(route):
+    """False for routes that are never limited, so callers can skip working out identities."""
+    return RATE_LIMIT_ENABLED and costOf(route) > 0
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats['buckets'] = len(_buckets)
+    stats['enabled'] = RATE_LIMIT_ENABLED
+    stats['shared'] = RATE_LIMIT_SHARED
+    return stats
+
+
+# ============================================================
+# Identities
+# ============================================================
+def clientIp(remoteAddr, forwardedFor):
+    """The client address, trusting the last RATE_LIMIT_TRUSTED_PROXIES hops of X-Forwarded-For."""
+    if RATE_LIMIT_TRUSTED_PROXIES and forwardedFor:
+        hops = [hop.strip() for hop in forwardedFor.split(',') if hop.strip()]
+        if len(hops) >= RATE_LIMIT_TRUSTED_PROXIES:
+            return hops[-RATE_LIMIT_TRUSTED_PROXIES]
+    return remoteAddr or 'unknown'
+
+
+def tokenUser(authorization):
+    """Username of a valid session token in an Authorization header, else None."""
+    token = sessionTokens.tokenFromHeader(authorization)
+    if token is None:
+        return None
+    try:
+        # Refreshable tokens still identify their user
+        return sessionTokens.verifyToken(token, maxAge=sessionTokens.SESSION_REFRESH_WINDOW)['sub']
+    except sessionTokens.TokenError:
+        return None
+
+
+def identities(ip, username=None, route=None):
+    """Identities a request is limited by; ACCOUNT_ROUTES leave the user to the route."""
+    if username and route not in ACCOUNT_ROUTES:
+        return [('ip', ip), ('user', username)]
+    return [('ip', ip)]
+
+
+# ============================================================
+# Checks
+# ============================================================
+def check(route, idents, store=None):
+    """
+    Take route's cost from each identity's bucket. Returns None if allowed,
+    else the seconds until it would be (for Retry-After).
+    """
+    cost = costOf(route)
+    if not RATE_LIMIT_ENABLED or cost <= 0:
+        return None
+    keys = [(route, kind, identity) for kind, identity in idents]
+    wait = _takeLocal(keys, cost)
+    if wait is None and _isShared(cost, store):
+        for key in keys:
+            _countShared()
+            try:
+                allowed, tokens = store.takeTokens(_sharedKey(key), cost, RATE_LIMIT_CAPACITY,
+                                                   RATE_LIMIT_REFILL_PER_SECOND)
+            except Exception as e:
+                _sharedFailed(e)
+                break
+            if not allowed:
+                wait = _waitFor(tokens, cost)
+                break
+    return _count(wait)
+
+
+async def checkAsync(route, idents, client):
+    """check for asyncApp: the shared buckets go through Motor."""
+    cost = costOf(route)
+    if not RATE_LIMIT_ENABLED or cost <= 0:
+        return None
+    keys = [(route, kind, identity) for kind, identity in idents]
+    wait = _takeLocal(keys, cost)
+    if wait is None and _isShared(cost, client):
+        buckets = client[RATE_LIMITS_DATABASE][RATE_LIMITS_COLLECTION]
+        for key in keys:
+            _countShared()
+            try:
+                doc = await buckets.find_one_and_update(
+                    {'_id': _sharedKey(key)},
+                    tokenBucketUpdate(cost, RATE_LIMIT_CAPACITY, RATE_LIMIT_REFILL_PER_SECOND),
+                    projection={'allowed': 1, 'tokens': 1}, upsert=True, return_document=ReturnDocument.AFTER
+                )
+            except Exception as e:
+                _sharedFailed(e)
+                break
+            if not doc['allowed']:
+                wait = _waitFor(doc['tokens'], cost)
+                break
+    return _count(wait)
+
+
+def _takeLocal(keys, cost):
+    # All of the request's buckets or none of them
+    now = time.monotonic()
+    with _lock:
+        wait = None
+        buckets = []
+        for key in keys:
+            bucket = _buckets.get(key)
+            if bucket is None:
+                bucket = _buckets[key] = [RATE_LIMIT_CAPACITY, now]
+            else:
+                _buckets.move_to_end(key)
+                bucket[0] = min(RATE_LIMIT_CAPACITY, bucket[0] + (now - bucket[1]) * RATE_LIMIT_REFILL_PER_SECOND)
+                bucket[1] = now
+            if bucket[0] < cost:
+                wait = max(wait or 0, _waitFor(bucket[0], cost))
+            buckets.append(bucket)
+        if wait is None:
+            for bucket in buckets:
+                bucket[0] -= cost
+        # Evicting the least recently used buckets only forgets nearly full ones
+        while len(_buckets) > RATE_LIMIT_MAX_KEYS:
+            _buckets.popitem(last=False)
+    return wait
+
+
+def _waitFor(tokens, cost):
+    return (cost - tokens) / RATE_LIMIT_REFILL_PER_SECOND
+
+
+def _isShared(cost, store):
+    return RATE_LIMIT_SHARED and store is not None and cost >= RATE_LIMIT_SHARED_MIN_COST
+
+
+def _sharedKey(key):
+    return '|'.join(str(part) for part in key)
+
+
+def _countShared():
+    with _lock:
+        _stats['sharedChecks'] += 1
+
+
+def _sharedFailed(e):
+    # Fail open: a storage problem must not turn into rejected requests
+    with _lock:
+        _stats['sharedErrors'] += 1
+    print(f"Shared rate limit unavailable, allowing request: {e}")
+
+
+def _count(wait):
+    with _lock:
+        _stats['limited' if wait is not None else 'allowed'] += 1
+    return wait
+
+
+def retryAfter(wait):
+    """Retry-After header value (whole seconds, at least 1) for a wait from check."""
+    return str(max(1, math.ceil(wait)))
+
+
+def tooManyRequests(wait):
+    """JSON body for a 429 response."""
+    return {
+        'success': False,
+        'message': f"Too many requests. Please retry in {retryAfter(wait)} second(s)."
+    }
+
+
+def _resetAfterFork():
+    global _lock
+    _lock = threading.Lock()
+    _buckets.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)
@@ -0,0 +1,148 @@
+# sessionTokens.py
+import os
+import secrets
+import time
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+'''
+Signed, stateless session tokens.
+
+/user/login issues a token carrying the username and the names of the
+projects the user belongs to. Routes that act on a project (checkout,
+check-in, batch) verify the signature and the project claim in memory, so
+they need neither bcrypt nor a users lookup, and take the username from the
+token instead of trusting the request body. Requests without a token are
+refused unless REQUIRE_SESSION_TOKEN=0, which keeps the old behaviour of
+acting as the username in the body for clients that predate the tokens
+(testBackend.py).
+
+Tokens expire after SESSION_TTL seconds. POST /user/token/refresh swaps a
+token for a fresh one with re-read memberships; clients do that when a route
+answers with "tokenRefresh": true (expired token, or a project joined after
+login). Every token carries the time of the password login it descends from
+(auth_time), copied unchanged on refresh, so a chain of refreshes ends
+SESSION_REFRESH_WINDOW seconds after that login and the user logs in again.
+The storage engine still checks membership as part of every write, so a
+removal takes effect immediately regardless of the claims.
+
+Environment variables:
+    SESSION_SECRET           signing key, shared by all workers (gunicorn.conf.py
+                             generates one per deployment when unset)
+    SESSION_TTL              token lifetime in seconds              (default 900)
+    SESSION_REFRESH_WINDOW   how long after login tokens can be refreshed (default 43200)
+    REQUIRE_SESSION_TOKEN    0 = accept the body's username on project routes
+                             without a token (default 1, token required)
+'''
+
+SESSION_TTL = int(os.environ.get('SESSION_TTL', 900))
+SESSION_REFRESH_WINDOW = int(os.environ.get('SESSION_REFRESH_WINDOW', 43200))
+REQUIRE_SESSION_TOKEN = os.environ.get('REQUIRE_SESSION_TOKEN', '1') != '0'
+
+_SALT = 'session-token'
+
+
+class TokenError(Exception):
+    """Raised for a missing, forged or expired token."""
+
+    def __init__(self, message, expired=False):
+        super().__init__(message)
+        self.expired = expired
+
+
+def _secret():
+    secret = os.environ.get('SESSION_SECRET')
+    if not secret:
+        # Single-process fallback; tokens will not survive a restart
+        secret = secrets.token_hex(32)
+        os.environ['SESSION_SECRET'] = secret
+        print("SESSION_SECRET is not set; using a per-process key.")
+    return secret
+
+
+_serializer = None
+
+
+def _getSerializer():
+    global _serializer
+    if _serializer is None:
+        _serializer = URLSafeTimedSerializer(_secret(), salt=_SALT)
+    return _serializer
+
+
+# ============================================================
+# Issue / verify
+# ============================================================
+def issueToken(username, projects, authTime=None):
+    """
+    Sign a token for username with its project memberships as claims.
+    authTime is the login the session started with (default now, for a login).
+    """
+    if authTime is None:
+        authTime = int(time.time())
+    return _getSerializer().dumps({'sub': username, 'projects': sorted(projects), 'auth_time': authTime})
+
+
+def verifyToken(token, maxAge=SESSION_TTL):
+    """
+    Return the claims {'sub': username, 'projects': [...], 'auth_time'} of a
+    valid token. Raises TokenError (with expired=True if only the age is wrong).
+    """
+    try:
+        claims = _getSerializer().loads(token, max_age=maxAge)
+    except SignatureExpired:
+        raise TokenError("Session expired. Please refresh your token.", expired=True)
+    except BadSignature:
+        raise TokenError("Invalid session token.")
+    if not isinstance(claims, dict) or 'sub' not in claims:
+        raise TokenError("Invalid session token.")
+    return claims
+
+
+def verifyRefresh(token):
+    """
+    Return the claims of a token that may be exchanged for a fresh one: its
+    session's login was at most SESSION_REFRESH_WINDOW seconds ago. Raises TokenError.
+    """
+    claims = verifyToken(token, maxAge=SESSION_REFRESH_WINDOW)
+    authTime = claims.get('auth_time')
+    if not isinstance(authTime, int) or time.time() - authTime > SESSION_REFRESH_WINDOW:
+        raise TokenError("Session too old to refresh. Please log in again.")
+    return claims
+
+
+def tokenFromHeader(authorization):
+    """Extract the token from an 'Authorization: Bearer <token>' header value."""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def authorizeProject(authorization, projectName, bodyUsername):
+    """
+    Resolve who is acting on projectName.
+    Returns (username, None) or (None, (status, payload)) for the route to send.
+    Without a token the request is refused, or with REQUIRE_SESSION_TOKEN=0
+    the body's username is used.
+    """
+    token = tokenFromHeader(authorization)
+    if token is None:
+        if REQUIRE_SESSION_TOKEN:
+            return (None, (401, {'success': False, 'message': 'A session token is required.'}))
+        return (bodyUsername, None)
+
+    try:
+        claims = verifyToken(token)
+    except TokenError as e:
+        return (None, (401, {'success': False, 'message': str(e), 'tokenRefresh': e.expired}))
+
+    if projectName not in claims.get('projects', []):
+        # Possibly joined after the token was issued; a refresh re-reads memberships
+        return (None, (403, {
+            'success': False,
+            'message': f"User '{claims['sub']}' is not part of project '{projectName}'",
+            'tokenRefresh': True
+        }))
+    return (claims['sub'], None)
@@ -1,41 +1,60 @@
 """
 Simple Hardware Checkout System Backend
-Uses in-memory dictionary storage for rapid prototyping
+Uses the in-memory storage engine for rapid prototyping
 """
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from datetime import datetime
+from memoryStorage import MemoryStorage
+from passwordHasher import HasherBusy
+import usersDatabase as usersDB
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend communication
 
-# Simple in-memory storage (data lost when server restarts)
-users_db = {
-    # Pre-populated test users for immediate testing
-    "admin": {
-        "password": "password123",
-        "email": "admin@hardware.edu",
-        "projects": ["admin_project"],
-        "created_at": "2024-01-15T10:30:00Z"
-    },
-    "testuser": {
-        "password": "test123",
-        "email": "test@example.com", 
-        "projects": [],
-        "created_at": "2024-01-20T14:22:00Z"
-    }
+# Pre-populated test users for immediate testing
+TEST_USERS = {
+    "admin": {"password": "password123", "email": "admin@hardware.edu", "projects": ["admin_project"]},
+    "testuser": {"password": "test123", "email": "test@example.com", "projects": []}
 }
 
+
+# Simple in-memory storage (data lost when server restarts), with the same
+# semantics as the MongoDB-backed app: hashed passwords, unique usernames
+def new_store():
+    store = MemoryStorage()
+    for username, user in TEST_USERS.items():
+        usersDB.addUser(store, username, user["password"], user["email"])
+        for projectId in user["projects"]:
+            usersDB.joinProject(store, username, projectId)
+    return store
+
+
+# Built on first use: hashing at import time would re-run in every spawned
+# bcrypt worker process, which imports this module too
+store = None
+
+
+def get_store():
+    global store
+    if store is None:
+        store = new_store()
+    return store
+
+
+def list_users():
+    return list(get_store().exportDocs('users'))
+
 # Health check endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'Simple Hardware Checkout System API is running',
-        'total_users': len(users_db),
-        'available_test_users': list(users_db.keys())
+        'total_users': len(list_users()),
+        'available_test_users': list(TEST_USERS)
     }), 200
 
 # User registration endpoint
@@ -57,17 +76,12 @@ def register():
         if not password:
             return jsonify({'success': False, 'message': 'Password is required'}), 400
         
-        # Check if username already exists
-        if username in users_db:
-            return jsonify({'success': False, 'message': 'Username already exists'}), 409
-        
-        # Create new user
-        users_db[username] = {
-            'password': password,  # Plain text for simplicity (NOT for production!)
-            'email': email or None,
-            'projects': [],
-            'created_at': datetime.utcnow().isoformat() + 'Z'
-        }
+        # Create new user (the password is stored as a bcrypt hash)
+        success, err = usersDB.addUser(get_store(), username, password, email or None)
+        if err == usersDB.USERNAME_TAKEN:
+            return jsonify({'success': False, 'message': err}), 409
+        if not success:
+            return jsonify({'success': False, 'message': err or 'Registration failed'}), 500
         
         return jsonify({
             'success': True, 
@@ -78,6 +92,8 @@ def register():
             }
         }), 201
         
+    except HasherBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         print(f"Registration error: {str(e)}")
         return jsonify({'success': False, 'message': 'Registration failed'}), 500
@@ -98,22 +114,17 @@ def login():
         if not username or not password:
             return jsonify({'success': False, 'message': 'Username and password are required'}), 400
         
-        # Check if user exists
-        if username not in users_db:
+        # Verify credentials against the stored hash
+        if not usersDB.login(get_store(), username, password):
             return jsonify({'success': False, 'message': 'Invalid username or password'}), 401
         
-        user = users_db[username]
-        
-        # Verify password (plain text comparison)
-        if user['password'] != password:
-            return jsonify({'success': False, 'message': 'Invalid username or password'}), 401
+        user = usersDB.queryUser(get_store(), username)
         
         # Return user data (excluding password)
         user_data = {
             'username': username,
             'email': user.get('email'),
             'projects': user.get('projects', []),
-            'created_at': user.get('created_at'),
             'last_login': datetime.utcnow().isoformat() + 'Z'
         }
         
@@ -123,6 +134,8 @@ def login():
             'user': user_data
         }), 200
         
+    except HasherBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 503, {'Retry-After': str(e.retry_after)}
     except Exception as e:
         print(f"Login error: {str(e)}")
         return jsonify({'success': False, 'message': 'Authentication failed'}), 500
@@ -132,36 +145,35 @@ def login():
 def debug_users():
     # Return usernames only (hide passwords even in debug)
     user_list = []
-    for username, user_data in users_db.items():
+    for user_data in list_users():
         user_list.append({
-            'username': username,
-            'email': user_data.get('email', 'No email'),
-            'projects': user_data.get('projects', []),
-            'created_at': user_data.get('created_at', 'Unknown')
+            'username': user_data['username'],
+            'email': user_data.get('email') or 'No email',
+            'projects': user_data.get('projects', [])
         })
     
     return jsonify({
-        'total_users': len(users_db),
+        'total_users': len(user_list),
         'users': user_list
     }), 200
 
 # Endpoint to reset/clear all users (for testing)
 @app.route('/debug/reset', methods=['POST'])
 def reset_users():
-    global users_db
-    users_db = {}
+    global store
+    store = MemoryStorage()
     return jsonify({
         'success': True,
         'message': 'All users cleared',
-        'total_users': len(users_db)
+        'total_users': len(list_users())
     }), 200
 
 if __name__ == '__main__':
     print("🚀 Simple Hardware Checkout System - Backend")
     print("📍 Server running on: http://localhost:8000")  
-    print("💾 Using in-memory dictionary storage")
+    print("💾 Using the in-memory storage engine")
     print("👥 Pre-loaded test users:")
-    for username, user_data in users_db.items():
+    for username, user_data in TEST_USERS.items():
         print(f"   - {username} (password: {user_data['password']})")
     print("🔧 Debug endpoints:")
     print("   - GET /health - Server status")
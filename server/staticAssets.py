@@ -0,0 +1,193 @@
+# staticAssets.py
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+'''
+In-memory manifest of the React build (client/build) for serve_react_routes.
+
+The build directory is indexed once when the app starts: every file gets its
+content type, a strong ETag from its content hash and, for text assets,
+gzip (and brotli, if the brotli package is installed) variants. Variants
+shipped by the build (main.js.gz, main.js.br) are used as they are; the rest
+are compressed at startup. Files up to STATIC_MEMORY_MAX_BYTES are held in
+memory, index.html always is, so serving a request is a dict lookup with no
+filesystem calls.
+
+Fingerprinted files (static/js/main.1a2b3c4d.js) never change under the same
+name and are sent with a one-year immutable Cache-Control; everything else,
+index.html included, is revalidated with its ETag (304 Not Modified).
+
+A new build is picked up when the workers restart (every deploy does).
+
+Environment variables:
+    STATIC_MEMORY_MAX_BYTES   largest file kept in memory   (default 1 MiB)
+    STATIC_COMPRESS_MIN_BYTES smallest file worth compressing (default 1024)
+'''
+
+STATIC_MEMORY_MAX_BYTES = int(os.environ.get('STATIC_MEMORY_MAX_BYTES', 1024 * 1024))
+STATIC_COMPRESS_MIN_BYTES = int(os.environ.get('STATIC_COMPRESS_MIN_BYTES', 1024))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+# Content hash in the file name, as react-scripts emits them
+_FINGERPRINT = re.compile(r'\.[0-9a-f]{8,}\.')
+_COMPRESSIBLE_TYPES = (
+    'application/javascript', 'application/json', 'application/manifest+json',
+    'application/xml', 'image/svg+xml', 'text/javascript'
+)
+# Preferred order when the client accepts several
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class Asset:
+    __slots__ = ('path', 'contentType', 'etag', 'cacheControl', 'size', 'body', 'variants')
+
+    def __init__(self, path, contentType, etag, cacheControl, size, body):
+        self.path = path                  # absolute path on disk
+        self.contentType = contentType
+        self.etag = etag
+        self.cacheControl = cacheControl
+        self.size = size
+        self.body = body                  # bytes, or None to stream from disk
+        self.variants = {}                # encoding -> bytes
+
+
+class Manifest:
+    """Index of a build directory, keyed by URL path relative to its root."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.assets = {}
+        self.index = None
+        if os.path.isdir(self.root):
+            self._scan()
+        else:
+            print(f"Static build folder '{self.root}' not found; only the API is served.")
+
+    def _scan(self):
+        compressed = 0
+        for directory, _, files in os.walk(self.root):
+            names = set(files)
+            for name in files:
+                if name.endswith(('.gz', '.br')) and name[:-3] in names:
+                    continue
+                full = os.path.join(directory, name)
+                urlPath = os.path.relpath(full, self.root).replace(os.sep, '/')
+                asset = _loadAsset(full, name, names)
+                compressed += len(asset.variants)
+                self.assets[urlPath] = asset
+        self.index = self.assets.get('index.html')
+        if self.index is not None and self.index.body is None:
+            with open(self.index.path, 'rb') as f:
+                self.index.body = f.read()
+        print(f"Indexed {len(self.assets)} static files ({compressed} compressed variants) from '{self.root}'")
+
+    def lookup(self, path):
+        """Return the Asset for a URL path, index.html for anything else (SPA routing), or None."""
+        if path:
+            asset = self.assets.get(path)
+            if asset is not None:
+                return asset
+        return self.index
+
+
+def _loadAsset(full, name, siblings):
+    size = os.path.getsize(full)
+    contentType = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    with open(full, 'rb') as f:
+        content = f.read()
+    etag = '"' + hashlib.sha1(content).hexdigest()[:20] + '"'
+    cacheControl = IMMUTABLE if _FINGERPRINT.search(name) else REVALIDATE
+    asset = Asset(full, contentType, etag, cacheControl, size,
+                  content if size <= STATIC_MEMORY_MAX_BYTES else None)
+
+    for encoding, suffix in _ENCODINGS:
+        if name + suffix in siblings:
+            with open(full + suffix, 'rb') as f:
+                asset.variants[encoding] = f.read()
+    if _isCompressible(contentType) and size >= STATIC_COMPRESS_MIN_BYTES:
+        if 'gzip' not in asset.variants:
+            _addVariant(asset, 'gzip', gzip.compress(content, compresslevel=9, mtime=0))
+        if 'br' not in asset.variants and brotli is not None:
+            _addVariant(asset, 'br', brotli.compress(content))
+    return asset
+
+
+def _addVariant(asset, encoding, data):
+    # Not worth a Content-Encoding if it does not save anything
+    if len(data) < asset.size:
+        asset.variants[encoding] = data
+
+
+def _isCompressible(contentType):
+    return contentType.startswith('text/') or contentType in _COMPRESSIBLE_TYPES
+
+
+# ============================================================
+# Request handling (framework-neutral)
+# ============================================================
+def negotiate(asset, acceptEncoding):
+    """Pick the best variant the client accepts: 'br', 'gzip' or None (identity)."""
+    if not asset.variants or not acceptEncoding:
+        return None
+    accepted = {}
+    for part in acceptEncoding.split(','):
+        token, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token.strip().lower()] = q
+    for encoding, _ in _ENCODINGS:
+        if encoding in asset.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def respond(asset, acceptEncoding, ifNoneMatch):
+    """
+    Return (status, headers, body, filePath) for an asset. body is the bytes to
+    send; when it is None, stream filePath from disk (large uncompressed files).
+    """
+    encoding = negotiate(asset, acceptEncoding)
+    # A strong ETag must differ per encoding
+    etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+    headers = {
+        'ETag': etag,
+        'Cache-Control': asset.cacheControl,
+        'Vary': 'Accept-Encoding'
+    }
+    if ifNoneMatch and _etagMatches(ifNoneMatch, etag):
+        return (304, headers, b'', None)
+
+    headers['Content-Type'] = _withCharset(asset.contentType)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+        return (200, headers, asset.variants[encoding], None)
+    if asset.body is not None:
+        return (200, headers, asset.body, None)
+    return (200, headers, None, asset.path)
+
+
+def _etagMatches(ifNoneMatch, etag):
+    if ifNoneMatch.strip() == '*':
+        return True
+    return any(tag.strip().removeprefix('W/') == etag for tag in ifNoneMatch.split(','))
+
+
+def _withCharset(contentType):
+    if contentType.startswith('text/') or contentType == 'application/javascript':
+        return contentType + '; charset=utf-8'
+    return contentType
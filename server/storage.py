@@ -0,0 +1,271 @@
+# storage.py
+import os
+import threading
+
+'''
+Storage interface used by usersDatabase, projectsDatabase and HWDatabase.
+
+The database modules keep validation, messages and cache invalidation; every
+read or write goes through one of the methods below, so the same module code
+runs on either engine:
+
+    mongodb  MongoStorage (mongoStorage.py), the shared pooled MongoClient
+    memory   MemoryStorage (memoryStorage.py), thread-safe in-process tables;
+             no network hops, nothing persisted, one process only
+             (run gunicorn with WEB_CONCURRENCY=1)
+
+The engine is chosen with STORAGE_BACKEND (default mongodb). Conditional
+writes are atomic in both engines: a checkout that would exceed a project's
+capacity, or a reservation larger than what is left, never applies.
+
+Unique names (username, projectName, hwName) are enforced by both engines,
+which raise pymongo's DuplicateKeyError on a clash so callers handle a single
+exception type.
+'''
+
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongodb')
+
+# Kinds of records, as used by bulkData and the export routes
+KINDS = ('users', 'projects', 'hardware')
+
+
+class Storage:
+    """Operations the database modules need from an engine."""
+
+    name = None
+
+    # ---------------- lifecycle ----------------
+    def start(self):
+        """Prepare the engine in a freshly started worker (connect, indexes, watchers)."""
+        return True
+
+    def healthCheck(self):
+        """Return a dict with at least 'ok' and 'error'."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    # ---------------- users ----------------
+    def insertUser(self, doc):
+        """Insert a user document. Raises DuplicateKeyError if the username is taken."""
+        raise NotImplementedError
+
+    def findUser(self, username, fields=None):
+        """Return the user document (only the given fields, if any) or None."""
+        raise NotImplementedError
+
+    def replaceUserPassword(self, username, oldHash, newHash):
+        """Swap the stored hash only if it is still oldHash. Returns True if replaced."""
+        raise NotImplementedError
+
+    # ---------------- hardware ----------------
+    def insertHardware(self, doc):
+        """Insert a hardware set. Raises DuplicateKeyError if the name is taken."""
+        raise NotImplementedError
+
+    def findHardware(self, hwName):
+        raise NotImplementedError
+
+    def findHardwareMany(self, hwNames):
+        """Return {hwName: hardware set} for the names that exist."""
+        raise NotImplementedError
+
+    def listHardware(self):
+        raise NotImplementedError
+
+    def setAvailability(self, hwName, availability):
+        """Set availability clamped to [0, capacity]. Returns False if the set does not exist."""
+        raise NotImplementedError
+
+    # ---------------- projects ----------------
+    def insertProjectWithReservations(self, doc, amounts):
+        """
+        Deduct { hwName: qty } from global availability and insert the project,
+        all or nothing. Returns False if some set no longer has enough left.
+        Raises DuplicateKeyError if the project name is taken.
+        """
+        raise NotImplementedError
+
+    def findProject(self, projectName, hwNames=None):
+        """
+        Return the project with its users and hwSets, or None. With hwNames,
+        hwSets only holds those sets.
+        """
+        raise NotImplementedError
+
+    def iterProjects(self, after=None, limit=None, fields=None, member=None, hwName=None):
+        """
+        Yield projects in _id order with '_id' and the requested fields.
+        after is an ObjectId; member and hwName filter on membership and on
+        reserving that hardware set.
+        """
+        raise NotImplementedError
+
+    def projectUsage(self, includeProjects=True):
+        """
+        Per hardware set, summed over projects:
+            {'_id': hwName, 'reserved': int, 'checkedOut': int,
+             'projects': [{'projectName', 'reserved', 'checkedOut'}]}
+        sorted by hwName ('projects' only with includeProjects).
+        """
+        raise NotImplementedError
+
+    def addProjectUser(self, projectName, username):
+        """
+        Record membership on both sides, project.users and the user's projects
+        (if the user is registered), together. Returns True if either side
+        changed, False if already a member, None if the project does not exist.
+        """
+        raise NotImplementedError
+
+    def checkOut(self, projectName, hwName, qty, username, lease=None):
+        """
+        Add qty to the set's used and the user's usage if the user is a member
+        and used + qty <= capacity; with a lease (checkoutLeases.newLease), store
+        it in project.leases in the same write. Returns the updated set entry or None.
+        """
+        raise NotImplementedError
+
+    def checkIn(self, projectName, hwName, qty, username):
+        """
+        Return up to qty of what the user holds (held > 0 and a member), using
+        up the user's leases on the set by the amount returned, oldest first.
+        Returns the user's holding before the update, or None if nothing matched.
+        """
+        raise NotImplementedError
+
+    def applyBatch(self, projectName, ops, username, atomic):
+        """
+        Apply parsed batch operations (see projectsDatabase.applyHWBatch);
+        check-ins use up leases as in checkIn.
+        Atomic: all or nothing, returns True/False.
+        Best effort: returns the involved part of the project before the
+        update (users and hwSets), or None if the project/membership did not match.
+        Operations the engine applied one by one rather than in that single
+        update are listed under 'processed' ({operation index: units moved}).
+        """
+        raise NotImplementedError
+
+    # ---------------- leases ----------------
+    def iterLeases(self, dueBefore=None):
+        """Yield (projectName, lease) for leases expiring at or before dueBefore (None = all)."""
+        raise NotImplementedError
+
+    def returnLeases(self, leasesByProject):
+        """
+        Return the units of {projectName: [lease]}, clamped to what each user
+        holds, and remove those leases. Only leases still stored count, at
+        their stored qty; the rest were returned already or used up by
+        check-ins. Returns [(projectName, stored lease, units returned)].
+        """
+        raise NotImplementedError
+
+    # ---------------- ledger ----------------
+    def appendLedger(self, entries):
+        """Append ledger entries (see checkoutLedger); each gets an increasing _id."""
+        raise NotImplementedError
+
+    def findLedger(self, filters, after=None, before=None, limit=None):
+        """
+        Yield the entries matching filters ({field: value}) with after < _id <
+        before, oldest first, at most limit of them (None = all).
+        """
+        raise NotImplementedError
+
+    def saveLedgerSnapshot(self, header, projects):
+        """Store a snapshot: a header and one {'projectName', 'hwSets'} per project."""
+        raise NotImplementedError
+
+    def loadLedgerSnapshot(self, headerOnly=False):
+        """Return (header, [projects]) of the latest complete snapshot, or (None, [])."""
+        raise NotImplementedError
+
+    def claimLedgerSnapshot(self, slot):
+        """Claim the ledger snapshot for slot (a datetime). True for exactly one caller per slot."""
+        raise NotImplementedError
+
+    # ---------------- utilization rollups ----------------
+    def updateRollups(self, rows):
+        """
+        Upsert rollup buckets (see utilizationSeries): each row has 'key'
+        (granularity, hwName, projectName, start), 'inc', 'max', 'min' and
+        'set' field updates, and 'expiresAt' for new buckets (None = kept).
+        """
+        raise NotImplementedError
+
+    def findRollups(self, granularity, hwName, projectName, start, end):
+        """Return the buckets of one series with start <= bucket start <= end, oldest first."""
+        raise NotImplementedError
+
+    def findPreviousRollup(self, granularity, hwName, projectName, before):
+        """Return the latest bucket of the series with a level sample starting before `before`, or None."""
+        raise NotImplementedError
+
+    def claimSampleSlot(self, slot):
+        """Claim the utilization sample for slot (a datetime). True for exactly one caller per slot."""
+        raise NotImplementedError
+
+    # ---------------- rate limits ----------------
+    def takeTokens(self, key, cost, capacity, refillPerSecond):
+        """
+        Take cost from the token bucket key shared by all workers (see
+        rateLimits), refilling it first. Returns (allowed, tokens left).
+        """
+        raise NotImplementedError
+
+    # ---------------- change counters ----------------
+    def bumpVersion(self, kinds):
+        """Advance the change counter of each kind (see collectionVersions)."""
+        raise NotImplementedError
+
+    def getVersion(self, kind):
+        """Return the kind's change counter; it only ever grows."""
+        raise NotImplementedError
+
+    # ---------------- bulk ----------------
+    def bulkLoad(self, kind, docs, upsert=False):
+        """
+        Write many documents, continuing past failures. Returns a dict with
+        inserted, updated, duplicates and errors: [(index, message)].
+        """
+        raise NotImplementedError
+
+    def exportDocs(self, kind):
+        """Yield every document of a kind, sorted by its unique name, without _id."""
+        raise NotImplementedError
+
+
+# ============================================================
+# Process-wide engine
+# ============================================================
+_lock = threading.Lock()
+_storage = None
+
+
+def getStorage():
+    """Return this process's storage engine, chosen by STORAGE_BACKEND."""
+    global _storage
+    if _storage is not None:
+        return _storage
+    with _lock:
+        if _storage is None:
+            _storage = createStorage(STORAGE_BACKEND)
+        return _storage
+
+
+def createStorage(backend):
+    if backend == 'mongodb':
+        from mongoStorage import MongoStorage
+        return MongoStorage()
+    if backend == 'memory':
+        from memoryStorage import MemoryStorage
+        return MemoryStorage()
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected 'mongodb' or 'memory').")
+
+
+def setStorage(engine):
+    """Install an engine explicitly (tests, benchmarks, simple_app)."""
+    global _storage
+    with _lock:
+        _storage = engine
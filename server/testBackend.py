@@ -2,7 +2,10 @@ import requests
 import json
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
+# These calls send the username in the request body rather than a session
+# token, so start the server with REQUIRE_SESSION_TOKEN=0
 BASE_URL = "http://localhost:8001"
 ERROR_COUNT = 0
 
@@ -133,6 +136,45 @@ def checkoutHW(projectName, hwName, qty):
     return res
 
 
+def addProjectUser(projectName, username):
+    print_section(f"Add User '{username}' to Project '{projectName}'")
+    data = {"projectName": projectName, "username": username}
+    res = requests.post(f"{BASE_URL}/projects/addUser", json=data)
+    print("Status:", res.status_code)
+    return res
+
+
+def stressCheckout(projectName, hwName, username, capacity, attempts=200, workers=32):
+    """
+    Fire many concurrent single-unit checkouts at one hardware set and verify
+    the project never hands out more than its reserved capacity.
+    """
+    print_section(f"Stress: {attempts} concurrent checkouts of '{hwName}' (capacity {capacity})")
+    data = {"username": username, "projectName": projectName, "hwName": hwName, "qty": 1}
+
+    def attempt(_):
+        try:
+            res = requests.post(f"{BASE_URL}/projects/checkout", json=data)
+            return res.status_code == 200 and res.json().get("success")
+        except requests.exceptions.RequestException:
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        granted = sum(1 for ok in pool.map(attempt, range(attempts)) if ok)
+
+    res = requests.get(f"{BASE_URL}/projects")
+    projects = res.json().get("projects", [])
+    found = next((p for p in projects if p["projectName"] == projectName), None)
+    used = found["hwSets"][hwName]["used"] if found else None
+    user_used = found["hwSets"][hwName].get("user_usage", {}).get(username) if found else None
+
+    print(f"Granted {granted}/{attempts}, project used = {used}")
+    assert_condition(granted == min(attempts, capacity), f"Exactly {min(attempts, capacity)} checkouts granted")
+    assert_condition(used == granted, f"{projectName}/{hwName} used matches granted checkouts ({used})")
+    assert_condition(user_used == granted, f"{username} usage matches granted checkouts ({user_used})")
+    assert_condition(used is not None and used <= capacity, "No over-allocation")
+
+
 # ============ Test Flow ============
 
 def run_all_tests():
@@ -178,6 +220,11 @@ def run_all_tests():
         {"hwName": "HWSet2", "capacity": 50, "availability": 50}
     ])
 
+    # 8️⃣ Concurrent checkouts on one hot hardware set must not over-allocate
+    createProject("Stress Project", "Concurrent checkout stress test", {"HWSet2": 25})
+    addProjectUser("Stress Project", "stress_user")
+    stressCheckout("Stress Project", "HWSet2", "stress_user", capacity=25)
+
     # ✅ Final test summary
     if ERROR_COUNT == 0:
         print("\n🎉 ✅ ALL TESTS PASSED SUCCESSFULLY!\n")
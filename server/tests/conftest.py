@@ -0,0 +1,150 @@
+# conftest.py
+import os
+import sys
+import threading
+
+'''
+Shared fixtures for the server tests.
+
+The modules under test are the flat modules in server/, imported by name, so
+that directory goes on sys.path. Most tests run against a fresh MemoryStorage
+installed as the process's engine; the concurrency tests run MongoStorage's
+queries against mongomock. bcrypt runs inline at the lowest cost so the user
+tests stay fast. Run from server/:
+
+    python -m pytest -q
+'''
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('BCRYPT_WORKERS', '0')
+os.environ.setdefault('BCRYPT_ROUNDS', '4')
+os.environ.setdefault('SESSION_SECRET', 'test-secret')
+
+import pytest
+import checkoutLeases
+import dbClient
+import dbIndexes
+import hwCache
+import passwordHasher
+import rateLimits
+import storage
+from memoryStorage import MemoryStorage
+from pymongo import ReturnDocument
+from pymongo.errors import OperationFailure
+
+
+def _serialised(lock, method):
+    def call(*args, **kwargs):
+        with lock:
+            return method(*args, **kwargs)
+    return call
+
+
+def _findOneAndUpdate(lock, method):
+    # mongomock finds the updated document by running the filter again, which
+    # misses once the update stops a $expr headroom check from matching. The
+    # server returns the document it updated, so re-read that one by _id.
+    def call(self, filter, update, projection=None, return_document=ReturnDocument.BEFORE, **kwargs):
+        with lock:
+            if return_document != ReturnDocument.AFTER:
+                return method(self, filter, update, projection=projection, return_document=return_document, **kwargs)
+            before = method(self, filter, update, projection={'_id': 1},
+                            return_document=ReturnDocument.BEFORE, **kwargs)
+            return before and self.find_one({'_id': before['_id']}, projection)
+    return call
+
+
+def _withoutSort(method):
+    # pymongo 4.11+ hands bulk updates a sort option that mongomock 4.3 does not know
+    def call(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return call
+
+
+def _standalone(*args, **kwargs):
+    raise OperationFailure('Transaction numbers are only allowed on a replica set member or mongos', 20)
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """
+    A mongomock client standing in for a standalone server: no transactions,
+    and each single-document operation is applied atomically (mongomock
+    itself takes no locks), so concurrent tests exercise the queries rather
+    than the mock.
+    """
+    mongomock = pytest.importorskip('mongomock')
+    collection = mongomock.collection.Collection
+    lock = threading.RLock()
+    for name in ('find_one', 'insert_one', 'update_one'):
+        monkeypatch.setattr(collection, name, _serialised(lock, getattr(collection, name)))
+    monkeypatch.setattr(collection, 'find_one_and_update', _findOneAndUpdate(lock, collection.find_one_and_update))
+    monkeypatch.setattr(mongomock.MongoClient, 'start_session', _standalone)
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ('add_update', 'add_replace'):
+        monkeypatch.setattr(builder, name, _withoutSort(getattr(builder, name)))
+    passwordHasher._verify_cache.clear()
+    hwCache.invalidate()
+    client = mongomock.MongoClient()
+    # As at worker start: the unique indexes back the insert-and-catch creates
+    assert dbIndexes.ensureIndexes(client)
+    return client
+
+
+@pytest.fixture
+def store():
+    engine = MemoryStorage()
+    storage.setStorage(engine)
+    hwCache.invalidate()
+    passwordHasher._verify_cache.clear()
+    with checkoutLeases._cond:
+        checkoutLeases._heap.clear()
+        checkoutLeases._scheduled.clear()
+    rateLimits._buckets.clear()
+    yield engine
+    storage.setStorage(None)
+
+
+@pytest.fixture
+def mongoStore(mongo, monkeypatch):
+    """MongoStorage on the mongomock client, installed as the process's engine."""
+    from mongoStorage import MongoStorage
+    monkeypatch.setattr(dbClient, 'MONGODB_URI', 'mongodb://mongomock')
+    monkeypatch.setattr(dbClient, 'getClient', lambda: mongo)
+    engine = MongoStorage()
+    storage.setStorage(engine)
+    yield engine
+    storage.setStorage(None)
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    """Flask test client on the memory engine, without the background threads."""
+    import app
+    monkeypatch.setattr(app, '_started', True)
+    return app.app.test_client()
+
+
+@pytest.fixture
+def project(store):
+    """Hardware sets HW1 (100) and HW2 (50), and project 'p1' reserving 20 and 10, with member amy."""
+    import HWDatabase
+    import projectsDatabase
+    HWDatabase.createHardwareSet(store, 'HW1', 100)
+    HWDatabase.createHardwareSet(store, 'HW2', 50)
+    assert projectsDatabase.createProject(store, 'p1', 'test project', {'HW1': 20, 'HW2': 10}) == (True, None)
+    assert projectsDatabase.addProjectUser(store, 'p1', 'amy')
+    return 'p1'
+
+
+@pytest.fixture
+def asyncClient(mongo, monkeypatch):
+    """Starlette test client for asyncApp, on a Motor mock over the same mongomock client."""
+    mongomock_motor = pytest.importorskip('mongomock_motor')
+    from starlette.testclient import TestClient
+    import asyncApp
+    motor = mongomock_motor.AsyncMongoMockClient(mock_mongo_client=mongo)
+    monkeypatch.setattr(dbClient, 'MONGODB_URI', 'mongodb://mongomock')
+    monkeypatch.setattr(dbClient, 'getAsyncClient', lambda: motor)
+    return TestClient(asyncApp.app)
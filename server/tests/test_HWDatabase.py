@@ -0,0 +1,73 @@
+# test_HWDatabase.py
+import collectionVersions
+import hwCache
+import HWDatabase as hardwareDB
+
+
+def test_create_hardware_set(store):
+    assert hardwareDB.createHardwareSet(store, 'HW1', 100)
+    assert not hardwareDB.createHardwareSet(store, 'HW1', 5)
+    hwSet = hardwareDB.queryHardwareSet(store, 'HW1')
+    assert (hwSet['capacity'], hwSet['availability']) == (100, 100)
+    assert hardwareDB.queryHardwareSet(store, 'missing') is None
+
+
+def test_update_availability_is_clamped_to_capacity(store):
+    hardwareDB.createHardwareSet(store, 'HW1', 10)
+    assert hardwareDB.updateAvailability(store, 'HW1', 25)
+    assert hardwareDB.queryHardwareSet(store, 'HW1')['availability'] == 10
+    assert hardwareDB.updateAvailability(store, 'HW1', -3)
+    assert hardwareDB.queryHardwareSet(store, 'HW1')['availability'] == 0
+    assert not hardwareDB.updateAvailability(store, 'missing', 1)
+
+
+def test_query_hardware_sets_returns_only_existing_names(store):
+    hardwareDB.createHardwareSet(store, 'HW1', 10)
+    hardwareDB.createHardwareSet(store, 'HW2', 20)
+    found = hardwareDB.queryHardwareSets(store, ['HW2', 'HW3'])
+    assert list(found) == ['HW2']
+
+
+def test_hardware_list_follows_this_workers_writes(store):
+    hardwareDB.createHardwareSet(store, 'HW1', 10)
+    assert hardwareDB.getAllHwSets(store) == [{'hwName': 'HW1', 'capacity': 10, 'availability': 10}]
+    hits = hwCache.getStats()['hits']
+    assert hardwareDB.getAllHwSets(store)[0]['availability'] == 10
+    assert hwCache.getStats()['hits'] == hits + 1
+
+    hardwareDB.updateAvailability(store, 'HW1', 4)
+    assert hardwareDB.getAllHwSets(store)[0]['availability'] == 4
+
+
+def test_a_load_that_raced_an_invalidation_is_not_cached(store):
+    hit, _, generation = hwCache.lookup()
+    assert not hit
+    hwCache.invalidate()
+    hwCache.store(['stale'], generation)
+    assert not hwCache.lookup()[0]
+
+
+def test_hardware_list_follows_writes(store):
+    hardwareDB.createHardwareSet(store, 'HW1', 10)
+    version = store.getVersion('hardware')
+    assert hardwareDB.getAllHwSets(store, version) == [{'hwName': 'HW1', 'capacity': 10, 'availability': 10}]
+
+    hardwareDB.updateAvailability(store, 'HW1', 4)
+    assert store.getVersion('hardware') > version
+    assert hardwareDB.getAllHwSets(store, store.getVersion('hardware'))[0]['availability'] == 4
+
+
+def test_hardware_etag_changes_with_the_version(store):
+    hardwareDB.createHardwareSet(store, 'HW1', 10)
+    tag = collectionVersions.etag('hardware', store.getVersion('hardware'))
+    assert collectionVersions.notModified(tag, tag)
+    hardwareDB.createHardwareSet(store, 'HW2', 10)
+    assert not collectionVersions.notModified(tag, collectionVersions.etag('hardware', store.getVersion('hardware')))
+
+
+def test_unchanged_hardware_answers_304(store, client):
+    hardwareDB.createHardwareSet(store, 'HW1', 10)
+    tag = client.get('/hardware').headers['ETag']
+    assert client.get('/hardware', headers={'If-None-Match': tag}).status_code == 304
+    hardwareDB.updateAvailability(store, 'HW1', 4)
+    assert client.get('/hardware', headers={'If-None-Match': tag}).status_code == 200
@@ -0,0 +1,58 @@
+# test_asyncApp.py
+import pytest
+import passwordHasher
+import projectsDatabase as projectsDB
+import sessionTokens
+import HWDatabase as hardwareDB
+
+
+@pytest.fixture
+def project(mongoStore):
+    """Hardware set HW1 (100) and project 'p1' reserving 20 of it, with member amy, written by MongoStorage."""
+    assert hardwareDB.createHardwareSet(mongoStore, 'HW1', 100)
+    assert projectsDB.createProject(mongoStore, 'p1', 'test project', {'HW1': 20}) == (True, None)
+    assert projectsDB.addProjectUser(mongoStore, 'p1', 'amy')
+    return 'p1'
+
+
+def test_register_and_login(asyncClient):
+    body = {'username': 'amy', 'password': 'secret'}
+    assert asyncClient.post('/user/register', json=body).status_code == 200
+    assert asyncClient.post('/user/register', json=body).status_code == 400
+    login = asyncClient.post('/user/login', json=body).json()
+    assert login['success']
+    assert asyncClient.post('/user/login', json={**body, 'password': 'wrong'}).status_code == 401
+
+    # A refresh keeps the login time of the session
+    refreshed = asyncClient.post('/user/token/refresh', headers={'Authorization': f"Bearer {login['token']}"}).json()
+    assert sessionTokens.verifyToken(refreshed['token'])['auth_time'] == \
+        sessionTokens.verifyToken(login['token'])['auth_time']
+
+
+def test_busy_hasher_answers_503(asyncClient, monkeypatch):
+    monkeypatch.setattr(passwordHasher, '_slots', passwordHasher.threading.BoundedSemaphore(1))
+    passwordHasher._slots.acquire()
+    response = asyncClient.post('/user/register', json={'username': 'amy', 'password': 'secret'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(passwordHasher.RETRY_AFTER_SECONDS)
+
+
+def test_checkout_and_checkin_match_the_sync_module(mongo, asyncClient, project):
+    asyncClient.headers['Authorization'] = f"Bearer {sessionTokens.issueToken('amy', ['p1'])}"
+    body = {'projectName': 'p1', 'hwName': 'HW1'}
+    assert asyncClient.post('/projects/checkout', json={**body, 'qty': 15}).json()['processedQty'] == 15
+    response = asyncClient.post('/projects/checkout', json={**body, 'qty': 6})
+    assert response.status_code == 400
+    assert response.json()['message'] == "Not enough 'HW1' available. Requested 6, only 5 left."
+
+    assert asyncClient.post('/projects/checkin', json={**body, 'qty': 40}).json()['processedQty'] == 15
+    hwSet = mongo['Projects'].project.find_one({'projectName': 'p1'})['hwSets']['HW1']
+    assert hwSet == {'used': 0, 'capacity': 20, 'user_usage': {'amy': 0}}
+
+
+def test_create_project_reserves_from_the_pool(asyncClient, project):
+    body = {'projectName': 'p2', 'description': '', 'hwSets': {'HW1': 30}}
+    assert asyncClient.post('/projects/create', json=body).status_code == 200
+    assert asyncClient.post('/projects/create', json={**body, 'projectName': 'p3', 'hwSets': {'HW1': 51}}).status_code == 400
+    hardware = asyncClient.get('/hardware').json()
+    assert [(h['hwName'], h['availability']) for h in hardware['hardware']] == [('HW1', 50)]
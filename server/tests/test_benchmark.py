@@ -0,0 +1,33 @@
+# test_benchmark.py
+import benchmark
+
+
+def _result(p95Ms, throughputRps):
+    return {'scenarios': {'checkout': {'routes': {
+        'POST /projects/checkout': {'count': 10, 'p95Ms': p95Ms, 'throughputRps': throughputRps}
+    }}}, 'meta': {}}
+
+
+def test_percentile_is_nearest_rank():
+    samples = [0.1 * i for i in range(1, 11)]
+    assert benchmark.percentile(samples, 50) == samples[4]
+    assert benchmark.percentile(samples, 99) == samples[-1]
+    assert benchmark.percentile([], 95) is None
+
+
+def test_summary_counts_server_and_transport_errors():
+    recorder = benchmark.Recorder()
+    for status in (200, 200, 503):
+        recorder.record('GET /hardware', 0.01, status)
+    recorder.error('GET /projects', OSError('refused'))
+    summary = benchmark.summarize(recorder, wall=2.0)
+    hardware = summary['routes']['GET /hardware']
+    assert (hardware['count'], hardware['serverErrors'], hardware['statusCounts']) == (3, 1, {'200': 2, '503': 1})
+    assert summary['routes']['GET /projects'] == {'count': 0, 'transportErrors': 1}
+    assert summary['throughputRps'] == 1.5
+
+
+def test_compare_flags_slower_p95_and_lower_throughput():
+    assert benchmark.compare(_result(10, 100), _result(10.5, 98), threshold=10) == 0
+    assert benchmark.compare(_result(10, 100), _result(12, 100), threshold=10) == 1
+    assert benchmark.compare(_result(10, 100), _result(10, 80), threshold=10) == 1
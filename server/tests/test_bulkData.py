@@ -0,0 +1,47 @@
+# test_bulkData.py
+import json
+import bulkData
+import passwordHasher
+from memoryStorage import MemoryStorage
+
+
+def _last(progress):
+    return list(progress)[-1]
+
+
+def test_import_skips_duplicates_and_reports_bad_lines(store):
+    lines = [
+        json.dumps({'username': 'amy', 'password': 'secret'}),
+        json.dumps({'username': 'bob', 'passwordHash': 'stored-hash', 'projects': 'p1;p2'}),
+        'not json',
+        json.dumps({'username': 'amy', 'password': 'again'}),
+        json.dumps({'username': 'eve'}),
+    ]
+    done = _last(bulkData.importRecords(store, 'users', lines, batchSize=2))
+    assert (done['read'], done['inserted'], done['skipped'], done['failed']) == (5, 2, 1, 2)
+    assert done['done'] and len(done['errors']) == 2
+
+    assert passwordHasher.verifyPassword('secret', store.findUser('amy')['password'])[0]
+    bob = store.findUser('bob')
+    assert (bob['password'], bob['projects']) == ('stored-hash', ['p1', 'p2'])
+
+
+def test_upsert_replaces_by_name(store):
+    _last(bulkData.importRecords(store, 'hardware', ['{"hwName": "HW1", "capacity": 10}']))
+    done = _last(bulkData.importRecords(store, 'hardware', ['{"hwName": "HW1", "capacity": 20, "availability": 5}'],
+                                        mode='upsert'))
+    assert (done['inserted'], done['updated']) == (0, 1)
+    hwSet = store.findHardware('HW1')
+    assert (hwSet['capacity'], hwSet['availability']) == (20, 5)
+
+
+def test_csv_export_reads_back_in(store):
+    lines = ['projectName,description,hwSets,users', 'p1,demo,"{""HW1"": 5}",amy;bob']
+    assert _last(bulkData.importRecords(store, 'projects', lines, fmt='csv'))['inserted'] == 1
+    exported = ''.join(bulkData.exportRecords(store, 'projects', fmt='csv')).splitlines()
+    assert exported[0] == 'projectName,description,hwSets,users'
+
+    other = MemoryStorage()
+    _last(bulkData.importRecords(other, 'projects', exported, fmt='csv'))
+    project = other.findProject('p1')
+    assert (project['hwSets'], project['users']) == ({'HW1': {'used': 0, 'capacity': 5}}, ['amy', 'bob'])
@@ -0,0 +1,85 @@
+# test_checkoutLedger.py
+import datetime
+import time
+import pytest
+import checkoutLedger
+
+
+def _entry(action, hwName, username, qty, projectName='p1'):
+    return {'action': action, 'projectName': projectName, 'hwName': hwName, 'username': username, 'qty': qty}
+
+
+def test_replay_clamps_returns_to_what_the_user_holds():
+    state = checkoutLedger.replay({}, [
+        _entry('reserve', 'HW1', None, 10),
+        _entry('checkout', 'HW1', 'amy', 4),
+        _entry('checkout', 'HW1', 'bob', 3),
+        _entry('checkin', 'HW1', 'amy', 6),
+        _entry('leaseExpired', 'HW1', 'bob', 1),
+    ])
+    assert state == {'p1': {'HW1': {'capacity': 10, 'used': 2, 'user_usage': {'amy': 0, 'bob': 2}}}}
+
+
+def test_query_filters_and_pages(store):
+    store.appendLedger([
+        checkoutLedger.entry('checkout', 'p1', 'HW1', 'amy', 1),
+        checkoutLedger.entry('checkout', 'p1', 'HW2', 'bob', 2),
+        checkoutLedger.entry('checkin', 'p1', 'HW1', 'amy', 1),
+    ])
+    entries, cursor = checkoutLedger.query(store, {'username': 'amy'}, limit=1)
+    assert [e['action'] for e in entries] == ['checkout'] and cursor == entries[0]['id']
+    entries, cursor = checkoutLedger.query(store, {'username': 'amy'}, after=cursor, limit=1)
+    assert [e['action'] for e in entries] == ['checkin']
+    assert checkoutLedger.query(store, {'hwName': 'HW2'})[0][0]['qty'] == 2
+
+
+def test_query_rejects_bad_input(store):
+    with pytest.raises(ValueError):
+        checkoutLedger.query(store, {'colour': 'red'})
+    with pytest.raises(ValueError):
+        checkoutLedger.query(store, {}, since='yesterday')
+    with pytest.raises(ValueError):
+        checkoutLedger.query(store, {}, after='not-an-id')
+
+
+def test_record_skips_zero_quantities(store):
+    checkoutLedger.record(store, [checkoutLedger.entry('checkin', 'p1', 'HW1', 'amy', 0)])
+    assert list(store.findLedger({})) == []
+
+
+def test_snapshot_plus_tail_rebuilds_current_state(store, monkeypatch):
+    store.appendLedger([
+        checkoutLedger.entry('reserve', 'p1', 'HW1', None, 10),
+        checkoutLedger.entry('checkout', 'p1', 'HW1', 'amy', 6),
+    ])
+    # Snapshots cover whole seconds: once the clock moves on, both entries are settled
+    monkeypatch.setattr(checkoutLedger, 'LEDGER_SETTLE_SECONDS', 0)
+    time.sleep(1.1)
+    header = checkoutLedger.takeSnapshot(store)
+    assert header['entries'] == 2
+    # Nothing new settled: the same snapshot is kept
+    assert checkoutLedger.takeSnapshot(store)['_id'] == header['_id']
+
+    store.appendLedger([checkoutLedger.entry('checkin', 'p1', 'HW1', 'amy', 2)])
+    loaded, projects = store.loadLedgerSnapshot()
+    assert projects == [{'projectName': 'p1', 'hwSets': {'HW1': {'capacity': 10, 'used': 6, 'user_usage': {'amy': 6}}}}]
+    assert checkoutLedger.currentState(store)['p1']['HW1'] == {'capacity': 10, 'used': 4, 'user_usage': {'amy': 4}}
+
+
+def test_unsettled_entries_stay_in_the_tail(store):
+    store.appendLedger([checkoutLedger.entry('reserve', 'p1', 'HW1', None, 10)])
+    assert checkoutLedger.takeSnapshot(store)['entries'] == 0
+    assert checkoutLedger.currentState(store)['p1']['HW1']['capacity'] == 10
+
+
+def test_diff_reports_writes_made_around_the_ledger(store, project):
+    store.appendLedger([checkoutLedger.entry('checkout', 'p1', 'HW1', 'amy', 3)])
+    mismatches = checkoutLedger.diff(store, projectName='p1')
+    assert ('p1', 'HW1', 'used', 3, 0) in mismatches
+    assert ('p1', 'HW1', 'user_usage', {'amy': 3}, {}) in mismatches
+
+
+def test_each_snapshot_slot_is_claimed_once(store):
+    slot = datetime.datetime(2026, 1, 1, 12, tzinfo=datetime.timezone.utc)
+    later = slot + datetime.timedelta(hours=1)
+    assert [store.claimLedgerSnapshot(s) for s in (slot, slot, later, slot)] == [True, False, True, False]
@@ -0,0 +1,177 @@
+# test_counterShards.py
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from bson import ObjectId
+import counterShards
+import mongoStorage
+import projectsDatabase as projectsDB
+import HWDatabase as hardwareDB
+
+
+@pytest.fixture
+def shards(mongo):
+    coll = mongo[counterShards.SHARDS_DATABASE][counterShards.SHARDS_COLLECTION]
+    key = counterShards.projectKey('p1', 'HW1')
+    coll.insert_many(counterShards.newShards(key, 10, shards=3))
+    return coll, key
+
+
+def _free(coll):
+    return [doc['free'] for doc in coll.find({}).sort('shard', 1)]
+
+
+def test_split_spreads_the_remainder_over_the_first_shards():
+    assert counterShards.split(10, 3) == [4, 3, 3]
+    assert counterShards.split(2, 4) == [1, 1, 0, 0]
+    assert counterShards.split(-5, 2) == [0, 0]
+
+
+def test_new_shards_keep_existing_usage_on_shard_zero():
+    docs = counterShards.newShards(counterShards.hardwareKey('HW1'), 5, shards=2, usage={'amy': 3})
+    assert [(d['shard'], d['free'], d['usage']) for d in docs] == [(0, 3, {'amy': 3}), (1, 2, {})]
+
+
+def test_take_and_give_merge_across_shards(shards):
+    coll, key = shards
+    assert counterShards.take(coll, key, 3, 4, 'amy')
+    # No single shard holds 6 any more: the free units are gathered first
+    assert counterShards.take(coll, key, 3, 6, 'bob')
+    assert not counterShards.take(coll, key, 3, 1, 'amy')
+    assert counterShards.merge(coll, [key]) == {('projects', 'p1', 'HW1'): {'free': 0, 'usage': {'amy': 4, 'bob': 6}}}
+
+    # Returns are clamped to what the user holds
+    assert counterShards.give(coll, key, 3, 9, 'amy') == (4, 4)
+    merged = counterShards.merge(coll, [key])[('projects', 'p1', 'HW1')]
+    assert merged['free'] == 4
+    assert merged['usage'] == {'amy': 0, 'bob': 6}
+
+
+def test_rebalance_respreads_free_units(shards):
+    coll, key = shards
+    counterShards.take(coll, key, 3, 4, 'amy')
+    counterShards.give(coll, key, 3, 4, 'amy')
+    coll.update_many(key, {'$set': {'free': 0}})
+    coll.update_one({**key, 'shard': 2}, {'$set': {'free': 9}})
+    assert counterShards.rebalance(coll, key)
+    assert _free(coll) == [3, 3, 3]
+    assert not counterShards.rebalance(coll, key)
+
+
+def _interruptedMove(coll, key, credited):
+    # A stopped worker's move of 2 units from shard 0 to shard 1
+    donor, target = coll.find_one({**key, 'shard': 0}), coll.find_one({**key, 'shard': 1})
+    move = {'id': ObjectId(), 'to': target['_id'], 'amount': 2}
+    coll.update_one({'_id': donor['_id']}, {'$inc': {'free': -2}, '$set': {'moving': move}})
+    if credited:
+        coll.update_one({'_id': target['_id']}, {'$inc': {'free': 2}, '$push': {'received': move['id']}})
+
+
+@pytest.mark.parametrize('credited', [False, True])
+def test_interrupted_moves_are_counted_once_and_finished(shards, monkeypatch, credited):
+    coll, key = shards
+    monkeypatch.setattr(counterShards, '_transactions', False)
+    _interruptedMove(coll, key, credited)
+    assert counterShards.merge(coll, [key])[('projects', 'p1', 'HW1')]['free'] == 10
+    # Another worker's gather skips the donor while its move is in flight
+    assert counterShards.take(coll, key, 3, 6, 'amy')
+
+    assert counterShards.recoverMoves(coll, key) == 1
+    assert counterShards.merge(coll, [key])[('projects', 'p1', 'HW1')] == {'free': 4, 'usage': {'amy': 6}}
+    assert coll.count_documents({'$or': [{'moving': {'$exists': True}}, {'received.0': {'$exists': True}}]}) == 0
+    assert counterShards.recoverMoves(coll, key) == 0
+
+
+def test_moves_run_in_a_transaction_when_the_server_has_them(shards, mongo, monkeypatch):
+    coll, key = shards
+    transactions = []
+
+    class Session:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def with_transaction(self, callback):
+            transactions.append(callback)
+            return callback(None)
+
+    monkeypatch.setattr(counterShards, '_transactions', True)
+    monkeypatch.setattr(type(mongo), 'start_session', lambda self: Session())
+    coll.update_many(key, {'$set': {'free': 0}})
+    coll.update_one({**key, 'shard': 2}, {'$set': {'free': 9}})
+    assert counterShards.rebalance(coll, key)
+    assert _free(coll) == [3, 3, 3]
+    assert len(transactions) == 2
+    assert coll.count_documents({'moving': {'$exists': True}}) == 0
+
+
+def test_merge_of_no_keys_reads_nothing(shards):
+    coll, _ = shards
+    assert counterShards.merge(coll, []) == {}
+
+
+@pytest.fixture
+def shardedProject(mongoStore, monkeypatch):
+    """Project 'p1' on the MongoDB engine with 20 HW1 over 4 shards, with members amy and bob."""
+    monkeypatch.setattr(counterShards, 'COUNTER_SHARDS', 4)
+    monkeypatch.setattr(counterShards, '_known', {})
+    assert hardwareDB.createHardwareSet(mongoStore, 'HW1', 100)
+    assert projectsDB.createProject(mongoStore, 'p1', '', {'HW1': 20}) == (True, None)
+    for username in ('amy', 'bob'):
+        assert projectsDB.addProjectUser(mongoStore, 'p1', username)
+    return 'p1'
+
+
+def test_sharded_sets_are_merged_on_read(mongoStore, shardedProject):
+    assert hardwareDB.queryHardwareSet(mongoStore, 'HW1')['availability'] == 80
+    assert projectsDB.checkOutHW(mongoStore, 'p1', 'HW1', 15, 'amy') == (True, 15, None)
+    assert projectsDB.checkOutHW(mongoStore, 'p1', 'HW1', 6, 'bob')[0] is False
+    assert projectsDB.checkInHW(mongoStore, 'p1', 'HW1', 40, 'amy') == (True, 15, None)
+    hwSet = mongoStore.findProject('p1')['hwSets']['HW1']
+    assert (hwSet['capacity'], hwSet['used'], hwSet['user_usage']) == (20, 0, {'amy': 0})
+
+
+def test_best_effort_batch_reports_what_the_shards_moved(mongoStore, shardedProject, monkeypatch):
+    # The pipeline leaves sharded sets alone, and mongomock has no $type to run it
+    monkeypatch.setattr(mongoStorage, 'bestEffortBatchPipeline',
+                        lambda ops, username: [{'$set': {'projectName': '$projectName'}}])
+    take = counterShards.take
+
+    def racedTake(coll, key, shards, qty, username=None, session=None):
+        # bob checks out 10 between the batch's read and its first take
+        if username == 'amy' and not racedTake.raced:
+            racedTake.raced = True
+            assert take(coll, key, shards, 10, 'bob')
+        return take(coll, key, shards, qty, username, session)
+
+    racedTake.raced = False
+    monkeypatch.setattr(counterShards, 'take', racedTake)
+    ops = [{'action': 'checkout', 'hwName': 'HW1', 'qty': 15},
+           {'action': 'checkout', 'hwName': 'HW1', 'qty': 5},
+           {'action': 'checkin', 'hwName': 'HW1', 'qty': 40},
+           {'action': 'checkin', 'hwName': 'HW1', 'qty': 1}]
+    success, results, err = projectsDB.applyHWBatch(mongoStore, 'p1', ops, 'amy', 'bestEffort')
+    assert (success, err) == (False, None)
+    assert [(r['success'], r['processedQty']) for r in results] == [(False, 0), (True, 5), (True, 5), (False, 0)]
+    assert mongoStore.findProject('p1')['hwSets']['HW1']['user_usage'] == {'amy': 0, 'bob': 10}
+
+
+def test_concurrent_sharded_checkouts_never_oversubscribe(mongoStore, shardedProject):
+    users = ('amy', 'bob')
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            results = list(pool.map(
+                lambda i: projectsDB.checkOutHW(mongoStore, 'p1', 'HW1', 1 + i % 2, users[i % 2]), range(300)))
+    finally:
+        sys.setswitchinterval(interval)
+
+    hwSet = mongoStore.findProject('p1')['hwSets']['HW1']
+    granted = {user: sum(r[1] for i, r in enumerate(results) if users[i % 2] == user) for user in users}
+    assert hwSet['used'] <= hwSet['capacity']
+    assert hwSet['used'] == sum(granted.values())
+    assert {user: held for user, held in hwSet['user_usage'].items() if held} == \
+        {user: held for user, held in granted.items() if held}
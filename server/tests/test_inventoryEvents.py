@@ -0,0 +1,51 @@
+# test_inventoryEvents.py
+import pytest
+import inventoryEvents
+import projectsDatabase as projectsDB
+
+
+@pytest.fixture
+def subscription():
+    subscription = inventoryEvents.subscribe()
+    yield subscription
+    inventoryEvents.unsubscribe(subscription)
+
+
+def test_writes_publish_their_deltas(store, project, subscription):
+    projectsDB.checkOutHW(store, 'p1', 'HW1', 3, 'amy')
+    projectsDB.checkInHW(store, 'p1', 'HW1', 5, 'amy')
+    projectsDB.checkOutHW(store, 'p1', 'HW1', 30, 'amy')
+    events = [event for _, event in subscription.drain()]
+    assert events == [
+        {'type': 'checkout', 'projectName': 'p1', 'hwName': 'HW1', 'username': 'amy', 'qty': 3},
+        {'type': 'checkin', 'projectName': 'p1', 'hwName': 'HW1', 'username': 'amy', 'qty': 3},
+    ]
+
+
+def test_reconnect_replays_what_was_missed(subscription):
+    inventoryEvents.publish({'type': 'checkout', 'qty': 1})
+    inventoryEvents.publish({'type': 'checkout', 'qty': 2})
+    (firstId, _), (secondId, _) = subscription.drain()
+
+    resumed = inventoryEvents.subscribe(lastEventId=firstId)
+    try:
+        assert resumed.drain() == [(secondId, {'type': 'checkout', 'qty': 2})]
+    finally:
+        inventoryEvents.unsubscribe(resumed)
+
+    forgotten = inventoryEvents.subscribe(lastEventId='no-such-id')
+    try:
+        assert forgotten.drain() == [(None, inventoryEvents.RESYNC)]
+    finally:
+        inventoryEvents.unsubscribe(forgotten)
+
+
+def test_a_subscriber_that_falls_behind_is_told_to_resync(subscription, monkeypatch):
+    monkeypatch.setattr(inventoryEvents, 'EVENT_QUEUE_SIZE', 2)
+    for qty in range(3):
+        inventoryEvents.publish({'type': 'checkout', 'qty': qty})
+    assert subscription.drain() == [(None, inventoryEvents.RESYNC)]
+
+
+def test_events_are_framed_for_event_source():
+    assert inventoryEvents.formatEvent('7', {'type': 'resync'}) == 'id: 7\nevent: inventory\ndata: {"type":"resync"}\n\n'
@@ -0,0 +1,42 @@
+# test_metrics.py
+from types import SimpleNamespace
+import metrics
+
+
+def _event(request_id, database='Projects', name='find', collection='project', micros=1500):
+    return SimpleNamespace(
+        command={name: collection}, command_name=name, database_name=database,
+        connection_id=('localhost', 27017), request_id=request_id, duration_micros=micros
+    )
+
+
+def _value(text, line):
+    return next(int(l.rsplit(' ', 1)[1]) for l in text.splitlines() if l.startswith(line + ' '))
+
+
+def test_commands_are_attributed_to_the_request_that_issued_them():
+    listener = metrics.CommandListener()
+    started = metrics.startRequest()
+    listener.started(_event(1))
+    listener.succeeded(_event(1))
+    listener.started(_event(2, name='update'))
+    listener.failed(_event(2, name='update'))
+    metrics.finishRequest(started, 'test_handler', 'POST', 200)
+
+    text = metrics.render()
+    labels = 'handler="test_handler",database="Projects",collection="project"'
+    assert _value(text, f'mongodb_commands_total{{{labels},command="find"}}') >= 1
+    assert _value(text, f'mongodb_command_failures_total{{{labels},command="update"}}') >= 1
+    assert 'http_request_mongodb_round_trips_bucket{handler="test_handler",le="2"}' in text
+
+
+def test_routes_are_counted_by_handler_and_status(client):
+    line = 'http_requests_total{handler="get_hardware",method="GET",status="200"}'
+    before = metrics.render()
+    count = _value(before, line) if line + ' ' in before else 0
+    assert client.get('/hardware').status_code == 200
+
+    response = client.get('/metrics')
+    assert response.mimetype == 'text/plain'
+    assert _value(response.get_data(as_text=True), line) == count + 1
+    assert 'http_requests_in_flight 1' in response.get_data(as_text=True)
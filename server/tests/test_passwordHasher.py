@@ -0,0 +1,62 @@
+# test_passwordHasher.py
+import concurrent.futures
+import pytest
+import passwordHasher
+import usersDatabase as usersDB
+
+
+def test_hash_and_verify():
+    hashed = passwordHasher.hashPassword('secret')
+    assert passwordHasher.verifyPassword('secret', hashed) == (True, None)
+    assert passwordHasher.verifyPassword('wrong', hashed) == (False, None)
+
+
+def test_full_queue_raises_hasher_busy(monkeypatch):
+    monkeypatch.setattr(passwordHasher, '_slots', passwordHasher.threading.BoundedSemaphore(1))
+    passwordHasher._slots.acquire()
+    rejected = passwordHasher.getStats()['rejected']
+    with pytest.raises(passwordHasher.HasherBusy):
+        passwordHasher.submitHash('secret')
+    assert passwordHasher.getStats()['rejected'] == rejected + 1
+
+
+def _stalled(*args):
+    # A job that never finishes
+    return concurrent.futures.Future()
+
+
+def test_busy_hasher_answers_503_with_retry_after(store, client, monkeypatch):
+    usersDB.addUser(store, 'amy', 'secret')
+    monkeypatch.setattr(passwordHasher, '_slots', passwordHasher.threading.BoundedSemaphore(1))
+    passwordHasher._slots.acquire()
+    for path, username in (('/user/login', 'amy'), ('/user/register', 'bob')):
+        response = client.post(path, json={'username': username, 'password': 'secret'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == str(passwordHasher.RETRY_AFTER_SECONDS)
+
+
+def test_timed_out_verification_answers_503_not_401(store, client, monkeypatch):
+    usersDB.addUser(store, 'amy', 'secret')
+    monkeypatch.setattr(passwordHasher, 'submitVerify', _stalled)
+    monkeypatch.setattr(passwordHasher, 'JOB_TIMEOUT_SECONDS', 0.01)
+    unavailable = passwordHasher.getStats()['unavailable']
+    response = client.post('/user/login', json={'username': 'amy', 'password': 'secret'})
+    assert response.status_code == 503
+    assert 'Retry-After' in response.headers
+    assert passwordHasher.getStats()['unavailable'] == unavailable + 1
+
+
+def test_broken_pool_raises_hasher_unavailable(monkeypatch):
+    future = concurrent.futures.Future()
+    future.set_exception(concurrent.futures.process.BrokenProcessPool('worker died'))
+    monkeypatch.setattr(passwordHasher, 'submitHash', lambda password: future)
+    with pytest.raises(passwordHasher.HasherUnavailable):
+        passwordHasher.hashPassword('secret')
+
+
+def test_successful_verifications_are_cached():
+    hashed = passwordHasher.hashPassword('secret')
+    passwordHasher.verifyPassword('secret', hashed)
+    hits = passwordHasher.getStats()['cacheHits']
+    assert passwordHasher.verifyPassword('secret', hashed) == (True, None)
+    assert passwordHasher.getStats()['cacheHits'] == hits + 1
@@ -0,0 +1,258 @@
+# test_projectsDatabase.py
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import checkoutLeases
+import checkoutLedger
+import projectsDatabase as projectsDB
+import HWDatabase as hardwareDB
+
+
+def _hw(store, projectName, hwName):
+    return store.findProject(projectName)['hwSets'][hwName]
+
+
+def _actions(store):
+    return [(e['action'], e['hwName'], e['username'], e['qty']) for e in store.findLedger({})]
+
+
+# ============================================================
+# Creating projects
+# ============================================================
+def test_create_project_reserves_from_the_pool(store, project):
+    assert hardwareDB.queryHardwareSet(store, 'HW1')['availability'] == 80
+    assert hardwareDB.queryHardwareSet(store, 'HW2')['availability'] == 40
+    assert _hw(store, 'p1', 'HW1') == {'capacity': 20, 'used': 0}
+    assert ('reserve', 'HW1', None, 20) in _actions(store)
+
+
+def test_create_project_rejects_oversubscription_without_reserving(store, project):
+    ok, err = projectsDB.createProject(store, 'p2', '', {'HW1': 50, 'HW2': 41})
+    assert not ok
+    assert "Not enough 'HW2'" in err
+    assert hardwareDB.queryHardwareSet(store, 'HW1')['availability'] == 80
+    assert store.findProject('p2') is None
+
+
+def test_create_project_rejects_duplicate_names(store, project):
+    ok, err = projectsDB.createProject(store, 'p1', '', {'HW1': 1})
+    assert (ok, err) == (False, "Project 'p1' already exists.")
+    assert hardwareDB.queryHardwareSet(store, 'HW1')['availability'] == 80
+
+
+def test_add_project_user_reports_existing_members(store, project):
+    assert projectsDB.addProjectUser(store, 'p1', 'amy') is False
+    assert projectsDB.addProjectUser(store, 'missing', 'amy') is False
+    assert projectsDB.addProjectUser(store, 'p1', 'bob') is True
+    assert projectsDB.getMemberProjects(store, 'bob') == ['p1']
+
+
+# ============================================================
+# Check out / check in
+# ============================================================
+def test_checkout_and_checkin(store, project):
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', 15, 'amy') == (True, 15, None)
+    assert projectsDB.checkInHW(store, 'p1', 'HW1', 40, 'amy') == (True, 15, None)
+    assert _hw(store, 'p1', 'HW1')['used'] == 0
+    assert _actions(store)[-2:] == [('checkout', 'HW1', 'amy', 15), ('checkin', 'HW1', 'amy', 15)]
+
+
+def test_checkout_never_exceeds_capacity(store, project):
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', 15, 'amy')[0]
+    ok, processed, err = projectsDB.checkOutHW(store, 'p1', 'HW1', 6, 'amy')
+    assert (ok, processed) == (False, 0)
+    assert err == "Not enough 'HW1' available. Requested 6, only 5 left."
+
+
+def test_checkout_and_checkin_explain_failures(store, project):
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', 1, 'eve')[2] == "User 'eve' is not part of project 'p1'"
+    assert projectsDB.checkOutHW(store, 'p1', 'HW9', 1, 'amy')[2] == "'HW9' not found in project 'p1'"
+    assert projectsDB.checkOutHW(store, 'p9', 'HW1', 1, 'amy')[2] == "Project 'p9' not found."
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', 0, 'amy')[0] is False
+    assert projectsDB.checkInHW(store, 'p1', 'HW1', 1, 'amy')[2] == "User 'amy' has no 'HW1' checked out in project 'p1'"
+
+
+# ============================================================
+# Batches
+# ============================================================
+def test_atomic_batch_applies_all_or_nothing(store, project):
+    ops = [{'action': 'checkout', 'hwName': 'HW1', 'qty': 5}, {'action': 'checkout', 'hwName': 'HW2', 'qty': 11}]
+    ok, results, err = projectsDB.applyHWBatch(store, 'p1', ops, 'amy', 'atomic')
+    assert not ok and err == "Batch rejected; no operations were applied."
+    assert [r['processedQty'] for r in results] == [0, 0]
+    assert _hw(store, 'p1', 'HW1')['used'] == 0
+
+    ops[1]['qty'] = 10
+    ok, results, err = projectsDB.applyHWBatch(store, 'p1', ops, 'amy', 'atomic')
+    assert ok and err is None
+    assert (_hw(store, 'p1', 'HW1')['used'], _hw(store, 'p1', 'HW2')['used']) == (5, 10)
+
+
+def test_best_effort_batch_applies_each_operation_on_its_own(store, project):
+    ops = [
+        {'action': 'checkout', 'hwName': 'HW1', 'qty': 5},
+        {'action': 'checkout', 'hwName': 'HW2', 'qty': 11},
+        {'action': 'checkin', 'hwName': 'HW1', 'qty': 8},
+    ]
+    ok, results, err = projectsDB.applyHWBatch(store, 'p1', ops, 'amy', 'bestEffort')
+    assert not ok and err is None
+    assert [(r['success'], r['processedQty']) for r in results] == [(True, 5), (False, 0), (True, 5)]
+    assert _hw(store, 'p1', 'HW1')['used'] == 0
+
+
+def test_batch_validation(store, project):
+    checkout = {'action': 'checkout', 'hwName': 'HW1', 'qty': 1}
+    assert projectsDB.applyHWBatch(store, 'p1', [], 'amy', 'atomic')[0] is False
+    assert projectsDB.applyHWBatch(store, 'p1', [{**checkout, 'action': 'steal'}], 'amy', 'atomic')[0] is False
+    assert projectsDB.applyHWBatch(store, 'p1', [checkout], 'amy', 'sometimes')[0] is False
+    assert projectsDB.applyHWBatch(store, 'p1', [checkout], 'eve', 'atomic')[0] is False
+
+
+# ============================================================
+# Leases
+# ============================================================
+def _checkOutLeased(store, qty, seconds=60):
+    lease, err = checkoutLeases.newLease('HW1', 'amy', qty, seconds)
+    assert err is None
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', qty, 'amy', lease)[0]
+    return lease
+
+
+def test_expired_lease_returns_its_units(store, project):
+    _checkOutLeased(store, 5)
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', 3, 'amy')[0]
+    due = list(store.iterLeases())
+    assert checkoutLeases.expireLeases(store, due) == 1
+    assert _hw(store, 'p1', 'HW1')['used'] == 3
+    assert list(store.iterLeases()) == []
+    assert _actions(store)[-1] == ('leaseExpired', 'HW1', 'amy', 5)
+
+
+def test_checkin_uses_up_leases_oldest_first(store, project):
+    first = _checkOutLeased(store, 4, seconds=60)
+    second = _checkOutLeased(store, 4, seconds=120)
+    assert projectsDB.checkInHW(store, 'p1', 'HW1', 6, 'amy') == (True, 6, None)
+    left = {lease['leaseId']: lease['qty'] for _, lease in store.iterLeases()}
+    assert left == {second['leaseId']: 2}
+    assert first['leaseId'] not in left
+
+    # Units checked out again without a lease are not taken back on expiry
+    assert projectsDB.checkOutHW(store, 'p1', 'HW1', 6, 'amy')[0]
+    checkoutLeases.expireLeases(store, list(store.iterLeases()))
+    assert _hw(store, 'p1', 'HW1')['used'] == 6
+    assert _actions(store)[-1] == ('leaseExpired', 'HW1', 'amy', 2)
+
+
+def test_batch_checkin_uses_up_leases(store, project):
+    _checkOutLeased(store, 5)
+    ops = [{'action': 'checkin', 'hwName': 'HW1', 'qty': 5}, {'action': 'checkout', 'hwName': 'HW1', 'qty': 5}]
+    assert projectsDB.applyHWBatch(store, 'p1', ops, 'amy', 'atomic')[0]
+    assert list(store.iterLeases()) == []
+
+
+def test_lease_is_returned_once(store, project):
+    _checkOutLeased(store, 5)
+    due = list(store.iterLeases())
+    assert checkoutLeases.expireLeases(store, due) == 1
+    assert checkoutLeases.expireLeases(store, due) == 0
+    assert _hw(store, 'p1', 'HW1')['used'] == 0
+    assert [a for a in _actions(store) if a[0] == 'leaseExpired'] == [('leaseExpired', 'HW1', 'amy', 5)]
+
+
+def test_new_lease_validates_its_duration():
+    assert checkoutLeases.newLease('HW1', 'amy', 1, None) == (None, None)
+    assert checkoutLeases.newLease('HW1', 'amy', 1, 'soon')[1] == "leaseSeconds must be a positive integer."
+    assert checkoutLeases.newLease('HW1', 'amy', 1, 0)[1].startswith("leaseSeconds must be between 1")
+
+
+# ============================================================
+# Ledger against the stored projects
+# ============================================================
+def test_ledger_replay_matches_the_stored_projects(store, project):
+    projectsDB.checkOutHW(store, 'p1', 'HW1', 7, 'amy')
+    projectsDB.checkInHW(store, 'p1', 'HW1', 2, 'amy')
+    projectsDB.applyHWBatch(store, 'p1', [{'action': 'checkout', 'hwName': 'HW2', 'qty': 3}], 'amy', 'atomic')
+    state = checkoutLedger.currentState(store, 'p1')
+    assert state['p1']['HW1'] == {'capacity': 20, 'used': 5, 'user_usage': {'amy': 5}}
+    assert checkoutLedger.diff(store, state, 'p1') == []
+
+
+# ============================================================
+# Listing and inventory
+# ============================================================
+def test_projects_are_paged_by_cursor_with_fields_and_filters(store, project):
+    projectsDB.createProject(store, 'p2', '', {'HW2': 1})
+    projectsDB.createProject(store, 'p3', '', {'HW1': 1})
+    first = list(projectsDB.iterProjects(store, limit=2, fields=['projectName']))
+    assert [p for _, p in first] == [{'projectName': 'p1'}, {'projectName': 'p2'}]
+    rest = list(projectsDB.iterProjects(store, after=first[-1][0]))
+    assert [p['projectName'] for _, p in rest] == ['p3']
+    assert [p['projectName'] for _, p in projectsDB.iterProjects(store, hwName='HW2')] == ['p1', 'p2']
+
+    with pytest.raises(ValueError):
+        list(projectsDB.iterProjects(store, after='not-a-cursor'))
+    with pytest.raises(ValueError):
+        list(projectsDB.iterProjects(store, fields=['secret']))
+
+
+def test_inventory_totals_reservations_and_checkouts(store, project):
+    projectsDB.createProject(store, 'p2', '', {'HW1': 30})
+    projectsDB.checkOutHW(store, 'p1', 'HW1', 5, 'amy')
+
+    inventory = {entry['hwName']: entry for entry in projectsDB.getInventory(store)}
+    hw1 = inventory['HW1']
+    assert (hw1['capacity'], hw1['availability'], hw1['reserved'], hw1['checkedOut'], hw1['reservedIdle']) == \
+        (100, 50, 50, 5, 45)
+    assert sorted((p['projectName'], p['checkedOut']) for p in hw1['projects']) == [('p1', 5), ('p2', 0)]
+    assert 'projects' not in projectsDB.getInventory(store, includeProjects=False)[1]
+    assert inventory['HW2']['reserved'] == 10
+
+
+# ============================================================
+# Concurrency against the MongoDB queries
+# ============================================================
+def _concurrently(attempt, times=300):
+    # Switch threads as often as possible, so a read-then-write update would race
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            return list(pool.map(attempt, range(times)))
+    finally:
+        sys.setswitchinterval(interval)
+
+
+@pytest.fixture
+def mongoProject(mongoStore):
+    """Project 'p1' holding 20 HW1 on the MongoDB engine, with members amy and bob."""
+    assert hardwareDB.createHardwareSet(mongoStore, 'HW1', 100)
+    assert projectsDB.createProject(mongoStore, 'p1', '', {'HW1': 20}) == (True, None)
+    for username in ('amy', 'bob'):
+        assert projectsDB.addProjectUser(mongoStore, 'p1', username)
+    return 'p1'
+
+
+def test_concurrent_checkouts_never_oversubscribe(mongoStore, mongoProject):
+    # testBackend.stressCheckout, without a live server
+    users = ('amy', 'bob')
+    results = _concurrently(lambda i: projectsDB.checkOutHW(mongoStore, 'p1', 'HW1', 1 + i % 2, users[i % 2]))
+
+    hwSet = _hw(mongoStore, 'p1', 'HW1')
+    granted = {user: sum(r[1] for i, r in enumerate(results) if users[i % 2] == user) for user in users}
+    assert hwSet['used'] <= hwSet['capacity']
+    assert hwSet['used'] == sum(granted.values())
+    assert hwSet['user_usage'] == granted
+    assert all(ok or err.startswith("Not enough 'HW1'") for ok, _, err in results)
+
+
+def test_concurrent_checkins_return_each_unit_once(mongoStore, mongoProject):
+    assert projectsDB.checkOutHW(mongoStore, 'p1', 'HW1', 20, 'amy')[0]
+    results = _concurrently(lambda i: projectsDB.checkInHW(mongoStore, 'p1', 'HW1', 1, 'amy'))
+    assert sum(r[1] for r in results) == 20
+    assert _hw(mongoStore, 'p1', 'HW1') == {'capacity': 20, 'used': 0, 'user_usage': {'amy': 0}}
+
+
+def test_concurrent_creations_never_oversubscribe_the_pool(mongoStore, mongoProject):
+    results = _concurrently(lambda i: projectsDB.createProject(mongoStore, f'q{i}', '', {'HW1': 10}), 40)
+    assert sum(ok for ok, _ in results) == 8
+    assert hardwareDB.queryHardwareSet(mongoStore, 'HW1')['availability'] == 0
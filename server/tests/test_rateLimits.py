@@ -0,0 +1,98 @@
+# test_rateLimits.py
+import pytest
+import rateLimits
+import usersDatabase as usersDB
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A monotonic clock the test moves by hand."""
+    now = [1000.0]
+    monkeypatch.setattr(rateLimits.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_bucket_refills_over_time(store, clock, monkeypatch):
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_CAPACITY', 20)
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_REFILL_PER_SECOND', 10)
+    idents = rateLimits.identities('10.0.0.1')
+    assert rateLimits.check('login', idents) is None
+    assert rateLimits.check('login', idents) is None
+    # Empty: the next 10 tokens arrive in one second
+    assert rateLimits.check('login', idents) == pytest.approx(1.0)
+
+    clock[0] += 0.5
+    assert rateLimits.check('login', idents) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert rateLimits.check('login', idents) is None
+
+
+def test_a_request_takes_all_of_its_buckets_or_none(store, clock, monkeypatch):
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_CAPACITY', 10)
+    assert rateLimits.check('login', rateLimits.identities('10.0.0.1', 'amy')) is None
+    # amy's bucket is empty, so the new address is not charged either
+    assert rateLimits.check('login', rateLimits.identities('10.0.0.2', 'amy')) is not None
+    assert rateLimits._buckets[('login', 'ip', '10.0.0.2')][0] == 10
+
+
+def test_least_recently_used_buckets_are_evicted(store, clock, monkeypatch):
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_MAX_KEYS', 2)
+    for ip in ('a', 'b', 'a', 'c'):
+        rateLimits.check('register', rateLimits.identities(ip))
+    assert [key[2] for key in rateLimits._buckets] == ['a', 'c']
+
+
+def test_free_routes_are_never_limited(store):
+    assert not rateLimits.applies('health')
+    assert rateLimits.check('health', rateLimits.identities('10.0.0.1')) is None
+    assert rateLimits._buckets == {}
+
+
+def test_costs_and_client_addresses(monkeypatch):
+    assert rateLimits._parseCosts('login=20, get_hardware=0.5') == {'login': 20.0, 'get_hardware': 0.5}
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_TRUSTED_PROXIES', 1)
+    assert rateLimits.clientIp('10.0.0.9', '1.2.3.4, 5.6.7.8') == '5.6.7.8'
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_TRUSTED_PROXIES', 0)
+    assert rateLimits.clientIp('10.0.0.9', '1.2.3.4') == '10.0.0.9'
+
+
+def test_shared_buckets_in_the_storage_engine(store, clock, monkeypatch):
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_SHARED', True)
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_CAPACITY', 10)
+    idents = rateLimits.identities('10.0.0.1')
+    assert rateLimits.check('login', idents, store) is None
+    # Another worker's local bucket is full, but the shared one is not
+    rateLimits._buckets.clear()
+    assert rateLimits.check('login', idents, store) is not None
+
+
+def test_memory_engine_bounds_its_shared_buckets(store, monkeypatch):
+    import memoryStorage
+    monkeypatch.setattr(memoryStorage, 'RATE_LIMIT_MAX_KEYS', 2)
+    for key in ('a', 'b', 'a', 'c'):
+        store.takeTokens(key, 1, 5, 1)
+    assert list(store._tokenBuckets) == ['a', 'c']
+
+
+def test_login_charges_each_bucket_once(store, client):
+    usersDB.addUser(store, 'amy', 'secret')
+    token = client.post('/user/login', json={'username': 'amy', 'password': 'secret'}).get_json()['token']
+    rateLimits._buckets.clear()
+
+    client.post('/user/login', json={'username': 'amy', 'password': 'secret'},
+                headers={'Authorization': f'Bearer {token}'})
+    cost = rateLimits.costOf('login')
+    assert {key: bucket[0] for key, bucket in rateLimits._buckets.items()} == {
+        ('login', 'ip', '127.0.0.1'): pytest.approx(rateLimits.RATE_LIMIT_CAPACITY - cost, abs=0.1),
+        ('login', 'user', 'amy'): pytest.approx(rateLimits.RATE_LIMIT_CAPACITY - cost, abs=0.1),
+    }
+
+
+def test_limited_requests_get_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_CAPACITY', 10)
+    monkeypatch.setattr(rateLimits, 'RATE_LIMIT_REFILL_PER_SECOND', 2)
+    body = {'username': 'amy', 'password': 'secret'}
+    assert client.post('/user/register', json=body).status_code != 429
+    response = client.post('/user/register', json=body)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '5'
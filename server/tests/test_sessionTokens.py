@@ -0,0 +1,88 @@
+# test_sessionTokens.py
+import pytest
+import sessionTokens
+import usersDatabase as usersDB
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Move the signer's clock (itsdangerous reads time.time) by hand."""
+    now = [1_700_000_000.0]
+    monkeypatch.setattr('itsdangerous.timed.time.time', lambda: now[0])
+    return now
+
+
+def test_token_carries_user_and_projects(clock):
+    claims = sessionTokens.verifyToken(sessionTokens.issueToken('amy', ['p2', 'p1']))
+    assert claims == {'sub': 'amy', 'projects': ['p1', 'p2'], 'auth_time': int(clock[0])}
+
+
+def test_forged_and_expired_tokens_are_rejected(clock):
+    token = sessionTokens.issueToken('amy', [])
+    with pytest.raises(sessionTokens.TokenError) as forged:
+        sessionTokens.verifyToken(token[:-2] + 'xx')
+    assert not forged.value.expired
+
+    clock[0] += sessionTokens.SESSION_TTL + 1
+    with pytest.raises(sessionTokens.TokenError) as expired:
+        sessionTokens.verifyToken(token)
+    assert expired.value.expired
+    # Still inside the refresh window
+    assert sessionTokens.verifyToken(token, maxAge=sessionTokens.SESSION_REFRESH_WINDOW)['sub'] == 'amy'
+
+
+def test_token_from_header():
+    assert sessionTokens.tokenFromHeader('Bearer abc ') == 'abc'
+    assert sessionTokens.tokenFromHeader('Basic abc') is None
+    assert sessionTokens.tokenFromHeader(None) is None
+
+
+def test_authorize_project(monkeypatch):
+    token = sessionTokens.issueToken('amy', ['p1'])
+    assert sessionTokens.authorizeProject(f'Bearer {token}', 'p1', 'mallory') == ('amy', None)
+    username, (status, payload) = sessionTokens.authorizeProject(f'Bearer {token}', 'p2', None)
+    assert (username, status) == (None, 403)
+    assert sessionTokens.authorizeProject(None, 'p1', 'bob')[1][0] == 401
+    # Opted out for clients without tokens
+    monkeypatch.setattr(sessionTokens, 'REQUIRE_SESSION_TOKEN', False)
+    assert sessionTokens.authorizeProject(None, 'p1', 'bob') == ('bob', None)
+
+
+def test_project_routes_require_a_token_by_default(store, client, project):
+    body = {'username': 'amy', 'projectName': 'p1', 'hwName': 'HW1', 'qty': 1}
+    assert client.post('/projects/checkout', json=body).status_code == 401
+    assert store.findProject('p1')['hwSets']['HW1']['used'] == 0
+
+
+def test_refresh_reissues_an_expired_token_with_current_projects(store, client, project, clock):
+    usersDB.addUser(store, 'amy', 'secret')
+    usersDB.joinProject(store, 'amy', 'p1')
+    token = sessionTokens.issueToken('amy', [])
+
+    clock[0] += sessionTokens.SESSION_TTL + 1
+    response = client.post('/projects/checkout', json={'projectName': 'p1', 'hwName': 'HW1', 'qty': 1},
+                           headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401 and response.get_json()['tokenRefresh']
+
+    response = client.post('/user/token/refresh', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    refreshed = response.get_json()
+    assert refreshed['projects'] == ['p1']
+    assert sessionTokens.verifyToken(refreshed['token'])['projects'] == ['p1']
+
+    clock[0] += sessionTokens.SESSION_REFRESH_WINDOW
+    assert client.post('/user/token/refresh', headers={'Authorization': f'Bearer {token}'}).status_code == 401
+
+
+def test_refresh_chain_ends_a_window_after_login(store, client, clock):
+    usersDB.addUser(store, 'amy', 'secret')
+    token = sessionTokens.issueToken('amy', [])
+    statuses = []
+    for _ in range(6):
+        # Each token is refreshed well inside its own refresh window
+        clock[0] += sessionTokens.SESSION_REFRESH_WINDOW // 4
+        response = client.post('/user/token/refresh', headers={'Authorization': f'Bearer {token}'})
+        statuses.append(response.status_code)
+        if response.status_code == 200:
+            token = response.get_json()['token']
+    assert statuses == [200, 200, 200, 200, 401, 401]
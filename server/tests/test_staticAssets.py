@@ -0,0 +1,41 @@
+# test_staticAssets.py
+import gzip
+import pytest
+import staticAssets
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    (tmp_path / 'index.html').write_text('<html>' + 'x' * 2000 + '</html>')
+    js = tmp_path / 'static' / 'js'
+    js.mkdir(parents=True)
+    (js / 'main.1a2b3c4d.js').write_text('console.log(1);' * 200)
+    (tmp_path / 'logo.png').write_bytes(b'\x89PNG' + b'\0' * 2000)
+    return staticAssets.Manifest(str(tmp_path))
+
+
+def test_unknown_paths_get_index_html(manifest):
+    assert manifest.lookup('projects/p1') is manifest.index
+    assert manifest.lookup('') is manifest.index
+    assert manifest.lookup('logo.png').contentType == 'image/png'
+
+
+def test_fingerprinted_files_are_immutable(manifest):
+    assert manifest.lookup('static/js/main.1a2b3c4d.js').cacheControl == staticAssets.IMMUTABLE
+    assert manifest.index.cacheControl == staticAssets.REVALIDATE
+
+
+def test_text_is_served_compressed_with_its_own_etag(manifest):
+    status, headers, body, _ = staticAssets.respond(manifest.index, 'gzip, deflate', None)
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body).startswith(b'<html>')
+    assert headers['ETag'] == manifest.index.etag[:-1] + '-gzip"'
+    assert 'Content-Encoding' not in staticAssets.respond(manifest.lookup('logo.png'), 'gzip', None)[1]
+    assert staticAssets.negotiate(manifest.index, 'gzip;q=0') is None
+
+
+def test_matching_etag_answers_304(manifest):
+    _, headers, _, _ = staticAssets.respond(manifest.index, None, None)
+    assert staticAssets.respond(manifest.index, None, headers['ETag'])[0] == 304
+    assert staticAssets.respond(manifest.index, None, 'W/' + headers['ETag'])[0] == 304
+    assert staticAssets.respond(manifest.index, None, '"other"')[0] == 200
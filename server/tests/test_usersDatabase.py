@@ -0,0 +1,42 @@
+# test_usersDatabase.py
+import pytest
+import passwordHasher
+import projectsDatabase as projectsDB
+import usersDatabase as usersDB
+
+
+def test_add_user_hashes_the_password(store):
+    assert usersDB.addUser(store, 'amy', 'secret') == (True, None)
+    assert usersDB.addUser(store, 'amy', 'other') == (False, usersDB.USERNAME_TAKEN)
+    stored = usersDB.queryUser(store, 'amy')
+    assert stored['password'] != 'secret'
+    assert usersDB.usernameExists(store, 'amy')
+    assert not usersDB.usernameExists(store, 'bob')
+
+
+def test_login(store):
+    usersDB.addUser(store, 'amy', 'secret')
+    assert usersDB.login(store, 'amy', 'secret')
+    assert not usersDB.login(store, 'amy', 'wrong')
+    assert not usersDB.login(store, 'bob', 'secret')
+
+
+def test_login_raises_when_the_hasher_is_busy(store, monkeypatch):
+    usersDB.addUser(store, 'amy', 'secret')
+
+    def busy(password, hashed):
+        raise passwordHasher.HasherBusy()
+
+    monkeypatch.setattr(passwordHasher, 'verifyPassword', busy)
+    with pytest.raises(passwordHasher.HasherBusy):
+        usersDB.login(store, 'amy', 'secret')
+
+
+def test_join_project_records_both_sides(store, project):
+    usersDB.addUser(store, 'bob', 'secret')
+    assert usersDB.joinProject(store, 'bob', 'p1')
+    assert not usersDB.joinProject(store, 'bob', 'p1')
+    assert usersDB.getUserProjectsList(store, 'bob') == ['p1']
+    assert 'bob' in store.findProject('p1')['users']
+    assert projectsDB.getMemberProjects(store, 'bob') == ['p1']
+    assert usersDB.getUserProjectsList(store, 'nobody') == []
@@ -0,0 +1,57 @@
+# test_utilizationSeries.py
+import datetime
+import pytest
+import projectsDatabase as projectsDB
+import utilizationSeries
+
+
+@pytest.fixture(autouse=True)
+def pending():
+    # Movements noted by other tests' writes
+    utilizationSeries._pending.clear()
+
+
+def _minute(at):
+    return at.replace(second=0, microsecond=0)
+
+
+def test_movements_and_samples_make_up_the_minute(store, project):
+    projectsDB.checkOutHW(store, 'p1', 'HW1', 5, 'amy')
+    projectsDB.checkInHW(store, 'p1', 'HW1', 2, 'amy')
+    assert utilizationSeries.flush(store) == 6
+    now = datetime.datetime.now(datetime.timezone.utc)
+    assert utilizationSeries.sample(store, now.timestamp())
+    # Another worker lost the race for this sample slot
+    assert not utilizationSeries.sample(store, now.timestamp())
+
+    since = (now - datetime.timedelta(minutes=3)).isoformat()
+    chart = utilizationSeries.series(store, 'HW1', since=since, until=now.isoformat())
+    assert (chart['granularity'], chart['capacity'], len(chart['points'])) == ('minute', 100, 4)
+    point = chart['points'][-1]
+    assert point['start'] == _minute(now).isoformat()
+    assert (point['checkedOut'], point['checkedIn'], point['operations']) == (5, 2, 2)
+    assert (point['usedMax'], point['reserved'], point['utilization']) == (3, 20, 0.03)
+
+    perProject = utilizationSeries.series(store, 'HW1', 'p1', since=since, until=now.isoformat())
+    assert perProject['points'][-1]['utilization'] == 0.15
+
+
+def test_empty_buckets_carry_the_last_level_forward():
+    start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(minutes=2)
+    rows = [{'start': start, 'samples': 2, 'usedSum': 6, 'usedMax': 4, 'usedMin': 2, 'usedLast': 4, 'reserved': 10}]
+    chart = utilizationSeries.buildSeries('HW1', 'p1', 'minute', 60, start, end, rows, None, None)
+    assert [p['usedAvg'] for p in chart['points']] == [3.0, 4, 4]
+    assert [p['utilization'] for p in chart['points']] == [0.3, 0.4, 0.4]
+
+
+def test_range_picks_the_finest_granularity_that_fits():
+    now = datetime.datetime(2026, 1, 10, tzinfo=datetime.timezone.utc)
+    assert utilizationSeries.parseRange(now=now)[0] == 'minute'
+    assert utilizationSeries.parseRange(since='2026-01-01', until='2026-01-09')[0] == 'hour'
+    with pytest.raises(ValueError):
+        utilizationSeries.parseRange(since='2026-01-02', until='2026-01-01')
+    with pytest.raises(ValueError):
+        utilizationSeries.parseRange(since='2025-01-01', until='2026-01-01', granularity='minute')
+    with pytest.raises(ValueError):
+        utilizationSeries.parseRange(since='yesterday')
@@ -1,9 +1,9 @@
 # Import necessary libraries and modules
 import projectsDatabase as projectsDB
+import passwordHasher
 from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
 from typing import Optional
-from passlib.hash import bcrypt
-from passlib.context import CryptContext
 
 '''
 Structure of User entry:
@@ -21,12 +21,13 @@ class UserLogin(BaseModel):
     email: Optional[str] = None
     projects: Optional[list] = []
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+USERNAME_TAKEN = 'Username already exists'
 
 # Function to add a new user (registration)
-def addUser(db, username, password, email=None):
+def addUser(store, username, password, email=None):
     # Add a new user to the database
-    # Returns success status and message
+    # Returns (success, error message); uniqueness is enforced by the
+    # storage engine (username_unique index on MongoDB), so this is a single insert
 
     # Create user document
     user = UserLogin(
@@ -36,31 +37,30 @@ def addUser(db, username, password, email=None):
         projects=[]
     )
 
+    # Hash User Password (off the request thread, see passwordHasher);
+    # HasherBusy goes up to the route, which answers 503
+    hashed_pw = passwordHasher.hashPassword(user.password)
+
     try:
-        # Check if user already exists
-        existing = usernameExists(db, user.username)
-        if existing:
-            return False
-        
-        # Hash User Password
-        hashed_pw = pwd_context.hash(user.password)
         user_model_dump = user.model_dump()
         user_model_dump["password"] = hashed_pw
-        db.users.insert_one(user_model_dump)
-        return True
-    
+        store.insertUser(user_model_dump)
+        return (True, None)
+
+    except DuplicateKeyError:
+        return (False, USERNAME_TAKEN)
     except Exception as e:
         print(f"Error adding user: {e}")
-        return False
+        return (False, f"Error adding user: {e}")
 
 # Helper function to query a user by username
-def queryUser(db, username):
+def queryUser(store, username):
     # Query and return a user from the database
-    existing = db.users.find_one({"username": username})
+    existing = store.findUser(username)
     return existing
 
 # Function to log in a user
-def login(db, username, password, email=None):
+def login(store, username, password, email=None):
     # Authenticate a user and return login status
     # Returns user data if successful
 
@@ -74,23 +74,30 @@ def login(db, username, password, email=None):
 
     try:
         # Check database for user
-        existing = queryUser(db, user.username)
-        if not existing or not pwd_context.verify(user.password, existing["password"]):
+        existing = queryUser(store, user.username)
+        if not existing:
             return False
-        else:
-            return True
+
+        matches, new_hash = passwordHasher.verifyPassword(user.password, existing["password"])
+        if not matches:
+            return False
+
+        # Transparently upgrade hashes created with an outdated bcrypt cost
+        if new_hash:
+            store.replaceUserPassword(user.username, existing["password"], new_hash)
+        return True
 
     except Exception as e:
+        # Not a credentials problem (or HasherBusy): let the route answer 500 or 503 rather than 401
         print(f"Error during login: {e}")
-        return False
+        raise
 
 # Function to check if username already exists
-def usernameExists(db, username):
+def usernameExists(store, username):
     # Check if username is already taken
     # Returns True if exists, False if available
     try:
-        # Check in-memory storage
-        existing = db.users.find_one({"username": username})
+        existing = store.findUser(username, fields=['username'])
         if existing:
             return True
         return False
@@ -99,23 +106,15 @@ def usernameExists(db, username):
         return False
 
 # Function to add a user to a project
-def joinProject(db, username, projectId):
-    # Add a user to a specified project
-    existing = queryUser(db, username)
-    if existing:
-        if projectId not in existing['projects']:
-            existing['projects'].append(projectId)
-            db.users.update_one(
-                {'username': username},
-                {'$set': {'projects': existing['projects']}}
-            )
-            return True
-    return False
+def joinProject(store, username, projectId):
+    # Add a user to a specified project (no-op if already joined); projectId is
+    # the project's name. Recorded on both the user and the project.
+    return projectsDB.addProjectUser(store, projectId, username)
 
 # Function to get the list of projects for a user
-def getUserProjectsList(db, username):
+def getUserProjectsList(store, username):
     # Get and return the list of projects a user is part of
-    existing = queryUser(db, username)
+    existing = store.findUser(username, fields=['projects'])
     if existing:
         return existing['projects']
     else:
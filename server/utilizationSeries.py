@@ -0,0 +1,310 @@
+# utilizationSeries.py
+import datetime
+import os
+import threading
+import time
+from mongoQueries import ROLLUPS_DATABASE, ROLLUPS_COLLECTION, rollupQuery, previousRollupQuery
+
+'''
+Utilization time series per hardware set, overall and per project, kept as
+pre-aggregated minute / hour / day rollups (Utilization.rollups on MongoDB):
+
+    {'granularity': 'minute' | 'hour' | 'day', 'hwName',
+     'projectName': name | '*' (all projects), 'start': bucket start (UTC),
+     'checkedOut', 'checkedIn', 'operations',        movement totals
+     'samples', 'usedSum', 'usedMax', 'usedMin',     sampled units in use
+     'usedLast', 'reserved'}
+
+Movements: checkOutHW / checkInHW and batches note what they moved in this
+worker's memory (no database call on the request path); every
+UTILIZATION_FLUSH_SECONDS the totals are added to the three rollups of their
+minute with one unordered bulk upsert of $inc updates.
+
+Levels: once per UTILIZATION_SAMPLE_SECONDS one worker (whichever claims the
+slot first) reads the units in use per set and project with the inventory
+aggregation and folds that sample into the rollups ($inc / $max / $min).
+Lease expiries, imports and sharded sets are all reflected that way.
+
+A chart query reads one bucket per point through the rollup index, choosing
+the finest granularity with at most UTILIZATION_MAX_POINTS buckets in the
+range, so its cost does not depend on how much history is stored. Minute
+buckets expire after 7 days and hour buckets after 90 (TTL index); day
+buckets are kept. The in-memory engine keeps everything.
+
+Environment variables:
+    UTILIZATION_FLUSH_SECONDS   movement flush interval        (default 5)
+    UTILIZATION_SAMPLE_SECONDS  level sample interval          (default 60)
+    UTILIZATION_MAX_POINTS      most buckets one query returns (default 1500)
+'''
+
+UTILIZATION_FLUSH_SECONDS = float(os.environ.get('UTILIZATION_FLUSH_SECONDS', 5))
+UTILIZATION_SAMPLE_SECONDS = int(os.environ.get('UTILIZATION_SAMPLE_SECONDS', 60))
+UTILIZATION_MAX_POINTS = int(os.environ.get('UTILIZATION_MAX_POINTS', 1500))
+
+# granularity -> (bucket seconds, retention seconds or None), finest first
+GRANULARITIES = {
+    'minute': (60, 7 * 86400),
+    'hour': (3600, 90 * 86400),
+    'day': (86400, None),
+}
+ALL_PROJECTS = '*'
+DEFAULT_RANGE_SECONDS = 86400
+
+_lock = threading.Lock()
+_pending = {}         # (hwName, projectName, minute start) -> [checkedOut, checkedIn, operations]
+_thread = None
+
+_stats = {
+    'noted': 0,
+    'flushes': 0,
+    'rollupsWritten': 0,
+    'samples': 0
+}
+
+
+# ============================================================
+# Recording (request path: memory only)
+# ============================================================
+def note(entries):
+    """Count checkout/checkin ledger entries (checkoutLedger.entry) towards their minute."""
+    with _lock:
+        for e in entries:
+            if e['action'] not in ('checkout', 'checkin') or e['qty'] <= 0:
+                continue
+            minute = int(e['at'].timestamp()) // 60 * 60
+            column = 0 if e['action'] == 'checkout' else 1
+            for projectName in (e['projectName'], ALL_PROJECTS):
+                totals = _pending.setdefault((e['hwName'], projectName, minute), [0, 0, 0])
+                totals[column] += e['qty']
+                totals[2] += 1
+            _stats['noted'] += 1
+
+
+def getStats():
+    with _lock:
+        stats = dict(_stats)
+        stats['pending'] = len(_pending)
+    stats['running'] = _thread is not None and _thread.is_alive()
+    return stats
+
+
+def _rollups(hwName, projectName, timestamp, inc, maximum=None, minimum=None, last=None):
+    # One update per granularity for the buckets containing timestamp
+    rows = []
+    for granularity, (step, retention) in GRANULARITIES.items():
+        start = timestamp - timestamp % step
+        rows.append({
+            'key': {
+                'granularity': granularity,
+                'hwName': hwName,
+                'projectName': projectName,
+                'start': _datetime(start)
+            },
+            'inc': inc,
+            'max': maximum or {},
+            'min': minimum or {},
+            'set': last or {},
+            'expiresAt': _datetime(start + step + retention) if retention else None
+        })
+    return rows
+
+
+def _datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def flush(store):
+    """Write the noted movements to the rollups. Returns the number of rollup updates."""
+    global _pending
+    with _lock:
+        pending, _pending = _pending, {}
+    if not pending:
+        return 0
+    rows = []
+    for (hwName, projectName, minute), (checkedOut, checkedIn, operations) in pending.items():
+        inc = {'checkedOut': checkedOut, 'checkedIn': checkedIn, 'operations': operations}
+        rows.extend(_rollups(hwName, projectName, minute, inc))
+    try:
+        store.updateRollups(rows)
+    except Exception:
+        # Put the totals back for the next flush
+        with _lock:
+            for key, totals in pending.items():
+                current = _pending.setdefault(key, [0, 0, 0])
+                for i, value in enumerate(totals):
+                    current[i] += value
+        raise
+    with _lock:
+        _stats['flushes'] += 1
+        _stats['rollupsWritten'] += len(rows)
+    return len(rows)
+
+
+def sample(store, now=None):
+    """Fold the current units in use into the rollups, if this worker claims the slot. Returns True if it did."""
+    now = int(now if now is not None else time.time())
+    slot = now - now % UTILIZATION_SAMPLE_SECONDS
+    if not store.claimSampleSlot(_datetime(slot)):
+        return False
+    rows = []
+    for hw in store.projectUsage(includeProjects=True):
+        levels = [(ALL_PROJECTS, hw['checkedOut'], hw['reserved'])]
+        levels += [(p['projectName'], p['checkedOut'], p['reserved']) for p in hw.get('projects', [])]
+        for projectName, used, reserved in levels:
+            rows.extend(_rollups(
+                hw['_id'], projectName, slot,
+                inc={'samples': 1, 'usedSum': used},
+                maximum={'usedMax': used},
+                minimum={'usedMin': used},
+                last={'usedLast': used, 'reserved': reserved}
+            ))
+    if rows:
+        store.updateRollups(rows)
+    with _lock:
+        _stats['samples'] += 1
+        _stats['rollupsWritten'] += len(rows)
+    return True
+
+
+# ============================================================
+# Chart queries
+# ============================================================
+def parseRange(since=None, until=None, granularity=None, now=None):
+    """
+    Validate a chart range (ISO 8601 since/until, default the last day) and
+    pick the granularity. Returns (granularity, step, start, end) with start
+    and end aligned to buckets; raises ValueError.
+    """
+    end = _parseTime(until, 'until') if until else (now or datetime.datetime.now(datetime.timezone.utc))
+    start = _parseTime(since, 'since') if since else end - datetime.timedelta(seconds=DEFAULT_RANGE_SECONDS)
+    if start >= end:
+        raise ValueError("since must be before until.")
+    seconds = (end - start).total_seconds()
+
+    if granularity is None:
+        granularity = next(
+            (g for g, (step, _) in GRANULARITIES.items() if seconds / step <= UTILIZATION_MAX_POINTS), 'day'
+        )
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}.")
+    step = GRANULARITIES[granularity][0]
+    first = int(start.timestamp()) // step * step
+    last = int(end.timestamp()) // step * step
+    if (last - first) // step + 1 > UTILIZATION_MAX_POINTS:
+        raise ValueError(f"Range too long for {granularity} buckets (at most {UTILIZATION_MAX_POINTS}).")
+    return (granularity, step, _datetime(first), _datetime(last))
+
+
+def series(store, hwName, projectName=None, since=None, until=None, granularity=None):
+    """Chart data for hwName (or its use in projectName). Raises ValueError on bad input."""
+    granularity, step, start, end = parseRange(since, until, granularity)
+    projectName = projectName or ALL_PROJECTS
+    rows = store.findRollups(granularity, hwName, projectName, start, end)
+    previous = store.findPreviousRollup(granularity, hwName, projectName, start)
+    capacity = None
+    if projectName == ALL_PROJECTS:
+        hw = store.findHardware(hwName)
+        capacity = hw.get('capacity') if hw else None
+    return buildSeries(hwName, projectName, granularity, step, start, end, rows, previous, capacity)
+
+
+async def seriesAsync(client, hwName, projectName=None, since=None, until=None, granularity=None):
+    """Motor counterpart of series, for asyncApp."""
+    granularity, step, start, end = parseRange(since, until, granularity)
+    projectName = projectName or ALL_PROJECTS
+    rollups = client[ROLLUPS_DATABASE][ROLLUPS_COLLECTION]
+    rows = await rollups.find(rollupQuery(granularity, hwName, projectName, start, end)).sort('start', 1) \
+        .to_list(length=UTILIZATION_MAX_POINTS)
+    previous = await rollups.find_one(previousRollupQuery(granularity, hwName, projectName, start),
+                                      sort=[('start', -1)])
+    capacity = None
+    if projectName == ALL_PROJECTS:
+        hw = await client['Hardware'].Hardware_Sets.find_one({'hwName': hwName}, {'capacity': 1})
+        capacity = hw.get('capacity') if hw else None
+    return buildSeries(hwName, projectName, granularity, step, start, end, rows, previous, capacity)
+
+
+def buildSeries(hwName, projectName, granularity, step, start, end, rows, previous, capacity):
+    """One point per bucket from start to end; buckets without a sample carry the last level forward."""
+    byStart = {_aware(row['start']): row for row in rows}
+    level = previous.get('usedLast') if previous else None
+    reserved = previous.get('reserved') if previous else None
+    points = []
+    at = start
+    while at <= end:
+        row = byStart.get(at, {})
+        if row.get('samples'):
+            average = row['usedSum'] / row['samples']
+            used = {'usedAvg': round(average, 2), 'usedMax': row['usedMax'], 'usedMin': row['usedMin']}
+            level, reserved = row['usedLast'], row.get('reserved')
+        else:
+            average = level
+            used = {'usedAvg': level, 'usedMax': level, 'usedMin': level}
+        total = capacity if projectName == ALL_PROJECTS else reserved
+        points.append({
+            'start': at.isoformat(),
+            'checkedOut': row.get('checkedOut', 0),
+            'checkedIn': row.get('checkedIn', 0),
+            'operations': row.get('operations', 0),
+            **used,
+            'reserved': reserved,
+            'utilization': round(average / total, 4) if average is not None and total else None
+        })
+        at += datetime.timedelta(seconds=step)
+    return {
+        'hwName': hwName,
+        'projectName': None if projectName == ALL_PROJECTS else projectName,
+        'granularity': granularity,
+        'capacity': capacity,
+        'points': points
+    }
+
+
+def _parseTime(value, name):
+    try:
+        return _aware(datetime.datetime.fromisoformat(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an ISO 8601 date or time.")
+
+
+def _aware(at):
+    # pymongo returns naive UTC datetimes unless the client is tz_aware
+    return at if at.tzinfo is not None else at.replace(tzinfo=datetime.timezone.utc)
+
+
+# ============================================================
+# Background flush and sampling
+# ============================================================
+def start(store):
+    """Start the flush / sample thread. Call once per worker."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return False
+    _thread = threading.Thread(target=_run, args=(store,), name='utilization-rollups', daemon=True)
+    _thread.start()
+    return True
+
+
+def _run(store):
+    nextSample = time.time()
+    while True:
+        time.sleep(UTILIZATION_FLUSH_SECONDS)
+        try:
+            flush(store)
+            if time.time() >= nextSample:
+                sample(store)
+                nextSample = time.time() // UTILIZATION_SAMPLE_SECONDS * UTILIZATION_SAMPLE_SECONDS \
+                    + UTILIZATION_SAMPLE_SECONDS
+        except Exception as e:
+            print(f"Utilization rollup error: {e}")
+
+
+def _resetAfterFork():
+    global _lock, _thread
+    _lock = threading.Lock()
+    _pending.clear()
+    _thread = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetAfterFork)